@@ -1,32 +1,23 @@
 # https://dash.plotly.com/layout
 
 # https://opensource.com/article/18/1/step-step-guide-git
-import create_ff_standings
-import create_settings_data
+import time
+import pandas as pd
+import standings_snapshot
+import shared_standings_store
+import standings_notify
+import standings_db
+from standings_refresh import StandingsState, StandingsRefresher, standings_changed, refresh_interval
+from standings_table_cache import StandingsTableCache
 import dash
 import dash_table
 import dash_html_components as html
 import dash_core_components as dcc
-from dash.dependencies import Input, Output, State
+from dash.dependencies import Input, Output, State, ClientsideFunction
+from app_configs import (LEAGUE_ID, SEASON_ID, for_rank_metrics_by_week_range, CLIENTSIDE_TABLE, STANDINGS_SOURCE,
+                         STANDINGS_LISTEN)
 # import dash_bootstrap_components as dbc
 
-LEAGUE_ID = 48347143
-SEASON_ID = 2022
-
-for_rank_metrics_by_week_range = {'1-4': [['cum_total_wins', 'cum_score'], [False, False]],
-                                  '5-6': [['cum_all_play_wins', 'cum_score'], [False, False]],
-                                  '7-10': [['cum_total_wins', 'cum_score'], [False, False]]}
-
-df_standings = create_ff_standings.create_final_standings(rank_metrics_by_week_range=for_rank_metrics_by_week_range, 
-                                                          league_id=LEAGUE_ID, year=SEASON_ID)
-
-# Adding string versions of the score metrics so that they can be formatted correctly
-df_standings['cum_score_str'] = df_standings['cum_score'].map('{:,.2f}'.format)
-df_standings['cum_score_opp_str'] = df_standings['cum_score_opp'].map('{:,.2f}'.format)
-df_standings['cum_score_per_week_str'] = df_standings['cum_score_per_week'].map('{:,.2f}'.format)
-df_standings['cum_score_opp_per_week_str'] = df_standings['cum_score_opp_per_week'].map('{:,.2f}'.format)
-df_standings['cum_all_play_wins_per_week_str'] = df_standings['cum_all_play_wins_per_week'].map('{:,.1f}'.format)
-
 # Used to create names for the table displayed in the app
 dict_columns_w_table_names = {'standings': 'Rank', 'manual_nickname': 'Team', 'cum_score_str': 'Points Scored',
                               'cum_wlt': 'W-L-T', 'cum_all_play_wlt_int': 'All Play W-L-T',
@@ -48,7 +39,7 @@ dict_sort_table_variables = {'cum_wlt': 'cum_wins', 'cum_all_play_wlt_int': 'cum
 def create_df_for_standings_table(df_final, week_number, new_col_names=dict_columns_w_table_names, sort_dict=None):
     """ Create dataframe used in the dashboard """
     if sort_dict is None:
-        sort_dict = {'sort_values': ['standings'], 'sort_asc': ['True']}
+        sort_dict = {'sort_values': ['standings'], 'sort_asc': [True]}
 
     df_current_standings = df_final.loc[df_final['week_number'] == week_number]
 
@@ -65,18 +56,147 @@ def create_df_for_standings_table(df_final, week_number, new_col_names=dict_colu
     return df_current_standings
 
 
-# ensures the table only displays regular season standings
-# need to update this to more effectively assign week numbers
-try:
-    settings_data = create_settings_data.settingsData(SEASON_ID, LEAGUE_ID)
-    current_week_number = settings_data.currentMatchupPeriod - 1
-except:
-    current_week_number = 14
+def create_standings_state(df_final, week_number, generation=None, prior_state=None, from_week_number=None):
+    """
+    Returns the standings being served along with the precomputed table records used by the callbacks.
+    The records of the weeks before from_week_number are reused from prior_state
+    """
+
+    prior_cache = prior_state.table_cache if prior_state is not None else None
+    table_cache = StandingsTableCache(df_final, create_df_for_standings_table, dict_columns_w_table_names,
+                                      dict_sort_table_variables, prior_cache=prior_cache,
+                                      from_week_number=from_week_number)
+
+    return StandingsState(df_final, week_number, table_cache, generation=generation)
+
+
+def read_shared_standings_state(info):
+    """ Returns the standings state for a generation published to the shared store """
+
+    return create_standings_state(shared_store.read(info), info['current_week_number'],
+                                  generation=info['generation'])
+
+
+def build_standings_state():
+    """
+    Returns new standings or None if they haven't changed. They're mapped from the shared store
+    if another worker published them, otherwise they're rebuilt (from ESPN or the DB) once they're due
+    or as soon as db_pipeline says it loaded new scores
+    """
+
+    info = shared_store.generation_info()
+
+    # every worker hears each notification, but only the one holding the lock rebuilds for it
+    if info is not None:
+        changed_weeks.clear_built_since(info['built_at'])
+
+    if info is not None and info['generation'] != standings_state.generation:
+        return read_shared_standings_state(info)
+
+    if (changed_weeks.peek() is None and info is not None
+            and time.time() - info['built_at'] < refresh_interval()):
+        return None
+
+    with shared_store.lock() as locked:
+        # another worker is already rebuilding them
+        if not locked:
+            return None
+
+        # they may have been published while waiting on the lock
+        new_info = shared_store.generation_info()
+        if new_info != info:
+            changed_weeks.clear_built_since(new_info['built_at'])
+            return read_shared_standings_state(new_info)
+
+        # only the weeks that changed need read again from the DB (unless nothing has been built yet).
+        # They're marked as built when the rebuild started, so a change notified during it is picked up
+        # by the next one
+        prior_state = standings_state
+        built_at = time.time()
+        changed_week_number = changed_weeks.pop()
+        from_week_number = changed_week_number if STANDINGS_SOURCE == 'db' and len(prior_state.df_standings) > 0 \
+            else None
+
+        try:
+            df_final, week_number = standings_snapshot.build_standings(LEAGUE_ID, SEASON_ID,
+                                                                       for_rank_metrics_by_week_range,
+                                                                       source=STANDINGS_SOURCE,
+                                                                       from_week_number=from_week_number,
+                                                                       df_prior=prior_state.df_standings)
+        except Exception:
+            # rebuilt on the next try
+            if changed_week_number is not None:
+                changed_weeks.add(changed_week_number, changed_at=built_at)
+            raise
+
+        if not standings_changed(standings_state, df_final, week_number):
+            shared_store.mark_refreshed(info, built_at=built_at)
+            return None
+
+        generation = shared_store.publish(df_final, week_number, built_at=built_at)
 
-if current_week_number > 14:
-    current_week_number = 14
+    standings_snapshot.save_snapshot(df_final, week_number, LEAGUE_ID, SEASON_ID)
 
-df_for_standings_table = create_df_for_standings_table(df_standings, current_week_number)
+    return create_standings_state(df_final, week_number, generation=generation, prior_state=prior_state,
+                                  from_week_number=from_week_number)
+
+
+def swap_standings_state(new_state):
+    """ Serves new_state from now on. Callbacks already running keep the state they started with """
+    global standings_state
+
+    standings_state = new_state
+
+
+def boot_standings_state():
+    """
+    Returns the standings to serve on startup. The first worker to boot publishes them to the shared store,
+    from the snapshot written by the ETL (see standings_snapshot.py) if there is one so that the app can serve
+    right away without waiting on ESPN. Without one, empty standings are served until the refresher's first
+    build. The other workers just map them.
+    """
+
+    with shared_store.lock(blocking=True):
+        info = shared_store.generation_info()
+
+        if info is None:
+            snapshot = standings_snapshot.load_snapshot(LEAGUE_ID, SEASON_ID)
+
+            if snapshot is None:
+                snapshot = pd.DataFrame({'week_number': pd.Series(dtype='int64')}), 0
+
+            # marked as built at 0 so they're refreshed right away
+            shared_store.publish(*snapshot, built_at=0)
+
+            info = shared_store.generation_info()
+
+    return read_shared_standings_state(info)
+
+
+shared_store = shared_standings_store.SharedStandingsStore(LEAGUE_ID, SEASON_ID)
+changed_weeks = standings_notify.ChangedWeeks()
+standings_state = boot_standings_state()
+
+# workers check for standings published by the others more often than they're rebuilt
+standings_refresher = StandingsRefresher(build_standings_state, swap_standings_state,
+                                         interval=lambda: min(refresh_interval(),
+                                                              shared_standings_store.POLL_INTERVAL))
+standings_refresher.start()
+
+
+def on_standings_changed(week_number):
+    """ Queues the weeks db_pipeline loaded and wakes the refresher to rebuild them """
+
+    if STANDINGS_SOURCE == 'db':
+        standings_db.get_reader().invalidate(LEAGUE_ID, SEASON_ID)
+
+    changed_weeks.add(week_number)
+    standings_refresher.wake()
+
+
+if STANDINGS_LISTEN:
+    standings_listener = standings_notify.StandingsListener(LEAGUE_ID, SEASON_ID, on_standings_changed)
+    standings_listener.start()
 
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 # external_stylesheets = [dbc.themes.FLATLY]
@@ -85,143 +205,138 @@ app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
 # This is necessary for the Dash app to run in Heroku
 server = app.server
 
-standings_table_dropdown = dcc.Dropdown(
-    id='standings-table-dd',
-    options=[{'label': f"Week {week_number}", 'value': week_number}
-             for week_number in range(1, current_week_number + 1)],
-    value=current_week_number,
-    clearable=False,
-    style={
-        # 'width': '30%',
-        #    'margin-left': '-75px',
-        #    'margin-right': '0px',
-        #    'font_family': 'Arial',
-        #    'display': 'inline-block',
-        #    'verticalAlign': 'middle',
-        #    'text-align': 'center',
-
-        'width': '90px',
-        'font_family': 'Arial',
-        'display': 'inline-block',
-        'verticalAlign': 'middle',
-        'text-align': 'center',
-           }
-)
-
-standings_table = dash_table.DataTable(
-    id='standings-table',
-    columns=[{"name": i, "id": i} for i in df_for_standings_table.columns],
-    data=df_for_standings_table.to_dict('records'),
-    style_table={'maxWidth': '1000px',
-                 # 'maxWidth': '75%',
-                 'marginLeft': 'auto',
-                 'marginRight': 'auto'
-                 },
-    style_cell={'textAlign': 'center',
-                'padding': '7px',
-                'font_size': '16px',
-                'font_family': 'Arial'
-                },
-    style_header={'backgroundColor': 'purple',
-                  'fontWeight': 'bold',
-                  'color': 'gold',
-                  'font_size': '18px',
-                  'height': 'auto',
-                  'whiteSpace': 'normal'
-                  },
-    style_cell_conditional=[
-        {'if': {'column_id': 'Rank'},
-         'width': '10%'},
-        {'if': {'column_id': 'Team'},
-         'width': '13%'},
-        {'if': {'column_id': 'W-L-T'},
-         'width': '11%'},
-        {'if': {'column_id': 'Points Scored'},
-         'width': '11%'},
-        {'if': {'column_id': 'Points Against'},
-         'width': '11%'},
-        {'if': {'column_id': 'All Play W-L-T'},
-         'width': '11%'},
-        {'if': {'column_id': 'Points Scored/Week'},
-         'width': '11%'},
-        {'if': {'column_id': 'Points Against/Week'},
-         'width': '11%'},
-        {'if': {'column_id': 'All Play Wins/Week'},
-         'width': '11%'},
-    ],
-    sort_action='custom',
-    sort_mode='multi',
-    sort_by=[]
-)
-
-app.layout = html.Div(children=[
-    html.H4("Delt Fantasy Football Standings",
-            style={'textAlign': 'center',
-                   'font_family': 'Arial',
-                   'padding': '0px',
-                   }
-            ),
-
-    html.Div([html.H6("Choose Week: ",
-                      style={'display': 'inline-block',
-                             # 'marginLeft': 'auto', 'marginRight': 'auto',
-                             'verticalAlign': 'middle'
-                             }
-                      ),
-              standings_table_dropdown
-              ],
-             style={'textAlign': 'center',
-                    'verticalAlign': 'middle'
-                    # 'margin-right': '0px',
-                    # 'margin-left': '150px'
-
-                    # 'margin-right': 'auto',
-                    # 'margin-left': 'auto'
-                    # 'display': 'inline-block',
-                    # 'horizonatlAlign': 'middle',
-                    # 'width': '100%'
-                    }
-             ),
-
-    standings_table,
-])
-
-
-@app.callback(Output('standings-table', 'data'),
-              [Input('standings-table', 'sort_by'),
-               Input('standings-table-dd', 'value')])
-def sort_table_standings(sort_by, week_number, dict_sort_table_variables=dict_sort_table_variables):
-    # note that the sort_by property is a list of dictionaries with the following form:
-    # {'column_id': <column_name>, 'direction': <'ascending' or 'descending'>}
-
-    # create a list of the table's sort variables
-    initial_sort_values = [col['column_id'] for col in sort_by]
-
-    # break out the table name dictionary into lists containing the keys and values
-    keys_columns_w_table_names = list(dict_columns_w_table_names.keys())
-    values_columns_w_table_names = list(dict_columns_w_table_names.values())
-
-    # create a list containing the original dataframe names of the sort variables
-    converted_sort_values = []
-    for initial_sort_value in initial_sort_values:
-        converted_sort_value = keys_columns_w_table_names[values_columns_w_table_names.index(initial_sort_value)]
-        converted_sort_values.append(converted_sort_value)
-
-    # create lists of the current sort values and their associated directions
-    sort_asc = [col['direction'] == 'asc'for col in sort_by]
-    sort_values = [dict_sort_table_variables[converted_sort_value] if converted_sort_value
-                   in list(dict_sort_table_variables) else converted_sort_value
-                   for converted_sort_value in converted_sort_values]
-
-    sort_dict = {'sort_values': sort_values, 'sort_asc': sort_asc}
-
-    # create the standings table data sorted by the table's sort variables
-    if len(sort_values):
-        dff_for_standings_table = create_df_for_standings_table(df_standings, week_number, sort_dict=sort_dict)
-    else:
-        dff_for_standings_table = create_df_for_standings_table(df_standings, week_number)
-
-    return dff_for_standings_table.to_dict('records')
+
+def serve_layout():
+    """ Returns the app layout. This runs on every page load so it always reflects the latest standings """
+
+    state = standings_state
+    current_week_number = state.current_week_number
+
+    standings_table_dropdown = dcc.Dropdown(
+        id='standings-table-dd',
+        options=[{'label': f"Week {week_number}", 'value': week_number}
+                 for week_number in range(1, current_week_number + 1)],
+        value=current_week_number,
+        clearable=False,
+        style={
+            # 'width': '30%',
+            #    'margin-left': '-75px',
+            #    'margin-right': '0px',
+            #    'font_family': 'Arial',
+            #    'display': 'inline-block',
+            #    'verticalAlign': 'middle',
+            #    'text-align': 'center',
+
+            'width': '90px',
+            'font_family': 'Arial',
+            'display': 'inline-block',
+            'verticalAlign': 'middle',
+            'text-align': 'center',
+               }
+    )
+
+    standings_table = dash_table.DataTable(
+        id='standings-table',
+        columns=[{"name": i, "id": i} for i in state.table_cache.columns],
+        data=state.table_cache.records(current_week_number),
+        style_table={'maxWidth': '1000px',
+                     # 'maxWidth': '75%',
+                     'marginLeft': 'auto',
+                     'marginRight': 'auto'
+                     },
+        style_cell={'textAlign': 'center',
+                    'padding': '7px',
+                    'font_size': '16px',
+                    'font_family': 'Arial'
+                    },
+        style_header={'backgroundColor': 'purple',
+                      'fontWeight': 'bold',
+                      'color': 'gold',
+                      'font_size': '18px',
+                      'height': 'auto',
+                      'whiteSpace': 'normal'
+                      },
+        style_cell_conditional=[
+            {'if': {'column_id': 'Rank'},
+             'width': '10%'},
+            {'if': {'column_id': 'Team'},
+             'width': '13%'},
+            {'if': {'column_id': 'W-L-T'},
+             'width': '11%'},
+            {'if': {'column_id': 'Points Scored'},
+             'width': '11%'},
+            {'if': {'column_id': 'Points Against'},
+             'width': '11%'},
+            {'if': {'column_id': 'All Play W-L-T'},
+             'width': '11%'},
+            {'if': {'column_id': 'Points Scored/Week'},
+             'width': '11%'},
+            {'if': {'column_id': 'Points Against/Week'},
+             'width': '11%'},
+            {'if': {'column_id': 'All Play Wins/Week'},
+             'width': '11%'},
+        ],
+        sort_action='custom',
+        sort_mode='multi',
+        sort_by=[]
+    )
+
+    return html.Div(children=[
+        html.H4("Delt Fantasy Football Standings",
+                style={'textAlign': 'center',
+                       'font_family': 'Arial',
+                       'padding': '0px',
+                       }
+                ),
+
+        html.Div([html.H6("Choose Week: ",
+                          style={'display': 'inline-block',
+                                 # 'marginLeft': 'auto', 'marginRight': 'auto',
+                                 'verticalAlign': 'middle'
+                                 }
+                          ),
+                  standings_table_dropdown
+                  ],
+                 style={'textAlign': 'center',
+                        'verticalAlign': 'middle'
+                        # 'margin-right': '0px',
+                        # 'margin-left': '150px'
+
+                        # 'margin-right': 'auto',
+                        # 'margin-left': 'auto'
+                        # 'display': 'inline-block',
+                        # 'horizonatlAlign': 'middle',
+                        # 'width': '100%'
+                        }
+                 ),
+
+        standings_table,
+
+        # only used when the table is sorted in the browser
+        dcc.Store(id='standings-store',
+                  data=state.table_cache.clientside_data() if CLIENTSIDE_TABLE else None),
+    ])
+
+
+app.layout = serve_layout
+
+
+if CLIENTSIDE_TABLE:
+    # see assets/standings_table.js
+    app.clientside_callback(ClientsideFunction(namespace='standings', function_name='sort_table'),
+                            Output('standings-table', 'data'),
+                            [Input('standings-table', 'sort_by'),
+                             Input('standings-table-dd', 'value')],
+                            [State('standings-store', 'data')])
+else:
+    @app.callback(Output('standings-table', 'data'),
+                  [Input('standings-table', 'sort_by'),
+                   Input('standings-table-dd', 'value')])
+    def sort_table_standings(sort_by, week_number):
+        # note that the sort_by property is a list of dictionaries with the following form:
+        # {'column_id': <column_name>, 'direction': <'ascending' or 'descending'>}
+        # the records for every week/sort are precomputed or cached, so this is just a lookup
+        return standings_state.table_cache.records(week_number, sort_by)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,24 @@
+'''
+League/season the dashboard displays. Shared by the app and the scripts that build its data
+'''
+
+import os
+
+LEAGUE_ID = 48347143
+SEASON_ID = 2022
+
+for_rank_metrics_by_week_range = {'1-4': [['cum_total_wins', 'cum_score'], [False, False]],
+                                  '5-6': [['cum_all_play_wins', 'cum_score'], [False, False]],
+                                  '7-10': [['cum_total_wins', 'cum_score'], [False, False]]}
+
+# Sort the standings table and switch weeks in the browser rather than through a server callback.
+# The whole season is sent with the layout, which is small (a row per team per week)
+CLIENTSIDE_TABLE = os.environ.get('CLIENTSIDE_TABLE', 'false').lower() == 'true'
+
+# Where the app gets its standings - 'espn' calculates them from the API and 'db' reads the ones
+# db_pipeline loaded into the SCORES table (DATABASE_URL needs to be set)
+STANDINGS_SOURCE = os.environ.get('STANDINGS_SOURCE', 'espn')
+
+# Rebuild the standings as soon as db_pipeline loads new scores rather than waiting for the next
+# refresh. Each worker LISTENs for them on its own connection (DATABASE_URL needs to be set)
+STANDINGS_LISTEN = os.environ.get('STANDINGS_LISTEN', 'false').lower() == 'true'
@@ -0,0 +1,50 @@
+// Sorts the standings table and switches weeks in the browser when the app runs with CLIENTSIDE_TABLE.
+// The data comes from StandingsTableCache.clientside_data, which is sent once with the layout.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    standings: {
+        sort_table: function(sort_by, week_number, store) {
+            var week = store.weeks[String(week_number)];
+            if (!week) {
+                return [];
+            }
+
+            var columns = store.columns;
+            var order = week.rows.map(function(row, i) { return i; });
+
+            // the rows are already in standings order and Array.sort is stable, so ties stay in that order
+            if (sort_by && sort_by.length) {
+                var sort_specs = sort_by.map(function(col) {
+                    return {index: columns.indexOf(col.column_id), sign: col.direction === 'asc' ? 1 : -1};
+                });
+
+                order.sort(function(a, b) {
+                    for (var i = 0; i < sort_specs.length; i++) {
+                        var key_a = week.keys[a][sort_specs[i].index];
+                        var key_b = week.keys[b][sort_specs[i].index];
+
+                        if (key_a === key_b) {
+                            continue;
+                        }
+
+                        var compare = (typeof key_a === 'number' && typeof key_b === 'number')
+                            ? key_a - key_b
+                            : String(key_a).localeCompare(String(key_b));
+
+                        return compare * sort_specs[i].sign;
+                    }
+
+                    return 0;
+                });
+            }
+
+            return order.map(function(i) {
+                var record = {};
+                for (var j = 0; j < columns.length; j++) {
+                    record[columns[j]] = week.rows[i][j];
+                }
+
+                return record;
+            });
+        }
+    }
+});
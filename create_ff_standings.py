@@ -262,6 +262,82 @@ def add_update_additional_metrics(df_matchup_data):
     return df_matchup_data
 
 
+def compile_tier_plan(rank_metrics_by_week_range):
+    """
+    Returns a list of (rank_lower, rank_upper, rank_metrics, ascending) tuples - one for each
+    tier of rank_metrics_by_week_range - so the ranges are only parsed once per season
+    """
+
+    tier_plan = []
+    for rank_range, rank_sort_list in rank_metrics_by_week_range.items():
+        rank_range_lower = int(rank_range[0:rank_range.find('-')].strip())
+        rank_range_upper = int(rank_range[rank_range.find('-') + 1:].strip())
+
+        rank_metric_list = list(rank_sort_list[0])
+        ascending_indicator_list = list(rank_sort_list[1])
+
+        tier_plan.append((rank_range_lower, rank_range_upper, rank_metric_list, ascending_indicator_list))
+
+    return tier_plan
+
+
+def _sort_key(values, ascending=True):
+    """ Returns a float array that sorts the same way as values (NaNs last) in the given direction """
+
+    if np.issubdtype(values.dtype, np.number):
+        key = values.astype('float')
+    else:
+        codes, _ = pd.factorize(values, sort=True)
+        key = np.where(codes == -1, np.nan, codes).astype('float')
+
+    if not ascending:
+        key = -key
+
+    return key
+
+
+def assign_standings(df_matchup_data, tier_plan):
+    """
+    Returns an array of standings aligned to the rows of df_matchup_data. Every week_number is
+    ranked on its own according to the tier plan, and rows the plan doesn't reach are set to 0
+    """
+
+    week_key = _sort_key(df_matchup_data['week_number'].to_numpy())
+    standings = np.zeros(len(df_matchup_data), dtype='int')
+
+    # rows that still need a rank along with their order coming out of the previous tier
+    remaining = np.arange(len(df_matchup_data))
+    prior_order = np.arange(len(df_matchup_data))
+
+    for rank_range_lower, rank_range_upper, rank_metric_list, ascending_indicator_list in tier_plan:
+        if len(remaining) == 0:
+            break
+
+        # np.lexsort uses the LAST key as the primary one, so the keys are stacked in reverse.
+        # Sorting on the prior order last keeps ties in the same order as the previous tier
+        sort_keys = [prior_order]
+        for rank_metric, ascending in reversed(list(zip(rank_metric_list, ascending_indicator_list))):
+            metric_values = df_matchup_data[rank_metric].to_numpy()[remaining]
+            sort_keys.append(_sort_key(metric_values, ascending))
+        sort_keys.append(week_key[remaining])
+
+        sorted_rows = remaining[np.lexsort(sort_keys)]
+
+        # position of each row within its week once sorted
+        sorted_weeks = week_key[sorted_rows]
+        week_starts = np.flatnonzero(np.r_[True, sorted_weeks[1:] != sorted_weeks[:-1]])
+        week_sizes = np.diff(np.r_[week_starts, len(sorted_rows)])
+        week_position = np.arange(len(sorted_rows)) - np.repeat(week_starts, week_sizes)
+
+        in_tier = week_position < rank_range_upper - rank_range_lower + 1
+        standings[sorted_rows[in_tier]] = rank_range_lower + week_position[in_tier]
+
+        remaining = sorted_rows[~in_tier]
+        prior_order = week_position[~in_tier]
+
+    return standings
+
+
 def add_all_standings(df_matchup_data, rank_metrics_by_week_range=None):
     """ Returns Week/Team level dataframe that includes week level standings """
 
@@ -271,28 +347,30 @@ def add_all_standings(df_matchup_data, rank_metrics_by_week_range=None):
     df_matchup_data = df_matchup_data.copy()
     
     reg_season = df_matchup_data.loc[df_matchup_data['week_type'] == 'Regular']
-    weeks = reg_season[['week_number']].sort_values(by='week_number', inplace=False, ascending=False)
-    num_weeks_reg_season = weeks['week_number'].tolist()[0]
-
-    columns = list(df_matchup_data.columns)
-    columns.append('standings')
+    num_weeks_reg_season = reg_season['week_number'].max()
 
-    # Shell for stacking
-    df_matchup_data_stacked = pd.DataFrame(columns=columns)
+    tier_plan = compile_tier_plan(rank_metrics_by_week_range)
 
-    for week_number in range(1, num_weeks_reg_season + 1):
-        df_matchup_data_w_standings = add_standings(df_matchup_data, week_number, rank_metrics_by_week_range)
+    # every regular season week is ranked at once rather than one add_standings call per week
+    df_reg_season = df_matchup_data.loc[(df_matchup_data['week_number'] >= 1) &
+                                        (df_matchup_data['week_number'] <= num_weeks_reg_season)].copy()
+    df_reg_season['standings'] = assign_standings(df_reg_season, tier_plan)
 
-        df_matchup_data_stacked = df_matchup_data_stacked.append(df_matchup_data_w_standings)
+    # teams outside of every tier range don't receive standings
+    df_reg_season = df_reg_season.loc[df_reg_season['standings'] > 0]
 
-    df_matchup_data_stacked.reset_index(inplace=True, drop=True)
+    df_reg_season.sort_values(by=['week_number', 'standings'], inplace=True)
+    df_reg_season.reset_index(inplace=True, drop=True)
 
-    return df_matchup_data_stacked
+    return df_reg_season
 
 
 def create_final_standings(league_id=48347143, year=2020,
                            rank_metrics_by_week_range=None, cum_metrics_dict=None):
-    """ return standings through all current weeks available and current standings"""
+    """
+    return standings through all current weeks available and current standings
+    Raises espn_scheduler.EspnUnavailable if the settings or matchups couldn't be pulled
+    """
 
     if cum_metrics_dict is None:
         cum_metrics_dict = {'score': 'cum_score', 'win_ind': 'cum_wins', 'all_play_wins': 'cum_all_play_wins',
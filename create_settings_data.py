@@ -16,6 +16,8 @@ class settingsData():
     pull_data(2019, 28056918, params=(("view", "mSettings")))
     
     TODO: update this so that this is part of the class and all that needs passed is the league id and year
+    
+    Raises espn_scheduler.EspnUnavailable if the settings couldn't be pulled
     """
     
     def __init__(self, season_id, league_id):
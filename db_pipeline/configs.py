@@ -1,6 +1,11 @@
 import os
 
-from credentials import HEROKU_USER, HEROKU_PASSWORD, LOCAL_USER, LOCAL_PASSWORD
+try:
+    from credentials import HEROKU_USER, HEROKU_PASSWORD, LOCAL_USER, LOCAL_PASSWORD
+except ImportError:
+    # credentials.py isn't checked in. DATABASE_URL is enough without it (and nothing needs either
+    # until it connects, e.g. the tests)
+    HEROKU_USER = HEROKU_PASSWORD = LOCAL_USER = LOCAL_PASSWORD = None
 
 
 LEAGUE_ID = 48347143
@@ -1,8 +1,22 @@
+import io
+import os
+import csv
+import json
+from contextlib import contextmanager
+
 import psycopg2
+import psycopg2.pool
 import pandas as pd
 from configs import connection_params
 
 
+# Column holding a hash of the rest of the row, used to skip rows that haven't changed
+ROW_HASH_COL = 'row_hash'
+
+# Channel the app LISTENs on for the league/season/weeks whose standings were reloaded
+STANDINGS_CHANNEL = os.environ.get('STANDINGS_NOTIFY_CHANNEL', 'standings_changed')
+
+
 def create_db_connection(connect_params: dict=None) -> psycopg2.connect:
     if connect_params is None:
         connect_params = connection_params(connect_type='heroku')
@@ -17,6 +31,75 @@ def create_db_connection(connect_params: dict=None) -> psycopg2.connect:
     return conn
 
 
+def create_connection_pool(connect_params: dict=None, min_conn: int=1, 
+                           max_conn: int=4) -> psycopg2.pool.ThreadedConnectionPool:
+    """ Returns a pool of connections that can be shared by threads """
+    
+    if connect_params is None:
+        connect_params = connection_params(connect_type='heroku')
+        
+    pool = psycopg2.pool.ThreadedConnectionPool(min_conn, max_conn,
+                                                user=connect_params['user'],
+                                                password=connect_params['password'],
+                                                host=connect_params['host'],
+                                                port=connect_params['port'],
+                                                database=connect_params['database']
+                                                )
+    
+    return pool
+
+
+@contextmanager
+def pooled_connection(pool: psycopg2.pool.ThreadedConnectionPool):
+    """ Yields a connection from the pool and returns it to the pool afterwards """
+    
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        # a connection left mid-transaction (e.g. by an error) isn't reused
+        pool.putconn(conn, close=conn.closed != 0 or 
+                     conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+
+
+# id(conn) -> callbacks to run once the transaction block open on the connection commits
+_commit_callbacks = {}
+
+
+@contextmanager
+def transaction(conn: psycopg2.connect):
+    """ 
+    Commits everything run in the block at once or rolls all of it back if anything fails.
+    The helpers need to be called with commit=False inside the block so they don't commit part of it.
+    """
+    
+    _commit_callbacks[id(conn)] = []
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        _commit_callbacks.pop(id(conn), None)
+        conn.rollback()
+        raise
+    
+    for callback in _commit_callbacks.pop(id(conn), []):
+        callback()
+
+
+def on_commit(conn: psycopg2.connect, callback) -> bool:
+    """ 
+    Runs callback once the transaction block open on conn commits (it's dropped on a rollback).
+    Returns False without queueing it if conn isn't in a transaction block.
+    """
+    
+    if id(conn) not in _commit_callbacks:
+        return False
+    
+    _commit_callbacks[id(conn)].append(callback)
+    
+    return True
+
+
 def table_columns(conn: psycopg2.connect, table: str) -> tuple:
     """ Pulls all columns in a table """
     
@@ -47,28 +130,66 @@ def table_columns(conn: psycopg2.connect, table: str) -> tuple:
         return 1
 
 
-def drop_rows(conn: psycopg2.connect, table: str, where_condition: str) -> None:
-    ''' Drops rows from a table based on a set of conditions '''
+def select_rows(conn: psycopg2.connect, table: str, where_condition: str) -> [pd.DataFrame, None]:
+    ''' Returns the rows from a table that meet a set of conditions '''
 
     query  = f'''
-        DELETE FROM {table}
+        SELECT *
+        FROM {table}
         WHERE {where_condition}
     '''
     
     cursor = conn.cursor()
     try:
         cursor.execute(query)
-        conn.commit()
+        
+        rows = cursor.fetchall()
+        cols = [col[0] for col in cursor.description]
+        
+        cursor.close()
+        
+        return pd.DataFrame(rows, columns=cols)
+        
     except (Exception, psycopg2.DatabaseError) as error:
         print("Error: %s" % error)
         conn.rollback()
         cursor.close()
+        
+        return None
+
+
+def drop_rows(conn: psycopg2.connect, table: str, where_condition: str, commit: bool=True) -> None:
+    ''' 
+    Drops rows from a table based on a set of conditions.
+    With commit=False the caller commits (see transaction) and errors are raised to it.
+    '''
+
+    query  = f'''
+        DELETE FROM {table}
+        WHERE {where_condition}
+    '''
+    
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query)
+        if commit:
+            conn.commit()
+    except (Exception, psycopg2.DatabaseError) as error:
+        cursor.close()
+        if not commit:
+            raise
+        
+        print("Error: %s" % error)
+        conn.rollback()
         return 1
     cursor.close()
 
 
-def insert_rows(conn: psycopg2.connect, df: pd.DataFrame, table: str) -> None:
-    ''' Inserts the df values into the DB table '''
+def insert_rows(conn: psycopg2.connect, df: pd.DataFrame, table: str, commit: bool=True) -> None:
+    ''' 
+    Inserts the df values into the DB table.
+    With commit=False the caller commits (see transaction) and errors are raised to it.
+    '''
     
     # Create a list of tupples from the dataframe values
     tuples = [tuple(x) for x in df.to_numpy()]
@@ -83,19 +204,25 @@ def insert_rows(conn: psycopg2.connect, df: pd.DataFrame, table: str) -> None:
     cursor = conn.cursor()
     try:
         cursor.execute(query)
-        conn.commit()
+        if commit:
+            conn.commit()
     except (Exception, psycopg2.DatabaseError) as error:
+        cursor.close()
+        if not commit:
+            raise
+        
         print("Error: %s" % error)
         conn.rollback()
-        cursor.close()
         return 1
     cursor.close()
 
 
-def upsert_rows(conn: psycopg2.connect, df: pd.DataFrame, table: str, pkeys: list) -> None:
+def upsert_rows(conn: psycopg2.connect, df: pd.DataFrame, table: str, pkeys: list, 
+                commit: bool=True) -> None:
     """
     Using cursor.mogrify() to build the bulk insert query
-    then cursor.execute() to execute the query
+    then cursor.execute() to execute the query.
+    With commit=False the caller commits (see transaction) and errors are raised to it.
     """
     
     # Create a list of tupples from the dataframe values
@@ -115,15 +242,255 @@ def upsert_rows(conn: psycopg2.connect, df: pd.DataFrame, table: str, pkeys: lis
     cursor = conn.cursor()
     try:
         cursor.execute(query)
-        conn.commit()
+        if commit:
+            conn.commit()
     except (Exception, psycopg2.DatabaseError) as error:
+        cursor.close()
+        if not commit:
+            raise
+        
         print("Error: %s" % error)
         conn.rollback()
+        return 1
+    cursor.close()
+
+
+def copy_upsert_rows(conn: psycopg2.connect, df: pd.DataFrame, table: str, pkeys: list, 
+                     chunk_size: int=10000, commit: bool=True) -> None:
+    """
+    Upserts the df values by streaming them with COPY into a temp staging table and then
+    merging the staging table into the DB table with a single INSERT ... ON CONFLICT.
+    Rows are written chunk_size at a time so memory use doesn't grow with the df.
+    With commit=False the caller commits (see transaction) and errors are raised to it.
+    """
+    
+    return copy_upsert_stream(conn, df_csv_chunks(df, chunk_size=chunk_size), table, list(df.columns), 
+                              pkeys, commit=commit)
+
+
+def copy_upsert_stream(conn: psycopg2.connect, chunks, table: str, cols: list, pkeys: list, 
+                       commit: bool=True) -> None:
+    """
+    Upserts the rows in chunks (an iterable of CSV text holding cols, see df_csv_chunks and 
+    rows_csv_chunks) through a temp staging table. The chunks are only pulled as COPY reads them, 
+    so a generator never has more than one of them in memory.
+    With commit=False the caller commits (see transaction) and errors are raised to it.
+    """
+    
+    staging_table = table + '_staging'
+    cols_str = ','.join(cols)
+    
+    create_staging_statement = f'''
+        CREATE TEMP TABLE {staging_table} 
+        (LIKE {table} INCLUDING DEFAULTS) 
+        ON COMMIT DROP
+    '''
+    copy_statement = f'''COPY {staging_table}({cols_str}) FROM STDIN WITH (FORMAT csv)'''
+    merge_statement = (f'''INSERT INTO {table}({cols_str}) SELECT {cols_str} FROM {staging_table} ''' 
+                       + 'ON CONFLICT (' + ', '.join(map(str, pkeys)) + ') ' 
+                       + _create_update_set_statement(cols))
+    
+    cursor = conn.cursor()
+    try:
+        cursor.execute(create_staging_statement)
+        cursor.copy_expert(copy_statement, CopyStream(chunks))
+        cursor.execute(merge_statement)
+        
+        # dropped right away in case the same table is upserted again in this transaction
+        cursor.execute(f'''DROP TABLE {staging_table}''')
+        if commit:
+            conn.commit()
+    except (Exception, psycopg2.DatabaseError) as error:
         cursor.close()
+        if not commit:
+            raise
+        
+        print("Error: %s" % error)
+        conn.rollback()
         return 1
     cursor.close()
 
 
+def notify_standings_changed(conn: psycopg2.connect, changes: list, commit: bool=True) -> None:
+    """
+    Sends a notification on STANDINGS_CHANNEL for each (league_id, season_id, week_number) in changes, 
+    where week_number is the first week that changed. Notifications are only delivered once the 
+    transaction commits, so with commit=False they go out along with the rows.
+    Errors are raised to the caller.
+    """
+    
+    cursor = conn.cursor()
+    try:
+        for league_id, season_id, week_number in changes:
+            payload = json.dumps({'league_id': int(league_id), 'season_id': int(season_id), 
+                                  'week_number': int(week_number)})
+            cursor.execute('''SELECT pg_notify(%s, %s)''', (STANDINGS_CHANNEL, payload))
+            
+        if commit:
+            conn.commit()
+    finally:
+        cursor.close()
+        
+        
+# id(conn) -> (league_id, season_id, week_number) changes committed on the connection that the app
+# hasn't been told about yet. They're sent once the dashboard's materialized views include them
+_pending_standings_changes = {}
+
+
+def queue_standings_changed(conn: psycopg2.connect, changes: list) -> None:
+    """
+    Queues the (league_id, season_id, week_number) changes for send_standings_changed. Inside a transaction
+    block they're only queued once it commits, so a rolled back load doesn't tell the app anything.
+    """
+    
+    def queue():
+        _pending_standings_changes.setdefault(id(conn), []).extend(changes)
+        
+    if not on_commit(conn, queue):
+        queue()
+        
+        
+def send_standings_changed(conn: psycopg2.connect) -> None:
+    """ 
+    Sends the changes queued on conn (see queue_standings_changed) with the first week of each league/season.
+    Errors are raised to the caller.
+    """
+    
+    first_weeks = {}
+    for league_id, season_id, week_number in _pending_standings_changes.pop(id(conn), []):
+        key = (int(league_id), int(season_id))
+        first_weeks[key] = min(int(week_number), first_weeks.get(key, int(week_number)))
+        
+    if len(first_weeks) > 0:
+        notify_standings_changed(conn, [key + (week_number,) for key, week_number in first_weeks.items()])
+
+
+def changed_weeks(df: pd.DataFrame) -> list:
+    """ Returns the (league_id, season_id, week_number) of the first week of each league/season in df """
+    
+    df_weeks = df.groupby(['league_id', 'season_id'], as_index=False)['week_number'].min()
+    
+    return list(df_weeks.itertuples(index=False, name=None))
+
+
+def add_row_hash(df: pd.DataFrame, hash_col: str=ROW_HASH_COL) -> pd.DataFrame:
+    """ Returns the df with a hash of each row's values, stored as a (signed) BIGINT """
+    
+    df = df.copy()
+    data_cols = [col for col in df.columns if col != hash_col]
+    
+    df[hash_col] = pd.util.hash_pandas_object(df[data_cols], index=False).values.view('int64')
+    
+    return df
+
+
+def changed_rows(conn: psycopg2.connect, df: pd.DataFrame, table: str, pkeys: list, 
+                 hash_col: str=ROW_HASH_COL) -> pd.DataFrame:
+    """
+    Returns the rows of df (which needs hash_col, see add_row_hash) that are new or whose hash 
+    differs from the one already in the table. Only the league/seasons in df are read back.
+    Errors are raised to the caller.
+    """
+    
+    query = f'''SELECT {', '.join(pkeys)}, {hash_col} FROM {table}'''
+    
+    scope_cols = [col for col in ['league_id', 'season_id'] if col in pkeys]
+    if len(scope_cols) > 0:
+        scopes = df[scope_cols].drop_duplicates().itertuples(index=False, name=None)
+        scopes_str = ', '.join('(' + ', '.join(str(int(val)) for val in scope) + ')' for scope in scopes)
+        
+        query = query + f''' WHERE ({', '.join(scope_cols)}) IN ({scopes_str})'''
+        
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query)
+        existing = pd.DataFrame(cursor.fetchall(), columns=pkeys + ['existing_hash'])
+    finally:
+        cursor.close()
+        
+    if len(existing) == 0:
+        return df
+    
+    for pkey in pkeys:
+        existing[pkey] = existing[pkey].astype(df[pkey].dtype)
+        
+    df_merged = pd.merge(df, existing, on=pkeys, how='left')
+    changed = (df_merged['existing_hash'] != df_merged[hash_col]).values
+    
+    return df.loc[changed]
+
+
+def df_csv_chunks(df: pd.DataFrame, chunk_size: int=10000):
+    """ Yields the df rows as CSV text (no header) chunk_size rows at a time """
+    
+    df = _whole_floats_to_int(df)
+    
+    for i in range(0, len(df), chunk_size):
+        yield df.iloc[i:i + chunk_size].to_csv(header=False, index=False)
+
+
+def rows_csv_chunks(rows, chunk_size: int=10000):
+    """ Yields an iterable of row tuples as CSV text (no header) chunk_size rows at a time. None is written as null """
+    
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    
+    n_rows = 0
+    for row in rows:
+        writer.writerow(row)
+        n_rows += 1
+        
+        if n_rows == chunk_size:
+            yield buffer.getvalue()
+            
+            buffer.seek(0)
+            buffer.truncate()
+            n_rows = 0
+            
+    if n_rows > 0:
+        yield buffer.getvalue()
+
+
+class CopyStream():
+    """ File-like object cursor.copy_expert reads from that pulls text from an iterable of chunks as needed """
+    
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._chunk = io.StringIO()
+        
+    def read(self, size: int=-1) -> str:
+        data = self._chunk.read(size)
+        
+        while size < 0 or len(data) < size:
+            try:
+                self._chunk = io.StringIO(next(self._chunks))
+            except StopIteration:
+                break
+            
+            data = data + self._chunk.read(size if size < 0 else size - len(data))
+            
+        return data
+
+
+def _whole_floats_to_int(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns the df with float columns holding only whole numbers as nullable ints.
+    Int columns become floats once they contain a null, and COPY won't take "1.0" for an integer column
+    """
+    
+    float_cols = [col for col in df.columns if pd.api.types.is_float_dtype(df[col])]
+    if len(float_cols) == 0:
+        return df
+    
+    df = df.copy()
+    for col in float_cols:
+        values = df[col].dropna()
+        if (values == values.round()).all():
+            df[col] = df[col].astype('Int64')
+            
+    return df
+
+
 def _create_update_set_statement(cols: list) -> str:
     ''' 
     Creates the "do update set" statement used for upsert.
@@ -2,59 +2,293 @@
 Loads data into the tables that need updated once a season
 """
 
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import psycopg2
 import pandas as pd
 
-from pull_data import ApiData
-from helpers import create_db_connection, upsert_rows, table_columns
+from pull_data import ApiData, LeagueHistory, MissingPriorWeek, create_session
+import schema_registry
+from materialized_views import refresh_materialized_views
+from sql_standings import compute_scores
+from table_schemas import TABLE_SCHEMAS
+from helpers import (create_connection_pool, pooled_connection, transaction, copy_upsert_rows, 
+                     select_rows, add_row_hash, changed_rows, queue_standings_changed, changed_weeks, 
+                     ROW_HASH_COL)
+
+
+# Primary keys of each table loaded for a season. The keys match the ApiData attributes
+TABLE_PKEYS = {table.lower(): [pkey.lower() for pkey in schema['pkeys']] for table, schema in TABLE_SCHEMAS.items()}
+
+# How the SCORES table gets built - 'pandas' loads ApiData.scores while 'sql' builds it inside 
+# the DB from the MATCHUPS and SETTINGS tables (see sql_standings)
+STANDINGS_ENGINES = ['pandas', 'sql']
+
+
+class SeasonsFailed(Exception):
+    """ 
+    Raised by load_seasons_concurrent (and stream_tables.stream_seasons) once every season has been tried 
+    if any of them failed 
+    """
+    
+    def __init__(self, failures: list):
+        # (league_id, season_id, error) for each season that failed
+        self.failures = failures
+        
+        super().__init__("%s season(s) failed to load: %s" % (
+            len(failures), ', '.join("%s season %s (%s)" % failure for failure in failures)))
+
+
+def engine_table_pkeys(table_pkeys: dict, engine: str) -> dict:
+    """ 
+    Returns the tables that get loaded from pandas for the engine. MATCHUPS is only needed by the 
+    'sql' engine, which builds SCORES from it
+    """
+    
+    if engine not in STANDINGS_ENGINES:
+        raise ValueError("engine must be one of %s" % ', '.join(STANDINGS_ENGINES))
+    
+    skip_table = 'scores' if engine == 'sql' else 'matchups'
+    
+    return {table: pkeys for table, pkeys in table_pkeys.items() if table != skip_table}
 
 
-def load_table(conn: psycopg2.connect, df: pd.DataFrame, table: str, pkeys: list) -> None:
+def load_table(conn: psycopg2.connect, df: pd.DataFrame, table: str, pkeys: list, 
+               commit: bool=True) -> None:
     df = df.copy()
     df.sort_values(by=pkeys, inplace=True)
     
     # df could contain columns that aren't in the DB
-    cols = table_columns(conn, table)
-    df = df[cols]
+    table_schema = schema_registry.registry.table_schema(conn, table)
+    
+    # e.g. a table added to table_schemas that hasn't been created in this DB yet
+    if not table_schema.exists:
+        print("Warning: skipping %s since it doesn't exist" % table)
+        return None
+    df = table_schema.project(df.drop(columns=[ROW_HASH_COL], errors='ignore'))
+    
+    # Only send the rows that are new or changed since they were last loaded
+    if ROW_HASH_COL in table_schema.columns:
+        df = add_row_hash(df)
+        df = changed_rows(conn, df, table, pkeys)
+        
+        if len(df) == 0:
+            return None
+    
+    schema_registry.registry.ensure_partitions(conn, table, df, commit=commit)
+    
+    if copy_upsert_rows(conn, df, table, pkeys, commit=commit) is not None:
+        return None
+    
+    # lets the app know which weeks to rebuild (see standings_notify in the app) once the views are refreshed
+    if table == 'scores':
+        queue_standings_changed(conn, changed_weeks(df))
+    
+
+def load_scores_incremental(conn: psycopg2.connect, espn_data: ApiData, week_number: int, 
+                            pkeys: list) -> None:
+    """ 
+    Upserts only week_number's scores by building on the prior week's rows 
+    already in the SCORES table. Every week is rebuilt if the prior week's rows are missing.
+    The dashboard's materialized views are refreshed once the week is committed.
+    """
+    
+    where_condition = f'''league_id = {espn_data.league_id} 
+        AND season_id = {espn_data.season_id} 
+        AND week_number = {week_number - 1}'''
+    
+    # the prior week is read in the same transaction the new week is written in
+    with transaction(conn):
+        prior_scores = select_rows(conn, 'scores', where_condition)
+        if prior_scores is None:
+            return None
+        
+        try:
+            espn_data.pull_scores_incremental(prior_scores, week_number=week_number, return_df=False)
+        except MissingPriorWeek as error:
+            # every week is rebuilt rather than restarting the cumulative metrics from 0
+            print("Rebuilding every week's scores: %s" % error)
+            espn_data.pull_scores(return_df=False)
+        
+        load_table(conn, espn_data.scores, 'scores', pkeys, commit=False)
+        
+    refresh_materialized_views(conn)
     
-    upsert_rows(conn, df, table, pkeys)
+
+def load_season(conn: psycopg2.connect, espn_data: ApiData, table_pkeys: dict=None, 
+                engine: str='pandas', refresh_views: bool=True) -> None:
+    """ 
+    Upserts every table for a season that has already been pulled. 
+    The tables are committed together, so a failure leaves none of them half loaded.
+    refresh_views refreshes the dashboard's materialized views afterwards.
+    """
+    
+    if table_pkeys is None:
+        table_pkeys = TABLE_PKEYS
+        
+    with transaction(conn):
+        for table, pkeys in engine_table_pkeys(table_pkeys, engine).items():
+            load_table(conn, getattr(espn_data, table), table, pkeys, commit=False)
+            
+        if engine == 'sql':
+            compute_scores(conn, [(espn_data.league_id, espn_data.season_id)], 
+                           rank_metrics_by_week_range=espn_data.standings_metrics, commit=False)
+            
+    if refresh_views:
+        refresh_materialized_views(conn)
+        
+
+def load_seasons_concurrent(conn: psycopg2.connect, league_seasons: list, max_workers: int=4, 
+                            queue_size: int=None, table_pkeys: dict=None, engine: str='pandas') -> None:
+    """ 
+    Pulls and transforms up to max_workers (league_id, season_id) pairs at a time and 
+    hands them to a single writer thread through a bounded queue, so the ESPN 
+    requests overlap each other and the DB writes. 
+    The pull threads wait once queue_size seasons are waiting on the writer.
+    The dashboard's materialized views are refreshed once after every season is loaded.
+    Raises SeasonsFailed once every season has been tried if any of them failed to pull or load.
+    """
+    
+    if queue_size is None:
+        queue_size = max_workers
+    
+    season_queue = queue.Queue(maxsize=queue_size)
+    failures = []
+    
+    # Each pull thread gets its own session. Every view comes back in the one request 
+    # (single_request), so each thread only ever has one request to ESPN in flight
+    thread_sessions = threading.local()
+    sessions = []
+    sessions_lock = threading.Lock()
+    
+    def thread_session():
+        if not hasattr(thread_sessions, 'session'):
+            thread_sessions.session = create_session(pool_maxsize=1)
+            
+            with sessions_lock:
+                sessions.append(thread_sessions.session)
+                
+        return thread_sessions.session
+    
+    # conn is only ever used by this thread
+    def write_seasons():
+        while True:
+            espn_data = season_queue.get()
+            if espn_data is None:
+                break
+            
+            # Keep draining the queue so the pull threads never block on a failed load
+            try:
+                load_season(conn, espn_data, table_pkeys=table_pkeys, engine=engine, refresh_views=False)
+            except (Exception, psycopg2.DatabaseError) as error:
+                print("Error loading %s season %s: %s" % (espn_data.league_id, espn_data.season_id, error))
+                failures.append((espn_data.league_id, espn_data.season_id, error))
+    
+    def pull_season(league_id, season_id):
+        espn_data = ApiData(season_id, league_id=league_id, session=thread_session(), single_request=True)
+        
+        # the season's frames are built in this thread so there are never more than max_workers pulling
+        espn_data.pull_all_data(max_workers=1)
+        
+        season_queue.put(espn_data)
+    
+    writer = threading.Thread(target=write_seasons)
+    writer.start()
+    
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(pull_season, league_id, season_id): (league_id, season_id)
+                       for league_id, season_id in league_seasons}
+            
+            for future, (league_id, season_id) in futures.items():
+                try:
+                    future.result()
+                except Exception as error:
+                    print("Error pulling %s season %s: %s" % (league_id, season_id, error))
+                    failures.append((league_id, season_id, error))
+    finally:
+        season_queue.put(None)
+        writer.join()
+        
+        for session in sessions:
+            session.close()
+            
+    refresh_materialized_views(conn)
+    
+    if len(failures) > 0:
+        raise SeasonsFailed(failures)
     
 
+def load_league_history(conn: psycopg2.connect, league_id: int, season_ids: list=None, 
+                        table_pkeys: dict=None, engine: str='pandas') -> None:
+    """ 
+    Upserts every season in the league's history (pre-2020 seasons) from a single 
+    leagueHistory request, with one upsert per table across all of the seasons
+    and a single commit. The dashboard's materialized views are refreshed afterwards.
+    """
+    
+    if table_pkeys is None:
+        table_pkeys = TABLE_PKEYS
+        
+    league_history = LeagueHistory(league_id=league_id)
+    league_history.pull_all_data(season_ids=season_ids)
+    
+    with transaction(conn):
+        for table, pkeys in engine_table_pkeys(table_pkeys, engine).items():
+            df = getattr(league_history, table)
+            
+            if df is not None:
+                load_table(conn, df, table, pkeys, commit=False)
+                
+        # every season is built with the one statement. The seasons all share the same standings metrics
+        if engine == 'sql' and len(league_history.seasons) > 0:
+            league_seasons = [(league_id, season_id) for season_id in league_history.seasons]
+            standings_metrics = next(iter(league_history.seasons.values())).standings_metrics
+            
+            compute_scores(conn, league_seasons, rank_metrics_by_week_range=standings_metrics, commit=False)
+            
+    league_history.session.close()
+    
+    refresh_materialized_views(conn)
+
 if __name__ == '__main__':
     
     from configs import connection_params, LEAGUE_ID, SEASON_ID
     
     connect_params = connection_params(connect_type='heroku')
-    conn = create_db_connection(connect_params=connect_params)
+    pool = create_connection_pool(connect_params=connect_params)
     season_ids = [2019, 2020, 2021]
     
-    scores_keys = ['league_id', 'season_id', 'week_number', 'team_id']
-    teams_keys = ['league_id', 'season_id', 'team_id']
-    weeks_keys = ['league_id', 'season_id', 'week_number']
-    divisions_keys = ['league_id', 'season_id', 'division_id']
-    settings_keys = ['league_id', 'season_id']
+    scores_keys = TABLE_PKEYS['scores']
+    matchups_keys = TABLE_PKEYS['matchups']
+    teams_keys = TABLE_PKEYS['teams']
+    weeks_keys = TABLE_PKEYS['weeks']
+    divisions_keys = TABLE_PKEYS['divisions']
+    settings_keys = TABLE_PKEYS['settings']
     
     ####################################################
     ################## UPSERT TABLES ###################
     ####################################################
     
-    for season_id in season_ids:
-        espn_data = ApiData(season_id, league_id=LEAGUE_ID)
-        espn_data.pull_all_data()
-        
-        load_table(conn, espn_data.scores, 'scores', scores_keys)
-        load_table(conn, espn_data.teams, 'teams', teams_keys)
-        load_table(conn, espn_data.weeks, 'weeks', weeks_keys)
-        load_table(conn, espn_data.divisions, 'divisions', divisions_keys)
-        load_table(conn, espn_data.settings, 'settings', settings_keys)
+    league_seasons = [(LEAGUE_ID, season_id) for season_id in season_ids]
+    with pooled_connection(pool) as conn:
+        load_seasons_concurrent(conn, league_seasons, max_workers=4)
         
-    conn.close()
+    pool.closeall()
     
     
+    # load_league_history(conn, LEAGUE_ID)
+    
+    # espn_data = ApiData(SEASON_ID, league_id=LEAGUE_ID)
+    # load_scores_incremental(conn, espn_data, week_number, scores_keys)
+    
     # espn_data = ApiData(SEASON_ID, league_id=LEAGUE_ID)
     # espn_data.pull_all_data()
     
     # load_table(conn, espn_data.scores, 'scores', scores_keys)
+    # load_table(conn, espn_data.matchups, 'matchups', matchups_keys)
     # load_table(conn, espn_data.teams, 'teams', teams_keys)
     # load_table(conn, espn_data.weeks, 'weeks', weeks_keys)
     # load_table(conn, espn_data.divisions, 'divisions', divisions_keys)
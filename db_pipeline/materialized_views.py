@@ -0,0 +1,148 @@
+"""
+Materialized views the dashboard reads instead of scanning and sorting SCORES.
+
+The views are refreshed CONCURRENTLY at the end of each load so the dashboard can keep reading
+them while they're rebuilt. That requires a unique index on each of them. The app is only told
+about the load's new scores (see helpers.send_standings_changed) once the views include them.
+"""
+
+import psycopg2
+
+from helpers import create_db_connection, send_standings_changed
+from configs import connection_params
+
+
+# name -> (query, columns of its unique index)
+MATERIALIZED_VIEWS = {
+    # The latest week's standings of every league/season - SCORES only holds regular season weeks
+    'CURRENT_STANDINGS': ('''
+        SELECT
+            S.LEAGUE_ID
+            , S.SEASON_ID
+            , S.WEEK_NUMBER
+            , S.TEAM_ID
+            , S.STANDINGS
+            , T.TEAM_NAME
+            , T.MANAGER_NAME
+            , S.RECORD
+            , S.ALL_PLAY_RECORD
+            , S.CUM_WINS
+            , S.CUM_LOSSES
+            , S.CUM_TIES
+            , S.CUM_WLT_POINTS
+            , S.CUM_ALL_PLAY_WLT_POINTS
+            , S.CUM_SCORE
+            , S.CUM_SCORE_OPP
+            , S.CUM_SCORE_PER_WEEK
+            , S.CUM_SCORE_OPP_PER_WEEK
+            , S.CUM_ALL_PLAY_WLT_POINTS_PER_WEEK
+        FROM SCORES S
+        JOIN (
+            SELECT LEAGUE_ID, SEASON_ID, MAX(WEEK_NUMBER) AS WEEK_NUMBER
+            FROM SCORES
+            WHERE STANDINGS IS NOT NULL
+            GROUP BY LEAGUE_ID, SEASON_ID
+        ) L
+            ON S.LEAGUE_ID = L.LEAGUE_ID
+            AND S.SEASON_ID = L.SEASON_ID
+            AND S.WEEK_NUMBER = L.WEEK_NUMBER
+        LEFT JOIN TEAMS T
+            ON S.LEAGUE_ID = T.LEAGUE_ID
+            AND S.SEASON_ID = T.SEASON_ID
+            AND S.TEAM_ID = T.TEAM_ID
+    ''', ['LEAGUE_ID', 'SEASON_ID', 'STANDINGS', 'TEAM_ID']),
+
+    # Every week's standings of every league/season along with each team's rank history through the week.
+    # The app reads its per-week standings from here (see standings_db.py in the app)
+    'STANDINGS_HISTORY': ('''
+        SELECT
+            S.LEAGUE_ID
+            , S.SEASON_ID
+            , S.WEEK_NUMBER
+            , S.TEAM_ID
+            , S.STANDINGS
+            , LAG(S.STANDINGS) OVER TEAM_WEEKS AS PRIOR_STANDINGS
+            , MIN(S.STANDINGS) OVER TEAM_WEEKS AS BEST_STANDINGS
+            , MAX(S.STANDINGS) OVER TEAM_WEEKS AS WORST_STANDINGS
+            , T.TEAM_NAME
+            , T.MANAGER_NAME
+            , S.RECORD
+            , S.ALL_PLAY_RECORD
+            , S.CUM_WINS
+            , S.CUM_LOSSES
+            , S.CUM_TIES
+            , S.CUM_WLT_POINTS
+            , S.CUM_ALL_PLAY_WLT_POINTS
+            , S.CUM_SCORE
+            , S.CUM_SCORE_OPP
+            , S.CUM_SCORE_PER_WEEK
+            , S.CUM_SCORE_OPP_PER_WEEK
+            , S.CUM_ALL_PLAY_WLT_POINTS_PER_WEEK
+        FROM SCORES S
+        LEFT JOIN TEAMS T
+            ON S.LEAGUE_ID = T.LEAGUE_ID
+            AND S.SEASON_ID = T.SEASON_ID
+            AND S.TEAM_ID = T.TEAM_ID
+        WHERE S.STANDINGS IS NOT NULL
+        WINDOW TEAM_WEEKS AS (PARTITION BY S.LEAGUE_ID, S.SEASON_ID, S.TEAM_ID ORDER BY S.WEEK_NUMBER)
+    ''', ['LEAGUE_ID', 'SEASON_ID', 'WEEK_NUMBER', 'STANDINGS', 'TEAM_ID'])
+}
+
+
+def create_materialized_views(conn: psycopg2.connect, overwrite: bool=False) -> None:
+    ''' Creates the materialized views along with the unique indexes needed to refresh them concurrently '''
+
+    create_views_statement = ''
+    for view_name, (query, index_cols) in MATERIALIZED_VIEWS.items():
+        if overwrite == True:
+            create_views_statement = create_views_statement + f'''
+            DROP MATERIALIZED VIEW IF EXISTS {view_name};
+            '''
+
+        create_views_statement = create_views_statement + f'''
+            CREATE MATERIALIZED VIEW IF NOT EXISTS {view_name} AS {query};
+            CREATE UNIQUE INDEX IF NOT EXISTS {view_name}_IDX ON {view_name} ({', '.join(index_cols)});
+        '''
+
+    cursor = conn.cursor()
+    cursor.execute(create_views_statement)
+    conn.commit()
+
+    cursor.close()
+
+
+def refresh_materialized_views(conn: psycopg2.connect, views: list=None) -> None:
+    '''
+    Refreshes the materialized views without blocking the dashboard's reads of them, then tells the app
+    about the scores loaded on conn. Each view is committed on its own so a failure doesn't undo the others.
+    '''
+
+    if views is None:
+        views = list(MATERIALIZED_VIEWS)
+
+    cursor = conn.cursor()
+    for view_name in views:
+        try:
+            cursor.execute(f'''REFRESH MATERIALIZED VIEW CONCURRENTLY {view_name}''')
+            conn.commit()
+        except (Exception, psycopg2.DatabaseError) as error:
+            print("Error: %s" % error)
+            conn.rollback()
+
+    cursor.close()
+
+    try:
+        send_standings_changed(conn)
+    except (Exception, psycopg2.DatabaseError) as error:
+        print("Error: %s" % error)
+        conn.rollback()
+
+
+if __name__ == '__main__':
+
+    connect_params = connection_params(connect_type='heroku')
+    conn = create_db_connection(connect_params=connect_params)
+
+    create_materialized_views(conn, overwrite=True)
+
+    conn.close()
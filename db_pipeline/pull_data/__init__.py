@@ -5,6 +5,6 @@ Created on Sun Jan 23 13:42:33 2022
 @author: conde
 """
 
-from pull_data.api_data import ApiData
+from pull_data.api_data import ApiData, LeagueHistory, create_session, MissingPriorWeek
 
 
@@ -1,16 +1,104 @@
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
 import pandas as pd
 import numpy as np
 
 import standings
+from standings import MissingPriorWeek
+import espn_cache
+import espn_scheduler
+
+
+# Can be pointed at mock_espn_server to replay recorded fixtures
+ESPN_BASE_URL = os.environ.get('ESPN_BASE_URL', 'https://fantasy.espn.com')
+
+# Views needed across all of the "pull_" methods. These get requested in one url when 
+# single_request is set rather than one request per raw attribute
+ALL_VIEWS = ['mMatchup', 'mMatchupScore', 'mSettings', 'mTeams', 'mTeam']
+
+# Top level keys of the combined payload used by each raw attribute
+RAW_PAYLOAD_KEYS = {'_raw_matchup': ['schedule'], 
+                    '_raw_settings': ['settings', 'status'],
+                    '_raw_teams': ['teams', 'members']}
+
+# attribute -> (method that builds it, attributes it's built from). Each attribute is only built
+# once (see ApiData._resolve), so e.g. weeks isn't rebuilt for every frame needing playoff_week_start
+PULL_DEPENDENCIES = {'_raw_matchup': ('_pull_raw_matchup', []),
+                     '_raw_settings': ('_pull_raw_settings', []),
+                     '_raw_teams': ('_pull_raw_teams', []),
+                     'weeks': ('pull_weeks', ['_raw_settings']),
+                     'playoff_week_start': ('_pull_playoff_week_start', ['weeks']),
+                     'members': ('pull_members', ['_raw_teams']),
+                     'scores': ('pull_scores', ['_raw_matchup', 'playoff_week_start']),
+                     'matchups': ('pull_matchups', ['_raw_matchup', 'playoff_week_start']),
+                     'settings': ('pull_settings', ['_raw_settings', 'playoff_week_start']),
+                     'divisions': ('pull_divisions', ['_raw_settings']),
+                     'teams': ('pull_teams', ['_raw_teams', 'members'])}
+
+# The dataframes loaded into the DB tables
+TABLE_ATTRS = ['scores', 'matchups', 'settings', 'divisions', 'teams', 'weeks']
+
+# Threads building the independent branches of PULL_DEPENDENCIES in pull_all_data. Mostly this
+# overlaps the requests for each raw attribute when single_request isn't set
+PULL_WORKERS = int(os.environ.get('ESPN_PULL_WORKERS', 3))
+
+
+def create_session(pool_maxsize: int=10) -> requests.Session:
+    """ 
+    Returns a requests Session that keeps its connections to ESPN alive so that
+    every pull after the first one skips the TCP/TLS handshake.
+    """
+    
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+    session.mount('https://', adapter)
+    
+    return session
+
+
+def add_params_to_url(url: str, params: list) -> str:
+    """ Returns the url with the [param, value] pairs in params added to its query string. """
+    
+    # Passing the dict_params directly to the request_params of the requests.get method was
+    # resulting in certain pulls retrieving unspecified data.
+    # So, I'm directly applying those parameters to the URL string to prevent this
+    # Note: This was likely happening due to duplicate keys being used (e.g. "view") in the dict
+    
+    for full_param in params:
+        param = str(full_param[0])
+        param_value = str(full_param[1])
+
+        if url.find("?") == -1:
+            url = url + "?" + param + "=" + param_value
+        else:
+            url = url + "&" + param + "=" + param_value
+            
+    return url
 
 
 class ApiData():
     
-    def __init__(self, season_id: int, standings_metrics: dict=None, league_id: int=48347143):
+    def __init__(self, season_id: int, standings_metrics: dict=None, league_id: int=48347143,
+                 session: requests.Session=None, single_request: bool=False, use_cache: bool=True):
         self.season_id = season_id
         self.league_id = league_id
         
+        # A session can be shared between ApiData objects (e.g. one per season)
+        if session is None:
+            self.session = create_session()
+        else:
+            self.session = session
+            
+        self.single_request = single_request
+        
+        # Pulls are served from the on-disk cache (see espn_cache) when this is set
+        self.use_cache = use_cache
+        
         if standings_metrics is None:
             self.standings_metrics = {'1-4': [['cum_total_wins', 'cum_score'], [False, False]],
                                  '5-6': [['cum_all_play_wins', 'cum_score'], [False, False]],
@@ -19,83 +107,101 @@ class ApiData():
             self.standings_metrics = standings_metrics
             
         self.scores = None
+        self.matchups = None
         self.settings = None
         self.divisions = None
         self.teams = None
         self.weeks = None
         
+        self.members = None
+        self.playoff_week_start = None
+        
         self._raw_matchup = None      
         self._raw_settings = None
         self._raw_teams = None
+        
+        # (attribute, seconds) for every attribute built through _resolve
+        self.build_log = []
+        
+        # The raw attributes share a lock with single_request since they all come from one pull
+        raw_lock = threading.Lock()
+        self._locks = {attr: raw_lock if single_request and attr in RAW_PAYLOAD_KEYS else threading.Lock()
+                       for attr in PULL_DEPENDENCIES}
 
-    def pull_api_data(self, params: (dict, tuple)=None) -> dict:
-        """ Returns a JSON object containing the data pulled APIs url. """
+    def pull_api_data(self, params: (dict, tuple)=None, filters: dict=None) -> dict:
+        """ 
+        Returns a JSON object containing the data pulled APIs url.
+        filters is sent as ESPN's X-Fantasy-Filter header, which limits what
+        comes back server side 
+        (e.g. {"schedule": {"filterMatchupPeriodIds": {"value": [3]}}}).
+        """
     
         if params == None:
             params = []
             
+        headers = {}
+        if filters is not None:
+            headers['X-Fantasy-Filter'] = json.dumps(filters, sort_keys=True)
+            
         season_id = self.season_id
         league_id = self.league_id
     
         if season_id < 2020:
-            url = "https://fantasy.espn.com/apis/v3/games/ffl/leagueHistory/" + \
+            url = ESPN_BASE_URL + "/apis/v3/games/ffl/leagueHistory/" + \
                   str(league_id) + "?seasonId=" + str(season_id)
         else:
-            url = "https://fantasy.espn.com/apis/v3/games/ffl/seasons/" + \
+            url = ESPN_BASE_URL + "/apis/v3/games/ffl/seasons/" + \
                   str(season_id) + "/segments/0/leagues/" + str(league_id)
     
-        # Passing the dict_params directly to the request_params of the requests.get method was
-        # resulting in certain pulls retrieving unspecified data.
-        # So, I'm directly applying those parameters to the URL string to prevent this
-        # Note: This was likely happening due to duplicate keys being used (e.g. "view") in the dict
-    
         if type(params) is tuple:
             params = self._convert_tuple_to_list(params)
     
         if type(params) is dict:
             params = self._convert_dict_to_list(params)
     
-        for full_param in params:
-            param = str(full_param[0])
-            param_value = str(full_param[1])
-    
-            if url.find("?") == -1:
-                url = url + "?" + param + "=" + param_value
-            else:
-                url = url + "&" + param + "=" + param_value
-    
-        r = requests.get(url)
-    
-        if r.status_code == 200:
-            pass
-        else:
-            if r.status_code == 429:
-                print("429 error")
+        url = add_params_to_url(url, params)
     
-            return None
-    
-            # 2020 url returns JSON object while prior season_ids return it in a list
-        if season_id < 2020:
-            d = r.json()[0]
+        if self.use_cache:
+            d = espn_cache.cached_get(self.session, url, season_id, league_id, params, headers=headers)
+            
+            if d is None:
+                return None
         else:
+            r = espn_scheduler.scheduler.get(self.session, url, headers=headers)
+        
+            # the scheduler already retried 429s and raised EspnUnavailable if they never cleared
+            if r.status_code != 200:
+                r.close()
+                return None
+            
             d = r.json()
+            r.close()
     
-        r.close()
+        # 2020 url returns JSON object while prior season_ids return it in a list
+        if season_id < 2020:
+            d = d[0]
     
         return d
     
-    def pull_all_data(self, clear_json: bool=True) -> None:
+    def pull_all_data(self, clear_json: bool=True, max_workers: int=None) -> None:
         """ 
-        Updates the attribute associated with every "pull_" method.
+        Updates every attribute in TABLE_ATTRS, building them (and what they're built from) once each. 
+        The independent branches of PULL_DEPENDENCIES are built in max_workers threads.
         """
-
-        pull_methods = [attr for attr in dir(self) if attr.startswith('pull')]
-        for pull_method in pull_methods:
-            attr = pull_method[5:]
+        
+        if max_workers is None:
+            max_workers = PULL_WORKERS
+        
+        # Everything but the raw attributes is rebuilt from them
+        for attr in PULL_DEPENDENCIES:
+            if attr not in RAW_PAYLOAD_KEYS:
+                setattr(self, attr, None)
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(self._resolve, attr) for attr in TABLE_ATTRS]
             
-            # Prevents "pull_" methods without an attr from running
-            if attr in(dir(self)):
-                getattr(self, pull_method)(return_df=False)
+            for future in futures:
+                future.result()
                 
         if clear_json:
             self.clear_json_attrs()
@@ -108,13 +214,98 @@ class ApiData():
         the current week.
         """
         
+        raw_matchup = self._resolve('_raw_matchup')
+        playoff_week_start = self._resolve('playoff_week_start')
+        
+        df = standings.pull_standings(raw_matchup, playoff_week_start, 
+                                      rank_metrics_by_week_range=self.standings_metrics)
+        df['season_id'] = self.season_id
+        df['league_id'] = self.league_id
+        
+        self.scores = df
+        
+        if return_df == True:
+            return df
+        else:
+            return None
+
+    def pull_matchups(self, return_df: bool=True) -> [pd.DataFrame, None]:
+        """ 
+        Returns a dataframe containing the Team/Week level scores of every week in the schedule. 
+        These are the only inputs sql_standings needs to build the scores inside the DB.
+        """
+        
+        raw_matchup = self._resolve('_raw_matchup')
+        playoff_week_start = self._resolve('playoff_week_start')
+        
+        df = standings.pull_matchups(raw_matchup, playoff_week_start)
+        df['season_id'] = self.season_id
+        df['league_id'] = self.league_id
+        
+        self.matchups = df
+        
+        if return_df == True:
+            return df
+        else:
+            return None
+
+    def iter_matchups(self):
+        """ 
+        Yields the rows of the matchups attribute as (league_id, season_id, week_number, team_id, 
+        team_id_opp, score, score_opp, home_or_away) tuples without building a dataframe.
+        """
+        
+        for row in standings.iter_matchup_rows(self._resolve('_raw_matchup')):
+            yield (self.league_id, self.season_id) + row
+            
+    def iter_scores(self):
+        """ Yields the rows of the scores attribute one week (dataframe) at a time """
+        
+        raw_matchup = self._resolve('_raw_matchup')
+        playoff_week_start = self._resolve('playoff_week_start')
+        
+        for df in standings.iter_standings(raw_matchup, playoff_week_start, 
+                                           rank_metrics_by_week_range=self.standings_metrics):
+            df['season_id'] = self.season_id
+            df['league_id'] = self.league_id
+            
+            yield df
+
+    def pull_scores_incremental(self, prior_scores: pd.DataFrame, week_number: int=None, 
+                                return_df: bool=True) -> [pd.DataFrame, None]:
+        """ 
+        Returns a dataframe containing only the Team level standings for week_number.
+        prior_scores is the prior week's scores (either a previous scores df or the 
+        rows from the SCORES table), so none of the earlier weeks get recomputed.
+        week_number defaults to the week after the latest one in prior_scores.
+        """
+        
+        if week_number is None:
+            if prior_scores is None or len(prior_scores) == 0:
+                week_number = 1
+            else:
+                week_number = int(prior_scores['week_number'].max()) + 1
+                
+        # Only the week's matchups are needed, so there's no need to download the full schedule
         if self._raw_matchup is None:
-            self._raw_matchup = self._pull_raw_matchup()
+            raw_matchup = self._pull_raw_matchup(matchup_period_ids=[week_number])
+        else:
+            raw_matchup = self._raw_matchup
             
-        playoff_week_start = self._playoff_week_start()
+        # with single_request, resolving playoff_week_start would pull every view (the full schedule included)
+        if self._raw_settings is None:
+            raw_settings = self._pull_raw_settings(settings_only=True)
+            if raw_settings is None:
+                raise espn_scheduler.EspnUnavailable("ESPN didn't return _raw_settings for league %s season %s" % (
+                    self.league_id, self.season_id))
+            
+            self._raw_settings = raw_settings
+            
+        playoff_week_start = self._resolve('playoff_week_start')
         
-        df = standings.pull_standings(self._raw_matchup, playoff_week_start, 
-                                      rank_metrics_by_week_range=self.standings_metrics)
+        df = standings.pull_standings_incremental(raw_matchup, prior_scores, week_number,
+                                                  playoff_week_start, 
+                                                  rank_metrics_by_week_range=self.standings_metrics)
         df['season_id'] = self.season_id
         df['league_id'] = self.league_id
         
@@ -128,12 +319,11 @@ class ApiData():
     def pull_settings(self, return_df: bool=True) -> [pd.DataFrame, None]:
         """ Returns dataframe containing all relevant data for the settings of a league/year. """
         
-        if self._raw_settings is None:
-            self._raw_settings = self._pull_raw_settings()
+        raw_settings = self._resolve('_raw_settings')
 
-        schedule_settings = self._raw_settings['settings']['scheduleSettings']
-        scoring_settings = self._raw_settings['settings']['scoringSettings']
-        status_settings = self._raw_settings['status']
+        schedule_settings = raw_settings['settings']['scheduleSettings']
+        scoring_settings = raw_settings['settings']['scoringSettings']
+        status_settings = raw_settings['status']
         
         playoffSeedingRule = schedule_settings['playoffSeedingRule']
         playoffSeedingRuleBy = schedule_settings['playoffSeedingRuleBy']
@@ -145,7 +335,7 @@ class ApiData():
         matchup_period_count = schedule_settings['matchupPeriodCount']
         
         # This ensures the playoff_week_start var references the week number (i.e. scoring period)
-        playoff_week_start = self._playoff_week_start()
+        playoff_week_start = self._resolve('playoff_week_start')
         
         scoring_type = scoring_settings['scoringType']
         
@@ -178,10 +368,7 @@ class ApiData():
     def pull_divisions(self, return_df: bool=True) -> [pd.DataFrame, None]:
         """ Return dataframe containing the name and size of each division. """
         
-        if self._raw_settings is None:
-            self._raw_settings = self._pull_raw_settings()
-        
-        divisions_list = self._raw_settings['settings']['scheduleSettings']['divisions']
+        divisions_list = self._resolve('_raw_settings')['settings']['scheduleSettings']['divisions']
     
         divisions = []
         for division in divisions_list:
@@ -211,24 +398,18 @@ class ApiData():
         attributes for the first one associated with the team.
         """
         
-        if self._raw_teams is None:
-            self._raw_teams = self._pull_raw_teams()
-            
         teams = []
-        for team in self._raw_teams['teams']:
+        for team in self._resolve('_raw_teams')['teams']:
             team_id = team['id']
             manager_id = team['owners'][0]
             team_name = team['location'].strip() + ' ' + team['nickname'].strip()
-            
-            # Single quotes in the name are causing db load issue
-            team_name = team_name.replace("'", "")
             team_name = team_name.strip()
             
             teams.append([team_id, manager_id, team_name])
             
         df = pd.DataFrame(teams, columns=['team_id', 'manager_id', 'team_name'])
         
-        member_df = self.pull_members()
+        member_df = self._resolve('members')
         df = pd.merge(df, member_df, on='manager_id', how='left')
         
         df['season_id'] = self.season_id
@@ -244,15 +425,11 @@ class ApiData():
     def pull_members(self) -> pd.DataFrame:
         """ 
         Returns dataframe containing Member attributes.
-        Note: Not going to include this as an attribute yet since it 
-        will be included the teams df.        
+        Note: This isn't loaded as its own table since it's included in the teams df.
         """
         
-        if self._raw_teams is None:
-            self._raw_teams = self._pull_raw_teams()
-            
         members = []
-        for member in self._raw_teams['members']:
+        for member in self._resolve('_raw_teams')['members']:
             manager_id = member['id']
             espn_name = member['displayName']
             manager_name = member['firstName'] + ' ' + member['lastName']
@@ -267,14 +444,11 @@ class ApiData():
     def pull_weeks(self, return_df: bool=True) -> [pd.DataFrame, None]:
         """ Returns dataframe containing the scoring period mapped to matchup period. """
         
-        if self._raw_settings is None:
-            self._raw_settings = self._pull_raw_settings()
-            
-        schedule_settings = self._raw_settings['settings']['scheduleSettings']
+        schedule_settings = self._resolve('_raw_settings')['settings']['scheduleSettings']
             
         num_matchups = schedule_settings['matchupPeriodCount']
         
-        reg_season_matchups_pds = self._raw_settings['settings']['scheduleSettings']['matchupPeriods']
+        reg_season_matchups_pds = schedule_settings['matchupPeriods']
         
         scoring_pd_list = []
         for matchup_pd, scoring_pds in reg_season_matchups_pds.items():
@@ -306,6 +480,11 @@ class ApiData():
 
         return df
     
+    def close(self) -> None:
+        """ Closes the connections held by the session. """
+        
+        self.session.close()
+    
     def clear_json_attrs(self):
         ''' 
         Clears all the atttributes that hold the json data pulled from the API. 
@@ -315,19 +494,144 @@ class ApiData():
         for attr in attrs:
             self.__dict__[attr] = None
     
-    def _pull_raw_matchup(self) -> list:
+    def _pull_raw_matchup(self, matchup_period_ids: list=None) -> list:
+        """
+        Pulls the schedule. matchup_period_ids limits the pull to those matchup periods
+        (and their scoring periods) through the X-Fantasy-Filter header.
+        """
+        
+        if self.single_request and matchup_period_ids is None:
+            return self._pull_raw_all()['_raw_matchup']
+        
         params = [["view", "mMatchup"], ["view", "mMatchupScore"]]
-        return self.pull_api_data(params=params)
+        filters = None
+        
+        if matchup_period_ids is not None:
+            matchup_period_ids = [int(matchup_period_id) for matchup_period_id in matchup_period_ids]
+            filters = {'schedule': {'filterMatchupPeriodIds': {'value': matchup_period_ids}}}
+            
+            # week_number and matchupPeriodId are currently treated as the same thing
+            if len(matchup_period_ids) == 1:
+                params.append(['scoringPeriodId', matchup_period_ids[0]])
+        
+        d = self.pull_api_data(params=params, filters=filters)
+        
+        if d is None:
+            return None
+        
+        return self._slim_schedule(d)
     
-    def _pull_raw_settings(self) -> list:
+    def _pull_raw_settings(self, settings_only: bool=False) -> list:
+        """ settings_only pulls just the mSettings view even if single_request is set """
+        
+        if self.single_request and not settings_only:
+            return self._pull_raw_all()['_raw_settings']
+        
         return self.pull_api_data(params=(("view", "mSettings")))
     
     def _pull_raw_teams(self) -> list:
+        if self.single_request:
+            return self._pull_raw_all()['_raw_teams']
+        
         params = [['view', 'mTeams'], ['view', 'mTeam']]
         return self.pull_api_data(params=params)
     
+    def _pull_raw_all(self) -> dict:
+        """ 
+        Pulls every view in a single request and splits the combined payload
+        across the raw attributes that haven't been pulled yet.
+        """
+        
+        params = [['view', view] for view in ALL_VIEWS]
+        d = self.pull_api_data(params=params)
+        
+        if d is None:
+            raise espn_scheduler.EspnUnavailable("ESPN didn't return league %s season %s" % (self.league_id, 
+                                                                                          self.season_id))
+        
+        return self.set_raw_data(d)
+    
+    def set_raw_data(self, d: dict) -> dict:
+        """ 
+        Splits a payload containing every view in ALL_VIEWS across the raw attributes
+        that haven't been pulled yet, so the "pull_" methods don't request them again.
+        Raises ValueError if the payload is missing any of them.
+        """
+        
+        missing_keys = [key for payload_keys in RAW_PAYLOAD_KEYS.values() for key in payload_keys if key not in d]
+        if len(missing_keys) > 0:
+            raise ValueError("League %s season %s payload is missing %s" % (self.league_id, self.season_id, 
+                                                                           ', '.join(missing_keys)))
+        
+        raw_data = {}
+        for raw_attr, payload_keys in RAW_PAYLOAD_KEYS.items():
+            raw_data[raw_attr] = {key: d[key] for key in payload_keys}
+            
+        raw_data['_raw_matchup'] = self._slim_schedule(raw_data['_raw_matchup'])
+        
+        for raw_attr in RAW_PAYLOAD_KEYS:
+            if getattr(self, raw_attr) is None:
+                setattr(self, raw_attr, raw_data[raw_attr])
+        
+        return raw_data
+    
+    def _slim_schedule(self, raw_matchup: dict) -> dict:
+        """ 
+        Returns the schedule with only the fields standings.create_matchup_df reads so 
+        the per-scoring-period detail isn't held onto.
+        """
+        
+        schedule = []
+        for matchup_dict in raw_matchup['schedule']:
+            slim_matchup = {'matchupPeriodId': matchup_dict['matchupPeriodId']}
+            
+            # bye weeks are missing the "away" key
+            for side in ['home', 'away']:
+                if side in matchup_dict:
+                    slim_matchup[side] = {key: matchup_dict[side][key] for key in ['teamId', 'totalPoints']
+                                          if key in matchup_dict[side]}
+                    
+            schedule.append(slim_matchup)
+        
+        return {'schedule': schedule}
+    
+    def _resolve(self, attr: str):
+        """ 
+        Returns the attribute, building it (after the attributes it's built from) if it hasn't been yet. 
+        Threads asking for the same attribute wait for the one building it.
+        Raises espn_scheduler.EspnUnavailable if a raw attribute couldn't be pulled.
+        """
+        
+        value = getattr(self, attr)
+        if value is not None:
+            return value
+        
+        build_method, dependencies = PULL_DEPENDENCIES[attr]
+        for dependency in dependencies:
+            self._resolve(dependency)
+        
+        with self._locks[attr]:
+            value = getattr(self, attr)
+            if value is None:
+                start = time.perf_counter()
+                value = getattr(self, build_method)()
+                
+                # everything built on a raw attribute would fail on the None
+                if value is None and attr in RAW_PAYLOAD_KEYS:
+                    raise espn_scheduler.EspnUnavailable("ESPN didn't return %s for league %s season %s" % (
+                        attr, self.league_id, self.season_id))
+                
+                setattr(self, attr, value)
+                
+                self.build_log.append((attr, time.perf_counter() - start))
+            
+        return value
+    
     def _playoff_week_start(self) -> int:
-        lookup = self.pull_weeks()
+        return self._resolve('playoff_week_start')
+    
+    def _pull_playoff_week_start(self) -> int:
+        lookup = self._resolve('weeks')
         playoff_periods = lookup['week_number'].loc[lookup['reg_season_flag'] == 0]
         playoff_week_start = playoff_periods.tolist()[0]
         
@@ -366,10 +670,97 @@ class ApiData():
         return list_var
 
 
+
+class LeagueHistory():
+    """ 
+    Pulls every season in the league's history (i.e. the leagueHistory endpoint used
+    for the seasons before 2020) in one request and builds the same dataframes as
+    ApiData for all of them at once.
+    """
+    
+    def __init__(self, league_id: int=48347143, standings_metrics: dict=None, 
+                 session: requests.Session=None, use_cache: bool=True):
+        self.league_id = league_id
+        self.standings_metrics = standings_metrics
+        self.use_cache = use_cache
+        
+        if session is None:
+            self.session = create_session()
+        else:
+            self.session = session
+            
+        # ApiData for each season in the history keyed by season_id
+        self.seasons = {}
+        
+        self.scores = None
+        self.matchups = None
+        self.settings = None
+        self.divisions = None
+        self.teams = None
+        self.weeks = None
+        
+    def pull_api_data(self, params: list=None) -> [list, None]:
+        """ Returns the list of season JSON objects for the whole league history. """
+        
+        if params is None:
+            params = []
+        
+        url = ESPN_BASE_URL + "/apis/v3/games/ffl/leagueHistory/" + str(self.league_id)
+        url = add_params_to_url(url, params)
+        
+        if self.use_cache:
+            # The history grows each time a season wraps up, so it's never treated as complete
+            return espn_cache.cached_get(self.session, url, 'history', self.league_id, params, 
+                                         complete=False)
+        
+        r = espn_scheduler.scheduler.get(self.session, url)
+        
+        if r.status_code != 200:
+            r.close()
+    
+            return None
+        
+        d = r.json()
+        r.close()
+        
+        return d
+    
+    def pull_all_data(self, season_ids: list=None, clear_json: bool=True) -> None:
+        """ 
+        Updates the seasons attribute along with the scores, matchups, settings, divisions, teams and 
+        weeks attributes (stacked across every season). season_ids limits which seasons are kept.
+        """
+        
+        raw_history = self.pull_api_data(params=[['view', view] for view in ALL_VIEWS])
+        if raw_history is None:
+            return None
+        
+        for raw_season in raw_history:
+            season_id = raw_season['seasonId']
+            if season_ids is not None and season_id not in season_ids:
+                continue
+            
+            espn_data = ApiData(season_id, standings_metrics=self.standings_metrics, 
+                                league_id=self.league_id, session=self.session, 
+                                use_cache=self.use_cache)
+            espn_data.set_raw_data(raw_season)
+            espn_data.pull_all_data(clear_json=clear_json)
+            
+            self.seasons[season_id] = espn_data
+            
+        for attr in TABLE_ATTRS:
+            dfs = [getattr(espn_data, attr) for espn_data in self.seasons.values()]
+            
+            if len(dfs):
+                setattr(self, attr, pd.concat(dfs, ignore_index=True))
+                
+        return None
+
+
 if __name__ == '__main__':
     pd.set_option('display.max_columns', 50)
     
-    espn_data = ApiData(2020, league_id=48347143)
+    espn_data = ApiData(2020, league_id=48347143, single_request=True)
     # espn_data.pull_all_data()
     espn_data.pull_scores(return_df=False)
     
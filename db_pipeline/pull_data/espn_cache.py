@@ -0,0 +1,153 @@
+'''
+On-disk cache for the JSON pulled from the ESPN API.
+
+Responses are keyed on the season, league and the (normalized) params used for the pull.
+Seasons that are over never change, so they're never refetched. The current season
+is refetched once its TTL runs out, and is revalidated with ETag/Last-Modified when
+ESPN provides them so that an unchanged payload doesn't need downloaded again.
+The cache is bypassed while fixtures are being recorded (see espn_fixtures) so every pull
+reaches ESPN and gets recorded.
+'''
+
+import os
+import json
+import time
+import hashlib
+import threading
+from datetime import date
+
+import espn_scheduler
+import espn_fixtures
+
+
+CACHE_DIR = os.environ.get('ESPN_CACHE_DIR',
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), '.espn_cache'))
+
+# Number of seconds the current season's responses are served before being revalidated
+CURRENT_SEASON_TTL = int(os.environ.get('ESPN_CACHE_TTL', 300))
+
+
+def season_complete(season_id: int) -> bool:
+    """
+    Returns True once the season (including the playoffs) is over.
+    The NFL season wraps up in February, so March 1st is used as the cutoff.
+    """
+
+    return date.today() >= date(season_id + 1, 3, 1)
+
+
+def cache_key(season_id: int, league_id: int, params: list, fantasy_filter: str=None) -> str:
+    """
+    Returns the file name used to cache a pull. The views are de-duplicated and sorted
+    so pulls that ask for the same views in a different order share an entry.
+    fantasy_filter is the X-Fantasy-Filter header sent with the pull (if any).
+    """
+
+    views = sorted(set(str(param[1]) for param in params if str(param[0]) == 'view'))
+    other_params = sorted((str(param[0]), str(param[1])) for param in params if str(param[0]) != 'view')
+
+    normalized_params = json.dumps([views, other_params, fantasy_filter])
+    params_hash = hashlib.sha1(normalized_params.encode('utf-8')).hexdigest()[:16]
+
+    return f'{season_id}_{league_id}_{params_hash}.json'
+
+
+def read_cache(key: str, cache_dir: str=None) -> [dict, None]:
+    """ Returns the cached entry for a key or None if it hasn't been cached. """
+
+    if cache_dir is None:
+        cache_dir = CACHE_DIR
+
+    try:
+        with open(os.path.join(cache_dir, key), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_cache(key: str, entry: dict, cache_dir: str=None) -> None:
+    """
+    Writes an entry to the cache. Each writer uses its own temp file which is swapped in
+    so readers never see a partial write.
+    """
+
+    if cache_dir is None:
+        cache_dir = CACHE_DIR
+
+    os.makedirs(cache_dir, exist_ok=True)
+
+    path = os.path.join(cache_dir, key)
+    tmp_path = path + '.' + str(os.getpid()) + '_' + str(threading.get_ident()) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(entry, f)
+
+    os.replace(tmp_path, path)
+
+
+def cached_get(session, url: str, season_id: int, league_id: int, params: list,
+               ttl: int=None, cache_dir: str=None, headers: dict=None,
+               complete: bool=None) -> [dict, list, None]:
+    """
+    Returns the JSON for the url, using the cached copy when it's still fresh.
+    headers are sent along with the request (e.g. X-Fantasy-Filter).
+    complete overrides season_complete for pulls that aren't for a single season.
+    Returns None if ESPN responds with anything other than a 200 (or a 304 for a cached entry) that isn't
+    worth retrying. espn_scheduler.EspnUnavailable is raised once it's run out of retries.
+    """
+
+    if ttl is None:
+        ttl = CURRENT_SEASON_TTL
+
+    if headers is None:
+        headers = {}
+
+    if complete is None:
+        complete = season_complete(season_id)
+
+    key = cache_key(season_id, league_id, params, fantasy_filter=headers.get('X-Fantasy-Filter'))
+
+    # a cached (or revalidated) response never reaches the recorder, which would leave it out of the fixtures
+    if espn_fixtures.RECORD_DIR is None:
+        entry = read_cache(key, cache_dir=cache_dir)
+    else:
+        entry = None
+
+    if entry is not None:
+        if entry['season_complete'] or time.time() - entry['fetched_at'] < ttl:
+            return entry['data']
+
+    # Revalidate the stale entry rather than downloading it again if ESPN supports it
+    headers = dict(headers)
+    if entry is not None:
+        if entry.get('etag') is not None:
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified') is not None:
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    r = espn_scheduler.scheduler.get(session, url, headers=headers)
+
+    if r.status_code == 304 and entry is not None:
+        r.close()
+        entry['fetched_at'] = time.time()
+        entry['season_complete'] = complete
+        write_cache(key, entry, cache_dir=cache_dir)
+
+        return entry['data']
+
+    if r.status_code != 200:
+        r.close()
+
+        return None
+
+    data = r.json()
+    entry = {'url': url,
+             'fetched_at': time.time(),
+             'season_complete': complete,
+             'etag': r.headers.get('ETag'),
+             'last_modified': r.headers.get('Last-Modified'),
+             'data': data}
+
+    r.close()
+    write_cache(key, entry, cache_dir=cache_dir)
+
+    return data
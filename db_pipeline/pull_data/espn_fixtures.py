@@ -0,0 +1,71 @@
+'''
+Records ESPN API responses as fixtures so they can be replayed by mock_espn_server.
+
+Set ESPN_RECORD_DIR to write every successful response that goes through espn_scheduler
+into that directory. espn_cache doesn't serve anything while it's set, so a warm cache doesn't
+leave pulls out of the fixtures. Fixtures are keyed on the path and (sorted) query string of the
+request, so they can be served back no matter which host the requests are pointed at.
+'''
+
+import os
+import json
+import hashlib
+import threading
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+
+RECORD_DIR = os.environ.get('ESPN_RECORD_DIR')
+
+# Headers worth replaying. ETag/Last-Modified are needed to exercise cache revalidation
+RECORD_HEADERS = ['Content-Type', 'ETag', 'Last-Modified']
+
+
+def fixture_key(url: str, fantasy_filter: str=None) -> str:
+    """
+    Returns the fixture file name for a url (or just its path and query string).
+    The query params are sorted since their order doesn't change what ESPN returns.
+    fantasy_filter is the X-Fantasy-Filter header sent with the request (if any).
+    """
+
+    split_url = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(split_url.query, keep_blank_values=True)))
+
+    request_key = split_url.path + '?' + query
+    if fantasy_filter is not None:
+        request_key = request_key + '#' + fantasy_filter
+
+    key_hash = hashlib.sha1(request_key.encode('utf-8')).hexdigest()[:16]
+
+    return f'{key_hash}.json'
+
+
+def record_response(url: str, r, record_dir: str=None, fantasy_filter: str=None) -> None:
+    """ Writes the response for a url to the fixture directory. """
+
+    if record_dir is None:
+        record_dir = RECORD_DIR
+
+    os.makedirs(record_dir, exist_ok=True)
+
+    fixture = {'url': url,
+               'fantasy_filter': fantasy_filter,
+               'status': r.status_code,
+               'headers': {header: r.headers[header] for header in RECORD_HEADERS if header in r.headers},
+               'body': r.json()}
+
+    path = os.path.join(record_dir, fixture_key(url, fantasy_filter=fantasy_filter))
+    tmp_path = path + '.' + str(os.getpid()) + '_' + str(threading.get_ident()) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(fixture, f)
+
+    os.replace(tmp_path, path)
+
+
+def read_fixture(url: str, record_dir: str, fantasy_filter: str=None) -> [dict, None]:
+    """ Returns the recorded fixture for a url or None if it was never recorded. """
+
+    try:
+        with open(os.path.join(record_dir, fixture_key(url, fantasy_filter=fantasy_filter)), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
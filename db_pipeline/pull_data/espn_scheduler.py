@@ -0,0 +1,135 @@
+'''
+Schedules the requests sent to the ESPN API.
+
+Every request in the process goes through the same scheduler, which caps the request rate
+(token bucket) and how many requests are in flight at once. Requests that are rate limited (429)
+or fail on ESPN's end are retried with exponential backoff and jitter, honoring Retry-After.
+A 429 also pauses every other caller since ESPN applies the limit to all of them.
+EspnUnavailable is raised once the retries run out.
+'''
+
+import os
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+
+import requests
+
+import espn_fixtures
+
+
+# Statuses worth retrying - anything else (e.g. 401 for a private league) won't change on a retry
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class EspnUnavailable(Exception):
+    """ Raised when ESPN couldn't be reached or kept failing after every retry """
+
+
+class RequestScheduler():
+
+    def __init__(self, rate: float=5, burst: int=5, max_concurrent: int=4, max_retries: int=5,
+                 backoff_base: float=1, backoff_max: float=60):
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._tokens = burst
+        self._last_refill = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+
+    def get(self, session: requests.Session, url: str, **kwargs) -> requests.Response:
+        """
+        Returns the response for the url, retrying rate limited and server errors and connection problems.
+        Raises EspnUnavailable once the retries run out. Other error responses (e.g. 401) are returned.
+        """
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._semaphore:
+                    self._acquire_token()
+                    r = session.get(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                if attempt == self.max_retries:
+                    raise EspnUnavailable("%s failed after %s attempts: %s" % (url, attempt + 1, error)) from error
+
+                time.sleep(self._backoff(attempt))
+                continue
+
+            if r.status_code in RETRY_STATUSES and attempt == self.max_retries:
+                r.close()
+                raise EspnUnavailable("%s returned %s after %s attempts" % (url, r.status_code, attempt + 1))
+
+            if r.status_code not in RETRY_STATUSES:
+                if espn_fixtures.RECORD_DIR is not None and r.status_code == 200:
+                    fantasy_filter = (kwargs.get('headers') or {}).get('X-Fantasy-Filter')
+                    espn_fixtures.record_response(url, r, fantasy_filter=fantasy_filter)
+
+                return r
+
+            delay = self._retry_after(r)
+            if delay is None:
+                delay = self._backoff(attempt)
+
+            if r.status_code == 429:
+                self._pause(delay)
+
+            r.close()
+            time.sleep(delay)
+
+    def _acquire_token(self) -> None:
+        """ Waits until a token is available (and any 429 pause is over) and takes it. """
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+
+                self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return None
+
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+
+            time.sleep(wait)
+
+    def _pause(self, delay: float) -> None:
+        """ Stops every caller from sending requests for delay seconds. """
+
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+    def _backoff(self, attempt: int) -> float:
+        """ Returns an exponential backoff delay with full jitter. """
+
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _retry_after(self, r: requests.Response) -> [float, None]:
+        """ Returns the delay requested by the Retry-After header (seconds or an HTTP date) if sent. """
+
+        retry_after = r.headers.get('Retry-After')
+        if retry_after is None:
+            return None
+
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+
+        return min(max(delay, 0), self.backoff_max)
+
+
+# Shared by every caller in the process so the limits apply to all of them together
+scheduler = RequestScheduler(rate=float(os.environ.get('ESPN_REQUEST_RATE', 5)),
+                             burst=int(os.environ.get('ESPN_REQUEST_BURST', 5)),
+                             max_concurrent=int(os.environ.get('ESPN_MAX_CONCURRENT', 4)))
@@ -5,6 +5,40 @@ import numpy as np
 # from api_data import pull_data
 
 
+CUM_METRICS_DICT = {'score': 'cum_score', 'win_ind': 'cum_wins', 'all_play_wins': 'cum_all_play_wins',
+                    'all_play_losses': 'cum_all_play_losses', 'tie_ind': 'cum_ties', 'loss_ind': 'cum_losses',
+                    'total_wins': 'cum_total_wins', 'all_play_wins_int': 'cum_all_play_wins_int',
+                    'all_play_losses_int': 'cum_all_play_losses_int',
+                    'all_play_ties_int': 'cum_all_play_ties_int', 'score_opp': 'cum_score_opp'}
+
+# Metrics that are always whole numbers, so their cumulative metrics are kept as ints. 
+# The rest (e.g. all_play_wins, which splits ties) are floats
+COUNT_METRICS = ['win_ind', 'loss_ind', 'tie_ind', 'all_play_wins_int', 'all_play_losses_int', 
+                 'all_play_ties_int']
+
+# Renames applied to the final standings for the DB - DB_RENAME_VARS_FIRST needs applied first
+DB_RENAME_VARS_FIRST = {'all_play_wins': 'all_play_wlt_points', 
+                        'cum_all_play_wins': 'cum_all_play_wlt_points'}
+
+DB_RENAME_VARS = {
+    'total_wins': 'wlt_points',  
+    'all_play_wins_int': 'all_play_wins', 
+    'all_play_losses_int': 'all_play_losses', 
+    'all_play_ties_int': 'all_play_ties', 
+    'cum_total_wins': 'cum_wlt_points', 
+    'cum_all_play_wins_int': 'cum_all_play_wins', 
+    'cum_all_play_losses_int': 'cum_all_play_losses', 
+    'cum_all_play_ties_int': 'cum_all_play_ties', 
+    'cum_all_play_wins_per_week': 'cum_all_play_wlt_points_per_week', 
+    'cum_wlt': 'record', 
+    'cum_all_play_wlt_int': 'all_play_record'
+}
+
+# Maps the DB names back to the ones used while calculating the standings
+DB_TO_CALC_VARS = {db_var: calc_var for calc_var, db_var 
+                   in list(DB_RENAME_VARS_FIRST.items()) + list(DB_RENAME_VARS.items())}
+
+
 def survivor_challenge(df_matchup_data, week_number):
     """
     Returns a DataFrame containing the remaining teams left in the survivor challenge through
@@ -134,12 +168,16 @@ def add_win_loss_ind(matchup_data):
     return matchup_data
 
 
-def add_all_play(matchup_data):
-    """ Returns Week/Team level dataframe with all play wins and losses added """
+def add_all_play(matchup_data, number_of_teams=None):
+    """
+    Returns Week/Team level dataframe with all play wins and losses added. number_of_teams defaults
+    to the number of teams in matchup_data, which needs passed when it only holds some of the weeks
+    """
 
     matchup_data = matchup_data.copy()
 
-    number_of_teams = len(matchup_data.groupby(['team_id'], as_index=False).size().index)
+    if number_of_teams is None:
+        number_of_teams = len(matchup_data.groupby(['team_id'], as_index=False).size().index)
 
     # sorting by UNIQUE week_number/scores to handle multi team ties more efficiently
     unique_week_scores = matchup_data.groupby(['week_number', 'score'], as_index=False).size()
@@ -179,12 +217,6 @@ def add_cum_metrics(matchup_data, by_group=None, cum_group=None):
 
     if cum_group is None:
         cum_group = ['week_number']
-    
-    cum_metrics_dict = {'score': 'cum_score', 'win_ind': 'cum_wins', 'all_play_wins': 'cum_all_play_wins',
-                        'all_play_losses': 'cum_all_play_losses', 'tie_ind': 'cum_ties', 'loss_ind': 'cum_losses',
-                        'total_wins': 'cum_total_wins', 'all_play_wins_int': 'cum_all_play_wins_int',
-                        'all_play_losses_int': 'cum_all_play_losses_int',
-                        'all_play_ties_int': 'cum_all_play_ties_int', 'score_opp': 'cum_score_opp'}
 
     matchup_data = matchup_data.copy()
 
@@ -192,12 +224,74 @@ def add_cum_metrics(matchup_data, by_group=None, cum_group=None):
 
     matchup_data.sort_values(by=by_cum_group, inplace=True)
 
-    for cum_metric, new_col_name in cum_metrics_dict.items():
+    for cum_metric, new_col_name in CUM_METRICS_DICT.items():
         matchup_data[new_col_name] = matchup_data.groupby(by_group)[cum_metric].cumsum()
 
     return matchup_data
 
 
+def add_cum_metrics_from_prior(matchup_data, prior_cum_data, by_group=None):
+    """
+    Returns one week of Team level data with cumulative metrics added to it by adding the week's
+    metrics onto the prior week's cumulative metrics rather than summing every week again
+    """
+
+    if by_group is None:
+        by_group = ['team_id']
+
+    matchup_data = matchup_data.copy()
+
+    prior_cum_cols = list(CUM_METRICS_DICT.values())
+    prior_cum_data = prior_cum_data[by_group + prior_cum_cols]
+    prior_cum_data = prior_cum_data.rename(columns={col: 'prior_' + col for col in prior_cum_cols})
+
+    # teams without a prior week (i.e. week 1) start from 0
+    matchup_data = pd.merge(matchup_data, prior_cum_data, on=by_group, how='left')
+
+    # The week's dtype can't be used for the sums since a week without any ties would turn the
+    # prior .5s into ints
+    for cum_metric, new_col_name in CUM_METRICS_DICT.items():
+        cum_values = matchup_data['prior_' + new_col_name].fillna(0) + matchup_data[cum_metric]
+        matchup_data[new_col_name] = cum_values.astype('int' if cum_metric in COUNT_METRICS else 'float')
+
+    matchup_data.drop(['prior_' + col for col in prior_cum_cols], axis=1, inplace=True)
+    matchup_data.sort_values(by=by_group + ['week_number'], inplace=True)
+
+    return matchup_data
+
+
+class MissingPriorWeek(ValueError):
+    """ Raised when the prior week's rows needed to build on are missing """
+
+
+def prior_cum_state(prior_scores, week_number):
+    """
+    Returns the Team level cumulative metrics through week_number. prior_scores can be a
+    pull_standings df or the rows pulled from the SCORES table since both use the DB names
+    """
+
+    cum_cols = list(CUM_METRICS_DICT.values())
+
+    if prior_scores is None:
+        return pd.DataFrame(columns=['team_id'] + cum_cols).astype('float')
+
+    prior_scores = prior_scores.loc[prior_scores['week_number'] == week_number].copy()
+    prior_scores.rename(columns=DB_TO_CALC_VARS, inplace=True)
+
+    # NUMERIC columns pulled from the DB come back as Decimals
+    for col in cum_cols:
+        if col in prior_scores.columns:
+            prior_scores[col] = prior_scores[col].astype('float')
+
+    # the DB doesn't keep cum_all_play_losses, but every all play matchup is either a win, loss or tie
+    prior_scores['cum_all_play_losses'] = prior_scores['cum_all_play_wins_int'] \
+                                          + prior_scores['cum_all_play_losses_int'] \
+                                          + prior_scores['cum_all_play_ties_int'] \
+                                          - prior_scores['cum_all_play_wins']
+
+    return prior_scores[['team_id'] + cum_cols]
+
+
 def merge_on_team_data(matchup_data, team_df):
     """ Returns Week/Team level dataframe with team information merged on """
 
@@ -297,6 +391,82 @@ def add_update_additional_metrics(df_matchup_data):
     return df_matchup_data
 
 
+def compile_tier_plan(rank_metrics_by_week_range):
+    """
+    Returns a list of (rank_lower, rank_upper, rank_metrics, ascending) tuples - one for each
+    tier of rank_metrics_by_week_range - so the ranges are only parsed once per season
+    """
+
+    tier_plan = []
+    for rank_range, rank_sort_list in rank_metrics_by_week_range.items():
+        rank_range_lower = int(rank_range[0:rank_range.find('-')].strip())
+        rank_range_upper = int(rank_range[rank_range.find('-') + 1:].strip())
+
+        rank_metric_list = list(rank_sort_list[0])
+        ascending_indicator_list = list(rank_sort_list[1])
+
+        tier_plan.append((rank_range_lower, rank_range_upper, rank_metric_list, ascending_indicator_list))
+
+    return tier_plan
+
+
+def _sort_key(values, ascending=True):
+    """ Returns a float array that sorts the same way as values (NaNs last) in the given direction """
+
+    if np.issubdtype(values.dtype, np.number):
+        key = values.astype('float')
+    else:
+        codes, _ = pd.factorize(values, sort=True)
+        key = np.where(codes == -1, np.nan, codes).astype('float')
+
+    if not ascending:
+        key = -key
+
+    return key
+
+
+def assign_standings(df_matchup_data, tier_plan):
+    """
+    Returns an array of standings aligned to the rows of df_matchup_data. Every week_number is
+    ranked on its own according to the tier plan, and rows the plan doesn't reach are set to 0
+    """
+
+    week_key = _sort_key(df_matchup_data['week_number'].to_numpy())
+    standings = np.zeros(len(df_matchup_data), dtype='int')
+
+    # rows that still need a rank along with their order coming out of the previous tier
+    remaining = np.arange(len(df_matchup_data))
+    prior_order = np.arange(len(df_matchup_data))
+
+    for rank_range_lower, rank_range_upper, rank_metric_list, ascending_indicator_list in tier_plan:
+        if len(remaining) == 0:
+            break
+
+        # np.lexsort uses the LAST key as the primary one, so the keys are stacked in reverse.
+        # Sorting on the prior order last keeps ties in the same order as the previous tier
+        sort_keys = [prior_order]
+        for rank_metric, ascending in reversed(list(zip(rank_metric_list, ascending_indicator_list))):
+            metric_values = df_matchup_data[rank_metric].to_numpy()[remaining]
+            sort_keys.append(_sort_key(metric_values, ascending))
+        sort_keys.append(week_key[remaining])
+
+        sorted_rows = remaining[np.lexsort(sort_keys)]
+
+        # position of each row within its week once sorted
+        sorted_weeks = week_key[sorted_rows]
+        week_starts = np.flatnonzero(np.r_[True, sorted_weeks[1:] != sorted_weeks[:-1]])
+        week_sizes = np.diff(np.r_[week_starts, len(sorted_rows)])
+        week_position = np.arange(len(sorted_rows)) - np.repeat(week_starts, week_sizes)
+
+        in_tier = week_position < rank_range_upper - rank_range_lower + 1
+        standings[sorted_rows[in_tier]] = rank_range_lower + week_position[in_tier]
+
+        remaining = sorted_rows[~in_tier]
+        prior_order = week_position[~in_tier]
+
+    return standings
+
+
 def add_all_standings(df_matchup_data, rank_metrics_by_week_range=None):
     """ Returns Week/Team level dataframe that includes week level standings """
 
@@ -306,23 +476,22 @@ def add_all_standings(df_matchup_data, rank_metrics_by_week_range=None):
     df_matchup_data = df_matchup_data.copy()
     
     reg_season = df_matchup_data.loc[df_matchup_data['week_type'] == 'Regular']
-    weeks = reg_season[['week_number']].sort_values(by='week_number', inplace=False, ascending=False)
-    num_weeks_reg_season = weeks['week_number'].tolist()[0]
+    num_weeks_reg_season = reg_season['week_number'].max()
 
-    columns = list(df_matchup_data.columns)
-    columns.append('standings')
+    tier_plan = compile_tier_plan(rank_metrics_by_week_range)
 
-    # Shell for stacking
-    df_matchup_data_stacked = pd.DataFrame(columns=columns)
+    # every regular season week is ranked at once rather than one add_standings call per week
+    df_reg_season = df_matchup_data.loc[(df_matchup_data['week_number'] >= 1) &
+                                        (df_matchup_data['week_number'] <= num_weeks_reg_season)].copy()
+    df_reg_season['standings'] = assign_standings(df_reg_season, tier_plan)
 
-    for week_number in range(1, num_weeks_reg_season + 1):
-        df_matchup_data_w_standings = add_standings(df_matchup_data, week_number, rank_metrics_by_week_range)
+    # teams outside of every tier range don't receive standings
+    df_reg_season = df_reg_season.loc[df_reg_season['standings'] > 0]
 
-        df_matchup_data_stacked = df_matchup_data_stacked.append(df_matchup_data_w_standings)
+    df_reg_season.sort_values(by=['week_number', 'standings'], inplace=True)
+    df_reg_season.reset_index(inplace=True, drop=True)
 
-    df_matchup_data_stacked.reset_index(inplace=True, drop=True)
-
-    return df_matchup_data_stacked
+    return df_reg_season
 
 
 def pull_standings(matchup_data, playoff_week_start, rank_metrics_by_week_range=None):
@@ -339,28 +508,145 @@ def pull_standings(matchup_data, playoff_week_start, rank_metrics_by_week_range=
     df_updated_matchup_data = add_update_additional_metrics(df_matchup_data_w_cum)
     df_final = add_all_standings(df_updated_matchup_data,
                                  rank_metrics_by_week_range=rank_metrics_by_week_range)
-    
+
+    return rename_vars_for_db(df_final)
+
+
+def pull_matchups(matchup_data, playoff_week_start):
+    """ Returns the Week/Team level scores of every week without any of the metrics built on them """
+
+    df_matchup_data = create_matchup_df(matchup_data, playoff_week_start=playoff_week_start)
+    df_expanded_matchup = expand_matchup_data(df_matchup_data)
+
+    keep_vars = ['week_number', 'team_id', 'team_id_opp', 'score', 'score_opp', 'home_or_away']
+
+    return df_expanded_matchup[keep_vars].reset_index(drop=True)
+
+
+def iter_matchup_rows(matchup_data):
+    """
+    Yields a (week_number, team_id, team_id_opp, score, score_opp, home_or_away) tuple for each team
+    in each matchup straight from the schedule - the same rows as expand_matchup_data without any
+    dataframes. Teams with a bye get -1 and 0 for their opponent, and sides missing a teamId or
+    totalPoints are skipped just as create_matchup_df does.
+    """
+
+    for matchup_dict in matchup_data['schedule']:
+        week_number = int(matchup_dict['matchupPeriodId'])
+
+        sides = {}
+        for side in ['home', 'away']:
+            side_dict = matchup_dict.get(side, {})
+            if 'teamId' in side_dict and 'totalPoints' in side_dict:
+                sides[side] = (int(side_dict['teamId']), side_dict['totalPoints'])
+
+        for side, opp_side in [('home', 'away'), ('away', 'home')]:
+            if side not in sides:
+                continue
+
+            team_id, score = sides[side]
+            team_id_opp, score_opp = sides.get(opp_side, (-1, 0))
+
+            yield (week_number, team_id, team_id_opp, score, score_opp, side)
+
+
+def iter_standings(matchup_data, playoff_week_start, rank_metrics_by_week_range=None):
+    """
+    Yields the standings one regular season week at a time, matching pull_standings. Only a week's dataframes
+    and each team's cumulative metrics through the prior week are held at once, so memory doesn't
+    grow with the number of weeks.
+    """
+
+    if rank_metrics_by_week_range is None:
+        rank_metrics_by_week_range = {'1-12': [['cum_total_wins', 'cum_score'], [False, False]]}
+
+    # the schedule is read once, grouping the regular season rows by week. All play losses are against
+    # every team in the season rather than just those in the week
+    team_ids = set()
+    rows_by_week = {}
+    for row in iter_matchup_rows(matchup_data):
+        team_ids.add(row[1])
+
+        if 1 <= row[0] < playoff_week_start:
+            rows_by_week.setdefault(row[0], []).append(row)
+
+    matchup_cols = ['week_number', 'team_id', 'team_id_opp', 'score', 'score_opp', 'home_or_away']
+    prior_cum_data = prior_cum_state(None, 0)
+
+    for week_number in sorted(rows_by_week):
+        week_rows = rows_by_week.pop(week_number)
+
+        df_week = pd.DataFrame(week_rows, columns=matchup_cols)
+        df_week['score'] = df_week['score'].astype('float')
+        df_week['score_opp'] = df_week['score_opp'].astype('float')
+        df_week['week_type'] = 'Regular'
+
+        df_week_w_wl = add_win_loss_ind(df_week)
+        df_week_w_all_play = add_all_play(df_week_w_wl, number_of_teams=len(team_ids))
+        df_week_w_cum = add_cum_metrics_from_prior(df_week_w_all_play, prior_cum_data)
+        df_updated_week = add_update_additional_metrics(df_week_w_cum)
+
+        # teams missing from the week carry their metrics through to the next one
+        cum_cols = ['team_id'] + list(CUM_METRICS_DICT.values())
+        prior_cum_data = pd.concat([prior_cum_data.loc[~prior_cum_data['team_id'].isin(df_updated_week['team_id'])],
+                                    df_updated_week[cum_cols]], ignore_index=True)
+
+        df_final = add_all_standings(df_updated_week, rank_metrics_by_week_range=rank_metrics_by_week_range)
+
+        yield rename_vars_for_db(df_final)
+
+
+def pull_standings_incremental(matchup_data, prior_scores, week_number, playoff_week_start,
+                               rank_metrics_by_week_range=None, number_of_teams=None):
+    """
+    Returns the standings for week_number only. prior_scores needs to contain the prior week's rows
+    from pull_standings or the SCORES table so that only the new week's matchups get processed.
+    number_of_teams defaults to the teams in matchup_data or prior_scores, like iter_standings.
+    Raises MissingPriorWeek if any team's prior week isn't in prior_scores.
+    """
+
+    if rank_metrics_by_week_range is None:
+        rank_metrics_by_week_range = {'1-12': [['cum_total_wins', 'cum_score'], [False, False]]}
+
+    week_schedule = [matchup_dict for matchup_dict in matchup_data['schedule']
+                     if matchup_dict['matchupPeriodId'] == week_number]
+
+    df_matchup_data = create_matchup_df({'schedule': week_schedule}, playoff_week_start=playoff_week_start)
+    df_expanded_matchup = expand_matchup_data(df_matchup_data)
+    df_matchup_data_w_wl = add_win_loss_ind(df_expanded_matchup)
+
+    # the cumulative metrics would quietly start over from 0 for any team without a prior week
+    prior_cum_data = prior_cum_state(prior_scores, week_number - 1)
+
+    # all play losses are against every team in the season rather than just those in the week
+    if number_of_teams is None:
+        team_ids = set(row[1] for row in iter_matchup_rows(matchup_data)) | set(prior_cum_data['team_id'])
+        number_of_teams = len(team_ids)
+
+    df_matchup_data_w_all_play = add_all_play(df_matchup_data_w_wl, number_of_teams=number_of_teams)
+    missing_team_ids = set(df_matchup_data_w_all_play['team_id']) - set(prior_cum_data['team_id'])
+    if week_number > 1 and len(missing_team_ids) > 0:
+        raise MissingPriorWeek("week %s is missing for teams %s" % (week_number - 1, sorted(missing_team_ids)))
+
+    df_matchup_data_w_cum = add_cum_metrics_from_prior(df_matchup_data_w_all_play, prior_cum_data)
+    df_updated_matchup_data = add_update_additional_metrics(df_matchup_data_w_cum)
+    df_final = add_all_standings(df_updated_matchup_data,
+                                 rank_metrics_by_week_range=rank_metrics_by_week_range)
+
+    return rename_vars_for_db(df_final)
+
+
+def rename_vars_for_db(df_final):
+    """ Returns the standings dataframe with its vars renamed to the SCORES table's columns """
+
+    df_final = df_final.copy()
+
     # This needs done first in order to retain these vars 
-    rename_vars = {'all_play_wins': 'all_play_wlt_points'
-                   , 'cum_all_play_wins': 'cum_all_play_wlt_points'}
-    df_final.rename(columns=rename_vars, inplace=True)
+    df_final.rename(columns=DB_RENAME_VARS_FIRST, inplace=True)
     
     # These conflict with other vars that need renamed for the DB
     df_final.drop(['all_play_losses' ,'cum_all_play_losses'], axis=1, inplace=True)
     
-    rename_vars = {
-    'total_wins': 'wlt_points',  
-    'all_play_wins_int': 'all_play_wins', 
-    'all_play_losses_int': 'all_play_losses', 
-    'all_play_ties_int': 'all_play_ties', 
-    'cum_total_wins': 'cum_wlt_points', 
-    'cum_all_play_wins_int': 'cum_all_play_wins', 
-    'cum_all_play_losses_int': 'cum_all_play_losses', 
-    'cum_all_play_ties_int': 'cum_all_play_ties', 
-    'cum_all_play_wins_per_week': 'cum_all_play_wlt_points_per_week', 
-    'cum_wlt': 'record', 
-    'cum_all_play_wlt_int': 'all_play_record'
-    }
-    df_final.rename(columns=rename_vars, inplace=True)
+    df_final.rename(columns=DB_RENAME_VARS, inplace=True)
 
     return df_final
@@ -0,0 +1,173 @@
+"""
+Schema of the tables the pipeline loads, built from the table_schemas definitions.
+
+The definitions are checked against the DB once per process (a single INFORMATION_SCHEMA query
+for every table), after which the column lists, types and primary keys are served from memory.
+"""
+
+import threading
+
+import pandas as pd
+import psycopg2
+
+from table_schemas import TABLE_SCHEMAS, create_partitions
+from helpers import on_commit
+
+
+# SQL type -> dtype the column is cast to before it's loaded
+SQL_TO_DTYPE = {'BIGINT': 'Int64', 'SMALLINT': 'Int64', 'INTEGER': 'Int64',
+                'NUMERIC': 'float64', 'DOUBLE PRECISION': 'float64', 'VARCHAR': 'object'}
+
+
+def sql_to_dtype(col_type: str) -> str:
+    """ Returns the dtype for a column type such as NUMERIC(5, 2) """
+
+    return SQL_TO_DTYPE.get(col_type.split('(')[0].strip().upper(), 'object')
+
+
+class TableSchema():
+
+    def __init__(self, name: str, columns: list, pkeys: list, partition_by: str=None):
+        self.name = name.lower()
+        self.columns = [col.lower() for col, _ in columns]
+        self.types = {col.lower(): col_type for col, col_type in columns}
+        self.dtypes = {col: sql_to_dtype(col_type) for col, col_type in self.types.items()}
+        self.pkeys = [pkey.lower() for pkey in pkeys]
+        self.partition_by = partition_by.lower() if partition_by is not None else None
+
+        # partition values known to exist
+        self.partitions = set()
+
+        # set to False by SchemaRegistry.verify if the table hasn't been created in the DB
+        self.exists = True
+
+    def project(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Returns df reduced to the table's columns (in the table's order) and cast to their dtypes.
+        Table columns that df doesn't have are left out.
+        """
+
+        cols = [col for col in self.columns if col in df.columns]
+
+        return df[cols].astype({col: self.dtypes[col] for col in cols})
+
+
+class SchemaRegistry():
+
+    def __init__(self, table_schemas: dict=None):
+        if table_schemas is None:
+            table_schemas = TABLE_SCHEMAS
+
+        self._tables = {table.lower(): TableSchema(table, schema['columns'], schema['pkeys'],
+                                                   partition_by=schema.get('partition_by'))
+                        for table, schema in table_schemas.items()}
+
+        self._verified = False
+        self._lock = threading.Lock()
+
+    def table_schema(self, conn: psycopg2.connect, table: str) -> TableSchema:
+        """ Returns the schema of a table, verifying the definitions against the DB the first time """
+
+        self.verify(conn)
+
+        return self._tables[table.lower()]
+
+    def columns(self, conn: psycopg2.connect, table: str) -> list:
+        return self.table_schema(conn, table).columns
+
+    def ensure_partitions(self, conn: psycopg2.connect, table: str, df: pd.DataFrame, commit: bool=True) -> None:
+        """ Creates the partitions df's rows need if the table is partitioned and they haven't been created yet """
+
+        table_schema = self.table_schema(conn, table)
+        if table_schema.partition_by is None:
+            return None
+
+        values = [int(value) for value in df[table_schema.partition_by].dropna().unique()
+                  if int(value) not in table_schema.partitions]
+
+        create_partitions(conn, table.upper(), values, commit=commit)
+
+        # only remembered once committed, since a rollback would undo them
+        if commit:
+            table_schema.partitions.update(values)
+        else:
+            on_commit(conn, lambda: table_schema.partitions.update(values))
+
+    def verify(self, conn: psycopg2.connect) -> None:
+        """
+        Checks the definitions against the DB. Columns that haven't been added to the DB yet
+        (e.g. by a migration) are dropped from the definitions so nothing tries to load them,
+        and tables that haven't been partitioned yet are loaded as regular tables. The partitions
+        that already exist are remembered so they aren't created again.
+        """
+
+        with self._lock:
+            if self._verified:
+                return None
+
+            query = '''
+                SELECT TABLE_NAME, COLUMN_NAME
+                FROM INFORMATION_SCHEMA.COLUMNS
+                WHERE TABLE_SCHEMA = 'public'
+                    AND TABLE_NAME = ANY(%s)
+            '''
+
+            partitioned_query = '''
+                SELECT C.RELNAME
+                FROM PG_PARTITIONED_TABLE P
+                JOIN PG_CLASS C
+                    ON C.OID = P.PARTRELID
+            '''
+
+            partitions_query = '''
+                SELECT PARENT.RELNAME, CHILD.RELNAME
+                FROM PG_INHERITS I
+                JOIN PG_CLASS PARENT
+                    ON PARENT.OID = I.INHPARENT
+                JOIN PG_CLASS CHILD
+                    ON CHILD.OID = I.INHRELID
+            '''
+
+            cursor = conn.cursor()
+            try:
+                cursor.execute(query, (list(self._tables),))
+                rows = cursor.fetchall()
+
+                cursor.execute(partitioned_query)
+                partitioned_tables = set(row[0] for row in cursor.fetchall())
+
+                cursor.execute(partitions_query)
+                partitions = cursor.fetchall()
+            finally:
+                cursor.close()
+
+            db_columns = {}
+            for table, col in rows:
+                db_columns.setdefault(table, set()).add(col)
+
+            for table, table_schema in self._tables.items():
+                if table not in db_columns:
+                    print("Warning: table %s doesn't exist" % table)
+                    table_schema.exists = False
+                    continue
+
+                missing_cols = [col for col in table_schema.columns if col not in db_columns[table]]
+                if len(missing_cols) > 0:
+                    print("Warning: %s is missing columns %s" % (table, ', '.join(missing_cols)))
+                    table_schema.columns = [col for col in table_schema.columns if col in db_columns[table]]
+
+                if table_schema.partition_by is not None and table not in partitioned_tables:
+                    print("Warning: %s hasn't been partitioned yet" % table)
+                    table_schema.partition_by = None
+
+            # partitions are named <table>_<value> (see table_schemas.create_partitions)
+            for table, partition in partitions:
+                suffix = partition[len(table) + 1:]
+                if table in self._tables and partition.startswith(table + '_') and suffix.isdigit():
+                    self._tables[table].partitions.add(int(suffix))
+
+            self._verified = True
+
+
+# Shared by everything in the process so the DB is only checked once
+registry = SchemaRegistry()
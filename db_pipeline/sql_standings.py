@@ -0,0 +1,336 @@
+"""
+Builds the SCORES table inside the DB from the MATCHUPS table rather than in pandas.
+
+Every metric pull_data/standings.py calculates is expressed as a window function over the
+raw team/week scores: the win/loss/tie indicators, all-play wins from each score's rank within
+its week, the cumulative sums by team, and the tiered standings. Any number of league/seasons
+are recomputed with a single statement, and standings_parity compares the result to the pandas one.
+"""
+
+import numpy as np
+import pandas as pd
+import psycopg2
+
+import schema_registry
+from pull_data import standings
+from table_schemas import TABLE_SCHEMAS
+from helpers import create_db_connection, queue_standings_changed
+
+
+# Every SCORES column the engine fills - STANDINGS comes from the tiers and ROW_HASH is cleared
+SCORES_COLS = [col for col, _ in TABLE_SCHEMAS['SCORES']['columns'] if col not in ('STANDINGS', 'ROW_HASH')]
+SCORES_PKEYS = TABLE_SCHEMAS['SCORES']['pkeys']
+
+WEEK_PARTITION = 'PARTITION BY LEAGUE_ID, SEASON_ID, WEEK_NUMBER'
+
+# Cumulative sums by team through each week. The all-play points keep their fractional ties.
+# Only standard SQL is used from here on so the tests can run the statements on sqlite
+METRICS_STATEMENT = f'''
+    TEAM_COUNTS AS (
+        SELECT LEAGUE_ID, SEASON_ID, COUNT(DISTINCT TEAM_ID) AS NUMBER_OF_TEAMS
+        FROM SEASON_MATCHUPS
+        GROUP BY LEAGUE_ID, SEASON_ID
+    ),
+    WEEKLY AS (
+        SELECT
+            M.LEAGUE_ID
+            , M.SEASON_ID
+            , M.WEEK_NUMBER
+            , M.TEAM_ID
+            , M.TEAM_ID_OPP
+            , M.SCORE
+            , M.SCORE_OPP
+            , M.HOME_OR_AWAY
+            , CASE WHEN M.SCORE > M.SCORE_OPP THEN 1 ELSE 0 END AS WIN_IND
+            , CASE WHEN M.SCORE < M.SCORE_OPP THEN 1 ELSE 0 END AS LOSS_IND
+            , CASE WHEN M.SCORE = M.SCORE_OPP THEN 1 ELSE 0 END AS TIE_IND
+
+            -- teams with a lower score that week, and those with the same one
+            , RANK() OVER (PARTITION BY M.LEAGUE_ID, M.SEASON_ID, M.WEEK_NUMBER ORDER BY M.SCORE) - 1 AS ALL_PLAY_WINS
+            , COUNT(*) OVER (PARTITION BY M.LEAGUE_ID, M.SEASON_ID, M.WEEK_NUMBER, M.SCORE) AS SAME_SCORE
+            , N.NUMBER_OF_TEAMS
+        FROM SEASON_MATCHUPS M
+        JOIN TEAM_COUNTS N
+            ON M.LEAGUE_ID = N.LEAGUE_ID
+            AND M.SEASON_ID = N.SEASON_ID
+        WHERE M.WEEK_NUMBER >= 1
+            AND M.WEEK_NUMBER < M.PLAYOFF_WEEK_START
+    ),
+    WEEKLY_ALL_PLAY AS (
+        SELECT
+            W.*
+            , W.WIN_IND + 0.5 * W.TIE_IND AS WLT_POINTS
+            , W.ALL_PLAY_WINS + CASE WHEN W.SAME_SCORE > 1 THEN 1.0 / W.SAME_SCORE ELSE 0 END AS ALL_PLAY_WLT_POINTS
+            , W.SAME_SCORE - 1 AS ALL_PLAY_TIES
+            , W.NUMBER_OF_TEAMS - W.ALL_PLAY_WINS - W.SAME_SCORE AS ALL_PLAY_LOSSES
+        FROM WEEKLY W
+    ),
+    CUMULATIVE AS (
+        SELECT
+            W.*
+            , SUM(W.SCORE) OVER TEAM_WEEKS AS CUM_SCORE
+            , SUM(W.SCORE_OPP) OVER TEAM_WEEKS AS CUM_SCORE_OPP
+            , SUM(W.WLT_POINTS) OVER TEAM_WEEKS AS CUM_WLT_POINTS
+            , SUM(W.WIN_IND) OVER TEAM_WEEKS AS CUM_WINS
+            , SUM(W.LOSS_IND) OVER TEAM_WEEKS AS CUM_LOSSES
+            , SUM(W.TIE_IND) OVER TEAM_WEEKS AS CUM_TIES
+            , SUM(W.ALL_PLAY_WLT_POINTS) OVER TEAM_WEEKS AS CUM_ALL_PLAY_WLT_POINTS
+            , SUM(W.ALL_PLAY_WINS) OVER TEAM_WEEKS AS CUM_ALL_PLAY_WINS
+            , SUM(W.ALL_PLAY_LOSSES) OVER TEAM_WEEKS AS CUM_ALL_PLAY_LOSSES
+            , SUM(W.ALL_PLAY_TIES) OVER TEAM_WEEKS AS CUM_ALL_PLAY_TIES
+        FROM WEEKLY_ALL_PLAY W
+        WINDOW TEAM_WEEKS AS (PARTITION BY W.LEAGUE_ID, W.SEASON_ID, W.TEAM_ID ORDER BY W.WEEK_NUMBER
+                              ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW)
+    ),
+    METRICS AS (
+        SELECT
+            C.*
+
+            -- rounded on doubles (half to even) the way pandas rounds them so both engines agree
+            , ROUND(CAST(C.CUM_SCORE AS DOUBLE PRECISION) / C.WEEK_NUMBER * 100) / 100 AS CUM_SCORE_PER_WEEK
+            , ROUND(CAST(C.CUM_SCORE_OPP AS DOUBLE PRECISION) / C.WEEK_NUMBER * 100) / 100 AS CUM_SCORE_OPP_PER_WEEK
+            , ROUND(CAST(C.CUM_ALL_PLAY_WLT_POINTS AS DOUBLE PRECISION) / C.WEEK_NUMBER * 10) / 10
+                AS CUM_ALL_PLAY_WLT_POINTS_PER_WEEK
+            , C.CUM_WINS || '-' || C.CUM_LOSSES || '-' || C.CUM_TIES AS RECORD
+            , C.CUM_ALL_PLAY_WINS || '-' || C.CUM_ALL_PLAY_LOSSES || '-' || C.CUM_ALL_PLAY_TIES AS ALL_PLAY_RECORD
+
+            -- ties in the first tier are left in team order, same as the pandas standings
+            , ROW_NUMBER() OVER (PARTITION BY C.LEAGUE_ID, C.SEASON_ID, C.WEEK_NUMBER ORDER BY C.TEAM_ID) AS TIER_POSITION
+        FROM CUMULATIVE C
+    )
+'''
+
+
+def db_metric(rank_metric: str) -> str:
+    """ Returns the SCORES column of a metric named the way pull_data/standings.py names it """
+
+    if rank_metric in standings.DB_RENAME_VARS_FIRST:
+        return standings.DB_RENAME_VARS_FIRST[rank_metric].upper()
+
+    return standings.DB_RENAME_VARS.get(rank_metric, rank_metric).upper()
+
+
+def tiers_statement(rank_metrics_by_week_range: dict) -> tuple:
+    """
+    Returns the CTEs ranking each tier of rank_metrics_by_week_range along with the query that
+    stacks their standings. Each tier ranks the rows the tiers before it didn't reach, with
+    ties kept in the order the previous tier left them.
+    """
+
+    tier_plan = standings.compile_tier_plan(rank_metrics_by_week_range)
+    cols = ', '.join(SCORES_COLS)
+
+    tier_ctes = []
+    tier_selects = []
+    source, prior_size = 'METRICS', 0
+    for i, (rank_lower, rank_upper, rank_metrics, ascending) in enumerate(tier_plan, start=1):
+        order = ', '.join(db_metric(rank_metric) + (' ASC' if asc else ' DESC') + ' NULLS LAST'
+                          for rank_metric, asc in zip(rank_metrics, ascending))
+
+        tier_ctes.append(f'''
+    TIER_{i} AS (
+        SELECT {cols}
+            , ROW_NUMBER() OVER ({WEEK_PARTITION} ORDER BY {order}, TIER_POSITION) AS TIER_POSITION
+        FROM {source}
+        WHERE TIER_POSITION > {prior_size}
+    )''')
+
+        tier_size = rank_upper - rank_lower + 1
+        tier_selects.append(f'''
+        SELECT {cols}, {rank_lower} + TIER_POSITION - 1 AS STANDINGS
+        FROM TIER_{i}
+        WHERE TIER_POSITION <= {tier_size}''')
+
+        source, prior_size = f'TIER_{i}', tier_size
+
+    return ','.join(tier_ctes), '\n        UNION ALL'.join(tier_selects)
+
+
+# The MATCHUPS rows (along with their season's PLAYOFF_WEEK_START) of the league/seasons passed
+# as the %(league_ids)s and %(season_ids)s arrays
+SEASON_MATCHUPS_STATEMENT = '''
+        SELECT M.*, S.PLAYOFF_WEEK_START
+        FROM MATCHUPS M
+        JOIN SETTINGS S
+            ON M.LEAGUE_ID = S.LEAGUE_ID
+            AND M.SEASON_ID = S.SEASON_ID
+        JOIN UNNEST(%(league_ids)s::BIGINT[], %(season_ids)s::SMALLINT[]) AS L (LEAGUE_ID, SEASON_ID)
+            ON M.LEAGUE_ID = L.LEAGUE_ID
+            AND M.SEASON_ID = L.SEASON_ID
+'''
+
+
+def standings_statement(season_matchups: str, rank_metrics_by_week_range: dict=None) -> str:
+    """
+    Returns the query that builds the SCORES rows of the matchups selected by season_matchups.
+    Only the regular season weeks are ranked.
+    """
+
+    if rank_metrics_by_week_range is None:
+        rank_metrics_by_week_range = {'1-12': [['cum_total_wins', 'cum_score'], [False, False]]}
+
+    tier_ctes, tier_selects = tiers_statement(rank_metrics_by_week_range)
+
+    return f'''
+    WITH SEASON_MATCHUPS AS ({season_matchups}),
+    {METRICS_STATEMENT},
+    {tier_ctes}
+    {tier_selects}
+    '''
+
+
+def standings_query(rank_metrics_by_week_range: dict=None) -> str:
+    """
+    Returns the query that builds the SCORES rows of the league/seasons passed as the
+    %(league_ids)s and %(season_ids)s arrays. Only the regular season weeks are ranked.
+    """
+
+    return standings_statement(SEASON_MATCHUPS_STATEMENT, rank_metrics_by_week_range)
+
+
+def league_season_params(league_seasons: list) -> dict:
+    return {'league_ids': [int(league_id) for league_id, _ in league_seasons],
+            'season_ids': [int(season_id) for _, season_id in league_seasons]}
+
+
+def matchup_league_seasons(conn: psycopg2.connect) -> list:
+    """ Returns every (league_id, season_id) pair in the MATCHUPS table """
+
+    cursor = conn.cursor()
+    cursor.execute('''SELECT DISTINCT LEAGUE_ID, SEASON_ID FROM MATCHUPS''')
+    league_seasons = cursor.fetchall()
+    cursor.close()
+
+    return league_seasons
+
+
+def compute_scores(conn: psycopg2.connect, league_seasons: list=None, rank_metrics_by_week_range: dict=None,
+                   commit: bool=True) -> None:
+    """
+    Upserts the SCORES rows of league_seasons (every league/season in MATCHUPS by default) from their
+    MATCHUPS and SETTINGS rows. The rows' ROW_HASH is cleared so the pandas loader doesn't skip them, and
+    every week of the league/seasons is sent to the app as changed. With commit=False the caller commits (see helpers.transaction) and errors are raised.
+    """
+
+    if league_seasons is None:
+        league_seasons = matchup_league_seasons(conn)
+
+    if len(league_seasons) == 0:
+        return None
+
+    df_league_seasons = pd.DataFrame(league_seasons, columns=['league_id', 'season_id'])
+    schema_registry.registry.ensure_partitions(conn, 'scores', df_league_seasons, commit=commit)
+
+    cols = SCORES_COLS + ['STANDINGS']
+    update_cols = [col for col in cols if col not in SCORES_PKEYS]
+
+    set_statement = ', '.join(f'{col} = EXCLUDED.{col}' for col in update_cols)
+
+    upsert_statement = f'''
+        INSERT INTO SCORES ({', '.join(cols)}, ROW_HASH)
+        SELECT {', '.join(cols)}, NULL
+        FROM ({standings_query(rank_metrics_by_week_range)}) STANDINGS_ROWS
+        ON CONFLICT ({', '.join(SCORES_PKEYS)}) DO UPDATE
+        SET {set_statement}, ROW_HASH = NULL
+    '''
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(upsert_statement, league_season_params(league_seasons))
+        if commit:
+            conn.commit()
+            
+        queue_standings_changed(conn, [(league_id, season_id, 1) for league_id, season_id in league_seasons])
+    except (Exception, psycopg2.DatabaseError) as error:
+        cursor.close()
+        if not commit:
+            raise
+
+        print("Error: %s" % error)
+        conn.rollback()
+        return 1
+    cursor.close()
+
+
+def select_standings(conn: psycopg2.connect, league_seasons: list,
+                     rank_metrics_by_week_range: dict=None) -> pd.DataFrame:
+    """ Returns the rows compute_scores would upsert for league_seasons without writing them """
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(standings_query(rank_metrics_by_week_range), league_season_params(league_seasons))
+        rows = cursor.fetchall()
+        cols = [col[0].lower() for col in cursor.description]
+    finally:
+        cursor.close()
+
+    df = pd.DataFrame(rows, columns=cols)
+
+    return schema_registry.registry.table_schema(conn, 'scores').project(df)
+
+
+def standings_parity(conn: psycopg2.connect, df_scores: pd.DataFrame,
+                     rank_metrics_by_week_range: dict=None, tolerance: float=1e-6) -> pd.DataFrame:
+    """
+    Returns the (row, column) pairs where df_scores (from pull_standings) and the engine's rows for
+    the same league/seasons disagree, so an empty frame means the two match. The league/seasons'
+    MATCHUPS and SETTINGS rows need to be loaded first.
+    """
+
+    table_schema = schema_registry.registry.table_schema(conn, 'scores')
+    pkeys = table_schema.pkeys
+
+    league_seasons = df_scores[['league_id', 'season_id']].drop_duplicates().values.tolist()
+    df_sql = select_standings(conn, league_seasons, rank_metrics_by_week_range=rank_metrics_by_week_range)
+    df_pandas = table_schema.project(df_scores)
+
+    df = pd.merge(df_pandas, df_sql, on=pkeys, how='outer', suffixes=('_pandas', '_sql'), indicator=True)
+
+    df_both = df.loc[df['_merge'] == 'both']
+
+    mismatches = []
+    for col in table_schema.columns:
+        if col in pkeys or col + '_pandas' not in df.columns or col + '_sql' not in df.columns:
+            continue
+
+        pandas_values = df_both[col + '_pandas']
+        sql_values = df_both[col + '_sql']
+
+        if table_schema.dtypes[col] == 'object':
+            same = (pandas_values == sql_values) | (pandas_values.isna() & sql_values.isna())
+        else:
+            same = np.isclose(pandas_values.astype('float'), sql_values.astype('float'),
+                              atol=tolerance, equal_nan=True)
+
+        df_col = df_both.loc[~same, pkeys + [col + '_pandas', col + '_sql']]
+        df_col.columns = pkeys + ['pandas', 'sql']
+        df_col.insert(len(pkeys), 'column', col)
+
+        mismatches.append(df_col)
+
+    # rows only one of them has
+    df_missing = df.loc[df['_merge'] != 'both', pkeys + ['_merge']].rename(columns={'_merge': 'pandas'})
+    df_missing['pandas'] = df_missing['pandas'] == 'left_only'
+    df_missing['sql'] = ~df_missing['pandas']
+    df_missing.insert(len(pkeys), 'column', 'row')
+    mismatches.append(df_missing)
+
+    return pd.concat(mismatches, ignore_index=True)
+
+
+if __name__ == '__main__':
+
+    from pull_data import ApiData
+    from configs import connection_params, LEAGUE_ID, SEASON_ID
+
+    connect_params = connection_params(connect_type='heroku')
+    conn = create_db_connection(connect_params=connect_params)
+
+    espn_data = ApiData(SEASON_ID, league_id=LEAGUE_ID)
+    espn_data.pull_scores(return_df=False)
+
+    df_mismatches = standings_parity(conn, espn_data.scores,
+                                     rank_metrics_by_week_range=espn_data.standings_metrics)
+    print(df_mismatches)
+
+    conn.close()
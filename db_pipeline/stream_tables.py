@@ -0,0 +1,154 @@
+"""
+Loads seasons by streaming the schedule JSON straight into the tables with COPY.
+
+The MATCHUPS rows go from the JSON to the COPY buffer as tuples, and the SCORES rows are built
+and copied one week at a time, so nothing holds a season's worth of dataframes. Seasons are
+pulled and committed one after another and their JSON released, so memory stays flat however
+much history a backfill loads.
+"""
+
+import itertools
+
+import psycopg2
+import pandas as pd
+
+from pull_data import ApiData, create_session
+import schema_registry
+from sql_standings import compute_scores
+from materialized_views import refresh_materialized_views
+from load_tables import TABLE_PKEYS, SeasonsFailed, engine_table_pkeys, load_table
+from helpers import (create_connection_pool, pooled_connection, transaction, copy_upsert_stream,
+                     rows_csv_chunks, df_csv_chunks, queue_standings_changed, ROW_HASH_COL)
+
+
+# Order of the values in ApiData.iter_matchups rows
+MATCHUP_COLS = ['league_id', 'season_id', 'week_number', 'team_id', 'team_id_opp', 'score', 'score_opp',
+                'home_or_away']
+
+# Tables that are streamed rather than loaded from the ApiData attributes
+STREAMED_TABLES = ['matchups', 'scores']
+
+
+def stream_matchups(conn: psycopg2.connect, espn_data: ApiData, chunk_size: int=10000,
+                    commit: bool=True) -> None:
+    """
+    Upserts the season's MATCHUPS rows straight from the schedule JSON.
+    Their ROW_HASH is cleared so load_table doesn't skip them later on.
+    """
+
+    table_schema = schema_registry.registry.table_schema(conn, 'matchups')
+
+    cols = MATCHUP_COLS
+    rows = espn_data.iter_matchups()
+    if ROW_HASH_COL in table_schema.columns:
+        cols = cols + [ROW_HASH_COL]
+        rows = (row + (None,) for row in rows)
+
+    return copy_upsert_stream(conn, rows_csv_chunks(rows, chunk_size=chunk_size), 'matchups', cols,
+                              table_schema.pkeys, commit=commit)
+
+
+def stream_scores(conn: psycopg2.connect, espn_data: ApiData, commit: bool=True) -> None:
+    """
+    Upserts the season's SCORES rows, building and copying them a week at a time.
+    Their ROW_HASH is cleared so load_table doesn't skip them later on.
+    The whole season is sent to the app as changed.
+    """
+
+    table_schema = schema_registry.registry.table_schema(conn, 'scores')
+
+    df_season = pd.DataFrame({'league_id': [espn_data.league_id], 'season_id': [espn_data.season_id]})
+    schema_registry.registry.ensure_partitions(conn, 'scores', df_season, commit=commit)
+
+    # every chunk needs the same columns in the same order as the COPY
+    week_chunks = (df_csv_chunks(table_schema.project(df).reindex(columns=table_schema.columns))
+                   for df in espn_data.iter_scores())
+
+    if copy_upsert_stream(conn, itertools.chain.from_iterable(week_chunks), 'scores',
+                          table_schema.columns, table_schema.pkeys, commit=commit) is not None:
+        return 1
+
+    queue_standings_changed(conn, [(espn_data.league_id, espn_data.season_id, 1)])
+
+
+def stream_season(conn: psycopg2.connect, espn_data: ApiData, table_pkeys: dict=None,
+                  engine: str='pandas', refresh_views: bool=True) -> None:
+    """
+    Upserts every table for a season, streaming the MATCHUPS and SCORES rows (see load_tables.load_season
+    for engine and refresh_views). The tables are committed together and the season's JSON is released afterwards.
+    """
+
+    if table_pkeys is None:
+        table_pkeys = TABLE_PKEYS
+
+    table_pkeys = engine_table_pkeys(table_pkeys, engine)
+
+    with transaction(conn):
+        if 'matchups' in table_pkeys or engine == 'sql':
+            stream_matchups(conn, espn_data, commit=False)
+
+        if 'scores' in table_pkeys:
+            stream_scores(conn, espn_data, commit=False)
+
+        # the rest only hold a few rows per season
+        for table, pkeys in table_pkeys.items():
+            if table not in STREAMED_TABLES:
+                df = getattr(espn_data, 'pull_' + table)()
+                load_table(conn, df, table, pkeys, commit=False)
+
+        if engine == 'sql':
+            compute_scores(conn, [(espn_data.league_id, espn_data.season_id)],
+                           rank_metrics_by_week_range=espn_data.standings_metrics, commit=False)
+
+    espn_data.clear_json_attrs()
+    
+    if refresh_views:
+        refresh_materialized_views(conn)
+
+
+def stream_seasons(conn: psycopg2.connect, league_seasons: list, table_pkeys: dict=None,
+                   engine: str='pandas') -> None:
+    """
+    Streams each (league_id, season_id) pair into the tables one season at a time. A season that fails
+    to load is rolled back on its own and the backfill moves on to the next one. The dashboard's
+    materialized views are refreshed once at the end.
+    Raises SeasonsFailed once every season has been tried if any of them failed, like
+    load_tables.load_seasons_concurrent.
+    """
+
+    session = create_session(pool_maxsize=1)
+
+    # (league_id, season_id, error) for each season that failed
+    failures = []
+
+    try:
+        for league_id, season_id in league_seasons:
+            espn_data = ApiData(season_id, league_id=league_id, session=session, single_request=True)
+
+            try:
+                stream_season(conn, espn_data, table_pkeys=table_pkeys, engine=engine, refresh_views=False)
+            except (Exception, psycopg2.DatabaseError) as error:
+                print("Error loading %s season %s: %s" % (league_id, season_id, error))
+                failures.append((league_id, season_id, error))
+    finally:
+        session.close()
+        
+    refresh_materialized_views(conn)
+    
+    if len(failures) > 0:
+        raise SeasonsFailed(failures)
+
+
+if __name__ == '__main__':
+
+    from configs import connection_params, LEAGUE_ID
+
+    connect_params = connection_params(connect_type='heroku')
+    pool = create_connection_pool(connect_params=connect_params)
+    season_ids = [2019, 2020, 2021]
+
+    league_seasons = [(LEAGUE_ID, season_id) for season_id in season_ids]
+    with pooled_connection(pool) as conn:
+        stream_seasons(conn, league_seasons)
+
+    pool.closeall()
@@ -1,203 +1,359 @@
-
 import psycopg2
 
 from helpers import create_db_connection
 from configs import connection_params
+from materialized_views import MATERIALIZED_VIEWS, create_materialized_views
 
 
-def create_table_scores(conn: psycopg2.connect, overwrite: bool=False) -> None:
-    ''' Creates the columns and relationships of the WEEKLY_SCORES table '''
+# Column definitions and primary key of each table. create_table_* build the tables from these and
+# schema_registry uses them to project DataFrames onto the tables' columns
+TABLE_SCHEMAS = {
+    'SCORES': {
+        'columns': [
+            ('LEAGUE_ID', 'BIGINT'),
+            ('SEASON_ID', 'SMALLINT'),
+            ('WEEK_NUMBER', 'BIGINT'),
+            ('TEAM_ID', 'SMALLINT'),
+            ('TEAM_ID_OPP', 'SMALLINT'),
+            ('SCORE', 'NUMERIC(5, 2)'),
+            ('SCORE_OPP', 'NUMERIC(5, 2)'),
+            ('WLT_POINTS', 'NUMERIC(2, 1)'),
+            ('WIN_IND', 'SMALLINT'),
+            ('LOSS_IND', 'SMALLINT'),
+            ('TIE_IND', 'SMALLINT'),
+            ('ALL_PLAY_WLT_POINTS', 'NUMERIC(3, 1)'),
+            ('ALL_PLAY_WINS', 'SMALLINT'),
+            ('ALL_PLAY_LOSSES', 'SMALLINT'),
+            ('ALL_PLAY_TIES', 'SMALLINT'),
+            ('CUM_SCORE', 'NUMERIC(6, 2)'),
+            ('CUM_SCORE_OPP', 'NUMERIC(6, 2)'),
+            ('CUM_WLT_POINTS', 'NUMERIC(3, 1)'),
+            ('CUM_WINS', 'SMALLINT'),
+            ('CUM_LOSSES', 'SMALLINT'),
+            ('CUM_TIES', 'SMALLINT'),
+            # not rounded since each incremental load adds the week's 1/3s etc. onto the prior week's total
+            ('CUM_ALL_PLAY_WLT_POINTS', 'DOUBLE PRECISION'),
+            ('CUM_ALL_PLAY_WINS', 'SMALLINT'),
+            ('CUM_ALL_PLAY_LOSSES', 'SMALLINT'),
+            ('CUM_ALL_PLAY_TIES', 'SMALLINT'),
+            ('CUM_SCORE_PER_WEEK', 'NUMERIC(5, 2)'),
+            ('CUM_SCORE_OPP_PER_WEEK', 'NUMERIC(5, 2)'),
+            ('CUM_ALL_PLAY_WLT_POINTS_PER_WEEK', 'NUMERIC(3, 1)'),
+            ('RECORD', 'VARCHAR(10)'),
+            ('ALL_PLAY_RECORD', 'VARCHAR(10)'),
+            ('STANDINGS', 'SMALLINT'),
+            ('HOME_OR_AWAY', 'VARCHAR(10)'),
+            ('ROW_HASH', 'BIGINT')
+        ],
+        'pkey_name': 'WEEKLY_SCORES_PKEY',
+        'pkeys': ['LEAGUE_ID', 'SEASON_ID', 'WEEK_NUMBER', 'TEAM_ID'],
+        # One partition per season (see create_partitions) so reads and reloads only touch their season
+        'partition_by': 'SEASON_ID',
+        'indexes': [
+            # Covers the dashboard's reads - a league/season/week's standings in order
+            {'name': 'SCORES_WEEK_STANDINGS_IDX',
+             'columns': ['LEAGUE_ID', 'SEASON_ID', 'WEEK_NUMBER', 'STANDINGS'],
+             'include': ['TEAM_ID', 'RECORD', 'ALL_PLAY_RECORD', 'CUM_WINS', 'CUM_LOSSES', 'CUM_TIES',
+                         'CUM_WLT_POINTS', 'CUM_ALL_PLAY_WLT_POINTS', 'CUM_SCORE', 'CUM_SCORE_OPP',
+                         'CUM_SCORE_PER_WEEK', 'CUM_SCORE_OPP_PER_WEEK', 'CUM_ALL_PLAY_WLT_POINTS_PER_WEEK']}
+        ]
+    },
+    # Raw team/week scores from the schedule - sql_standings builds SCORES from these inside the DB
+    'MATCHUPS': {
+        'columns': [
+            ('LEAGUE_ID', 'BIGINT'),
+            ('SEASON_ID', 'SMALLINT'),
+            ('WEEK_NUMBER', 'SMALLINT'),
+            ('TEAM_ID', 'SMALLINT'),
+            ('TEAM_ID_OPP', 'SMALLINT'),
+            ('SCORE', 'NUMERIC(5, 2)'),
+            ('SCORE_OPP', 'NUMERIC(5, 2)'),
+            ('HOME_OR_AWAY', 'VARCHAR(10)'),
+            ('ROW_HASH', 'BIGINT')
+        ],
+        'pkey_name': 'MATCHUPS_PKEY',
+        'pkeys': ['LEAGUE_ID', 'SEASON_ID', 'WEEK_NUMBER', 'TEAM_ID']
+    },
+    'TEAMS': {
+        'columns': [
+            ('LEAGUE_ID', 'BIGINT'),
+            ('SEASON_ID', 'SMALLINT'),
+            ('TEAM_ID', 'SMALLINT'),
+            ('MANAGER_ID', 'VARCHAR(50)'),
+            ('TEAM_NAME', 'VARCHAR(50)'),
+            ('MANAGER_NAME', 'VARCHAR(50)'),
+            ('ESPN_NAME', 'VARCHAR(50)'),
+            ('ROW_HASH', 'BIGINT')
+        ],
+        'pkey_name': 'TEAMS_PKEY',
+        'pkeys': ['LEAGUE_ID', 'SEASON_ID', 'TEAM_ID']
+    },
+    'WEEKS': {
+        'columns': [
+            ('LEAGUE_ID', 'BIGINT'),
+            ('SEASON_ID', 'SMALLINT'),
+            ('WEEK_NUMBER', 'SMALLINT'),
+            ('MATCHUP_PERIOD', 'SMALLINT'),
+            ('REG_SEASON_FLAG', 'SMALLINT'),
+            ('ROW_HASH', 'BIGINT')
+        ],
+        'pkey_name': 'WEEKS_PKEY',
+        'pkeys': ['LEAGUE_ID', 'SEASON_ID', 'WEEK_NUMBER']
+    },
+    'DIVISIONS': {
+        'columns': [
+            ('LEAGUE_ID', 'BIGINT'),
+            ('SEASON_ID', 'SMALLINT'),
+            ('DIVISION_NAME', 'VARCHAR(50)'),
+            ('SIZE', 'SMALLINT'),
+            ('DIVISION_ID', 'SMALLINT'),
+            ('ROW_HASH', 'BIGINT')
+        ],
+        'pkey_name': 'DIVISIONS_PKEY',
+        'pkeys': ['LEAGUE_ID', 'SEASON_ID', 'DIVISION_ID']
+    },
+    'SETTINGS': {
+        'columns': [
+            ('LEAGUE_ID', 'BIGINT'),
+            ('SEASON_ID', 'SMALLINT'),
+            ('PLAYOFF_SEEDING_RULE', 'VARCHAR(100)'),
+            ('PLAYOFF_SEEDING_RULE_BY', 'SMALLINT'),
+            ('NUM_PLAYOFF_TEAMS', 'SMALLINT'),
+            ('FIRST_SCORING_PERIOD', 'SMALLINT'),
+            ('FINAL_SCORING_PERIOD', 'SMALLINT'),
+            ('PLAYOFF_WEEK_START', 'SMALLINT'),
+            ('SCORING_TYPE', 'VARCHAR(50)'),
+            ('REG_SEASON_MATCHUP_TIEBREAKER', 'VARCHAR(50)'),
+            ('PLAYOFF_MATCHUP_TIEBREAKER', 'VARCHAR(50)'),
+            ('HOME_TEAM_BONUS', 'SMALLINT'),
+            ('ROW_HASH', 'BIGINT')
+        ],
+        'pkey_name': 'SETTINGS_PKEY',
+        'pkeys': ['LEAGUE_ID', 'SEASON_ID']
+    }
+}
+
+
+def create_table_statement(table_name: str, overwrite: bool=False) -> str:
+    ''' Returns the statement that creates a table from its TABLE_SCHEMAS definition '''
     
-    table_name = 'SCORES'
+    schema = TABLE_SCHEMAS[table_name]
     
     if overwrite == True:
         drop_table_statement = f'''DROP TABLE IF EXISTS {table_name};'''
     else:
         drop_table_statement = ''
         
+    columns_statement = '\n            , '.join(col + ' ' + col_type for col, col_type in schema['columns'])
+    pkeys_statement = ', '.join(schema['pkeys'])
+    
+    partition_statement = ''
+    default_partition_statement = ''
+    if schema.get('partition_by') is not None:
+        partition_statement = f'PARTITION BY LIST ({schema["partition_by"]})'
+        
+        # anything without its own partition yet lands here
+        default_partition_statement = f'''
+        CREATE TABLE {table_name}_DEFAULT PARTITION OF {table_name} DEFAULT;
+        '''
+        
     create_table_statment = f'''
         {drop_table_statement}
         
         CREATE TABLE {table_name}
         (
-            LEAGUE_ID BIGINT
-            , SEASON_ID SMALLINT
-            , WEEK_NUMBER BIGINT
-            , TEAM_ID SMALLINT
-            , TEAM_ID_OPP SMALLINT
-            , SCORE NUMERIC(5, 2)
-            , SCORE_OPP NUMERIC(5, 2)
-            , WLT_POINTS NUMERIC(2, 1)
-            , WIN_IND SMALLINT
-            , LOSS_IND SMALLINT
-            , TIE_IND SMALLINT
-            , ALL_PLAY_WLT_POINTS NUMERIC(3, 1)
-            , ALL_PLAY_WINS SMALLINT
-            , ALL_PLAY_LOSSES SMALLINT
-            , ALL_PLAY_TIES SMALLINT
-            , CUM_SCORE NUMERIC(6, 2)
-            , CUM_SCORE_OPP NUMERIC(6, 2)
-            , CUM_WLT_POINTS NUMERIC(3, 1)
-            , CUM_WINS SMALLINT
-            , CUM_LOSSES SMALLINT
-            , CUM_TIES SMALLINT
-            , CUM_ALL_PLAY_WLT_POINTS NUMERIC(4, 1)
-            , CUM_ALL_PLAY_WINS SMALLINT
-            , CUM_ALL_PLAY_LOSSES SMALLINT
-            , CUM_ALL_PLAY_TIES SMALLINT
-            , CUM_SCORE_PER_WEEK NUMERIC(5, 2)
-            , CUM_SCORE_OPP_PER_WEEK NUMERIC(5, 2)
-            , CUM_ALL_PLAY_WLT_POINTS_PER_WEEK NUMERIC(3, 1)
-            , RECORD VARCHAR(10)
-            , ALL_PLAY_RECORD VARCHAR(10)
-            , STANDINGS SMALLINT
-            , HOME_OR_AWAY VARCHAR(10)
+            {columns_statement}
             
-            , CONSTRAINT WEEKLY_SCORES_PKEY PRIMARY KEY(LEAGUE_ID, SEASON_ID, WEEK_NUMBER, TEAM_ID)
-        );
+            , CONSTRAINT {schema['pkey_name']} PRIMARY KEY({pkeys_statement})
+        ) {partition_statement};
+        {default_partition_statement}
+        {create_indexes_statement(table_name)}
         '''
+        
+    return create_table_statment
 
-    cursor = conn.cursor()
-    cursor.execute(create_table_statment)
-    conn.commit()
 
-    cursor.close()
+def create_indexes_statement(table_name: str) -> str:
+    ''' Returns the statement that creates a table's TABLE_SCHEMAS indexes '''
     
+    create_indexes_statment = ''
+    for index in TABLE_SCHEMAS[table_name].get('indexes', []):
+        include_statement = ''
+        if len(index.get('include', [])) > 0:
+            include_statement = 'INCLUDE (' + ', '.join(index['include']) + ')'
+            
+        create_indexes_statment = create_indexes_statment + f'''
+        CREATE INDEX IF NOT EXISTS {index['name']} 
+        ON {table_name} ({', '.join(index['columns'])}) {include_statement};
+        '''
+        
+    return create_indexes_statment
+
+
+def create_partitions(conn: psycopg2.connect, table_name: str, values: list, commit: bool=True) -> None:
+    ''' 
+    Creates the partitions of a partitioned table for each value that doesn't have one yet.
+    With commit=False the caller commits (see helpers.transaction).
+    '''
     
-def create_table_teams(conn: psycopg2.connect, overwrite: bool=False) -> None:
-    ''' Creates the columns and relationships of the TEAMS table '''
+    create_partitions_statement = ''.join(f'''
+        CREATE TABLE IF NOT EXISTS {table_name}_{int(value)} 
+        PARTITION OF {table_name} FOR VALUES IN ({int(value)});
+        ''' for value in values)
     
-    table_name = 'TEAMS'
+    if create_partitions_statement == '':
+        return None
     
-    if overwrite == True:
-        drop_table_statement = f'''DROP TABLE IF EXISTS {table_name};'''
-    else:
-        drop_table_statement = ''
-        
-    create_table_statment = f'''
-        {drop_table_statement}
-        
-        CREATE TABLE {table_name}
-        (
-            LEAGUE_ID BIGINT
-            , SEASON_ID SMALLINT
-            , TEAM_ID SMALLINT
-            , MANAGER_ID VARCHAR(50)
-            , TEAM_NAME VARCHAR(50)
-            , MANAGER_NAME VARCHAR(50)
-            , ESPN_NAME VARCHAR(50)
-
-            , CONSTRAINT TEAMS_PKEY PRIMARY KEY(LEAGUE_ID, SEASON_ID, TEAM_ID)
-        );
-        '''
+    cursor = conn.cursor()
+    cursor.execute(create_partitions_statement)
+    if commit:
+        conn.commit()
 
+    cursor.close()
+
+
+def create_table(conn: psycopg2.connect, table_name: str, overwrite: bool=False) -> None:
+    ''' Creates a table from its TABLE_SCHEMAS definition '''
+    
     cursor = conn.cursor()
-    cursor.execute(create_table_statment)
+    cursor.execute(create_table_statement(table_name, overwrite=overwrite))
     conn.commit()
 
     cursor.close()
+
+
+def create_table_scores(conn: psycopg2.connect, overwrite: bool=False) -> None:
+    ''' Creates the columns and relationships of the WEEKLY_SCORES table '''
+    
+    create_table(conn, 'SCORES', overwrite=overwrite)
+    
+    
+def create_table_matchups(conn: psycopg2.connect, overwrite: bool=False) -> None:
+    ''' Creates the columns and relationships of the MATCHUPS table '''
+    
+    create_table(conn, 'MATCHUPS', overwrite=overwrite)
+    
+    
+def create_table_teams(conn: psycopg2.connect, overwrite: bool=False) -> None:
+    ''' Creates the columns and relationships of the TEAMS table '''
+    
+    create_table(conn, 'TEAMS', overwrite=overwrite)
     
     
 def create_table_weeks(conn: psycopg2.connect, overwrite: bool=False) -> None:
     ''' Creates the columns and relationships of the WEEKS table '''
     
-    table_name = 'WEEKS'
-    
-    if overwrite == True:
-        drop_table_statement = f'''DROP TABLE IF EXISTS {table_name};'''
-    else:
-        drop_table_statement = ''
-        
-    create_table_statment = f'''
-        {drop_table_statement}
-        
-        CREATE TABLE {table_name}
-        (
-            LEAGUE_ID BIGINT
-            , SEASON_ID SMALLINT
-            , WEEK_NUMBER SMALLINT
-            , MATCHUP_PERIOD SMALLINT
-            , REG_SEASON_FLAG SMALLINT
-
-            , CONSTRAINT WEEKS_PKEY PRIMARY KEY(LEAGUE_ID, SEASON_ID, WEEK_NUMBER)
-        );
-        '''
-
-    cursor = conn.cursor()
-    cursor.execute(create_table_statment)
-    conn.commit()
-
-    cursor.close()
+    create_table(conn, 'WEEKS', overwrite=overwrite)
     
     
 def create_table_divisions(conn: psycopg2.connect, overwrite: bool=False) -> None:
     ''' Creates the columns and relationships of the DIVISIONS table '''
     
-    table_name = 'DIVISIONS'
+    create_table(conn, 'DIVISIONS', overwrite=overwrite)
     
-    if overwrite == True:
-        drop_table_statement = f'''DROP TABLE IF EXISTS {table_name};'''
-    else:
-        drop_table_statement = ''
-        
-    create_table_statment = f'''
-        {drop_table_statement}
-        
-        CREATE TABLE {table_name}
-        (
-            LEAGUE_ID BIGINT
-            , SEASON_ID SMALLINT
-            , DIVISION_NAME VARCHAR(50)
-            , SIZE SMALLINT
-            , DIVISION_ID SMALLINT
-
-            , CONSTRAINT DIVISIONS_PKEY PRIMARY KEY(LEAGUE_ID, SEASON_ID, DIVISION_ID)
-        );
-        '''
+    
+def create_table_settings(conn: psycopg2.connect, overwrite: bool=False) -> None:
+    ''' Creates the columns and relationships of the SETTINGS table '''
+    
+    create_table(conn, 'SETTINGS', overwrite=overwrite)
 
+
+def add_row_hash_columns(conn: psycopg2.connect, tables: list=None) -> None:
+    ''' 
+    Adds the ROW_HASH column to tables created before it existed. 
+    Their rows are all rewritten on the next load, after which unchanged rows are skipped.
+    '''
+    
+    if tables is None:
+        tables = list(TABLE_SCHEMAS)
+    
+    alter_table_statement = ''.join(f'''
+        ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS ROW_HASH BIGINT;
+        ''' for table_name in tables)
+    
     cursor = conn.cursor()
-    cursor.execute(create_table_statment)
+    cursor.execute(alter_table_statement)
     conn.commit()
 
     cursor.close()
+
+
+def widen_cum_all_play_wlt_points(conn: psycopg2.connect) -> None:
+    ''' 
+    Changes SCORES.CUM_ALL_PLAY_WLT_POINTS from NUMERIC(4, 1) to DOUBLE PRECISION. The materialized 
+    views read the column so they're dropped and created again around it. The seasons need reloaded 
+    afterwards since the totals already in SCORES stay rounded.
+    '''
     
+    drop_views_statement = ''.join(f'''
+        DROP MATERIALIZED VIEW IF EXISTS {view_name};
+        ''' for view_name in MATERIALIZED_VIEWS)
     
-def create_table_settings(conn: psycopg2.connect, overwrite: bool=False) -> None:
-    ''' Creates the columns and relationships of the SETTINGS table '''
+    cursor = conn.cursor()
+    try:
+        cursor.execute(drop_views_statement)
+        cursor.execute('''
+            ALTER TABLE SCORES ALTER COLUMN CUM_ALL_PLAY_WLT_POINTS TYPE DOUBLE PRECISION;
+        ''')
+        
+        conn.commit()
+    except (Exception, psycopg2.DatabaseError) as error:
+        print("Error: %s" % error)
+        conn.rollback()
+        cursor.close()
+        return 1
+    cursor.close()
+    
+    create_materialized_views(conn)
+
+
+def migrate_to_partitioned(conn: psycopg2.connect, table_name: str='SCORES') -> None:
+    ''' 
+    Rebuilds an existing table as a partitioned one with its indexes, moving the rows over.
+    Runs in a single transaction so the table is never missing or half copied.
+    '''
     
-    table_name = 'SETTINGS'
+    schema = TABLE_SCHEMAS[table_name]
+    old_table_name = table_name + '_UNPARTITIONED'
+    partition_by = schema['partition_by']
     
-    if overwrite == True:
-        drop_table_statement = f'''DROP TABLE IF EXISTS {table_name};'''
-    else:
-        drop_table_statement = ''
+    cursor = conn.cursor()
+    try:
+        # the primary key's index name would clash with the new table's
+        cursor.execute(f'''
+            ALTER TABLE {table_name} RENAME TO {old_table_name};
+            ALTER TABLE {old_table_name} RENAME CONSTRAINT {schema['pkey_name']} 
+                TO {schema['pkey_name']}_UNPARTITIONED;
+        ''')
         
-    create_table_statment = f'''
-        {drop_table_statement}
+        cursor.execute(f'''SELECT DISTINCT {partition_by} FROM {old_table_name}''')
+        values = [row[0] for row in cursor.fetchall()]
         
-        CREATE TABLE {table_name}
-        (
-            LEAGUE_ID BIGINT
-            , SEASON_ID SMALLINT
-            , PLAYOFF_SEEDING_RULE VARCHAR(100)
-            , PLAYOFF_SEEDING_RULE_BY SMALLINT
-            , NUM_PLAYOFF_TEAMS SMALLINT
-            , FIRST_SCORING_PERIOD SMALLINT
-            , FINAL_SCORING_PERIOD SMALLINT
-            , PLAYOFF_WEEK_START SMALLINT
-            , SCORING_TYPE VARCHAR(50)
-            , REG_SEASON_MATCHUP_TIEBREAKER VARCHAR(50)
-            , PLAYOFF_MATCHUP_TIEBREAKER VARCHAR(50)
-            , HOME_TEAM_BONUS SMALLINT
-
-            , CONSTRAINT SETTINGS_PKEY PRIMARY KEY(LEAGUE_ID, SEASON_ID)
-        );
-        '''
-
-    cursor = conn.cursor()
-    cursor.execute(create_table_statment)
-    conn.commit()
-
+        cursor.execute('''
+            SELECT COLUMN_NAME
+            FROM INFORMATION_SCHEMA.COLUMNS
+            WHERE TABLE_SCHEMA = 'public'
+                AND TABLE_NAME = %s
+        ''', (old_table_name.lower(),))
+        old_cols = set(row[0] for row in cursor.fetchall())
+        
+        cursor.execute(create_table_statement(table_name))
+        create_partitions(conn, table_name, values, commit=False)
+        
+        cols = ', '.join(col for col, _ in schema['columns'] if col.lower() in old_cols)
+        cursor.execute(f'''
+            INSERT INTO {table_name} ({cols}) 
+            SELECT {cols} FROM {old_table_name};
+            
+            DROP TABLE {old_table_name};
+        ''')
+        
+        conn.commit()
+    except (Exception, psycopg2.DatabaseError) as error:
+        print("Error: %s" % error)
+        conn.rollback()
+        cursor.close()
+        return 1
     cursor.close()
 
 
@@ -207,9 +363,14 @@ if __name__ == '__main__':
     conn = create_db_connection(connect_params=connect_params)
     
     create_table_scores(conn, overwrite=True)
+    create_table_matchups(conn, overwrite=True)
     create_table_teams(conn, overwrite=True)
     create_table_weeks(conn, overwrite=True)
     create_table_divisions(conn, overwrite=True)
     create_table_settings(conn, overwrite=True)
     
+    # add_row_hash_columns(conn)
+    # migrate_to_partitioned(conn, 'SCORES')
+    # widen_cum_all_play_wlt_points(conn)
+    
     conn.close()
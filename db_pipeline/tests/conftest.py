@@ -0,0 +1,6 @@
+import os
+import sys
+
+# db_pipeline's modules import each other (and pull_data's modules) from their own directories
+DB_PIPELINE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [DB_PIPELINE_DIR, os.path.join(DB_PIPELINE_DIR, 'pull_data')]
@@ -0,0 +1,57 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import standings
+import sql_standings
+from load_tables import TABLE_PKEYS, engine_table_pkeys
+from test_standings import RANK_METRICS, PLAYOFF_WEEK_START, fake_schedule, assert_standings_equal
+
+
+LEAGUE_ID, SEASON_ID = 1, 2020
+
+
+def sqlite_connection(df_matchups):
+    """ Returns an in-memory sqlite DB with df_matchups as the MATCHUPS table """
+
+    conn = sqlite3.connect(':memory:')
+
+    # sqlite's ROUND rounds half away from zero while Postgres and pandas round doubles half to even
+    conn.create_function('ROUND', 1, lambda x: None if x is None else float(round(x)), deterministic=True)
+
+    df_matchups.to_sql('MATCHUPS', conn, index=False)
+
+    return conn
+
+
+def sql_standings_df(matchup_data):
+    df_matchups = standings.pull_matchups(matchup_data, PLAYOFF_WEEK_START)
+    df_matchups = df_matchups.assign(league_id=LEAGUE_ID, season_id=SEASON_ID,
+                                     playoff_week_start=PLAYOFF_WEEK_START)
+
+    conn = sqlite_connection(df_matchups)
+    try:
+        query = sql_standings.standings_statement('SELECT * FROM MATCHUPS', RANK_METRICS)
+        df = pd.read_sql_query(query, conn)
+    finally:
+        conn.close()
+
+    return df.rename(columns=str.lower)
+
+
+@pytest.mark.parametrize('number_of_teams, seed', [(4, seed) for seed in range(10)] +
+                                                  [(12, seed) for seed in range(20)])
+def test_sql_matches_pull_standings(number_of_teams, seed):
+    matchup_data = fake_schedule(number_of_teams, seed)
+    df_expected = standings.pull_standings(matchup_data, PLAYOFF_WEEK_START, RANK_METRICS)
+
+    assert_standings_equal(sql_standings_df(matchup_data), df_expected)
+
+
+def test_matchups_only_loaded_for_sql_engine():
+    assert 'matchups' not in engine_table_pkeys(TABLE_PKEYS, 'pandas')
+    assert 'scores' in engine_table_pkeys(TABLE_PKEYS, 'pandas')
+
+    assert 'matchups' in engine_table_pkeys(TABLE_PKEYS, 'sql')
+    assert 'scores' not in engine_table_pkeys(TABLE_PKEYS, 'sql')
@@ -0,0 +1,129 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import standings
+from table_schemas import TABLE_SCHEMAS
+
+
+RANK_METRICS = {'1-4': [['cum_total_wins', 'cum_score'], [False, False]],
+                '5-6': [['cum_all_play_wins', 'cum_score'], [False, False]],
+                '7-12': [['cum_total_wins', 'cum_score'], [False, False]]}
+
+PLAYOFF_WEEK_START = 15
+
+
+def fake_schedule(number_of_teams, seed, weeks=17):
+    """ Returns a slimmed schedule (see ApiData._slim_schedule) with random scores, ties included """
+
+    rng = random.Random(seed)
+
+    schedule = []
+    for week_number in range(1, weeks + 1):
+        team_ids = list(range(1, number_of_teams + 1))
+        rng.shuffle(team_ids)
+
+        for away_id, home_id in zip(team_ids[::2], team_ids[1::2]):
+            # scores are picked from a small set so that all play ties happen in some weeks but not others
+            schedule.append({'matchupPeriodId': week_number,
+                             'away': {'teamId': away_id, 'totalPoints': float(rng.randint(80, 110))},
+                             'home': {'teamId': home_id, 'totalPoints': float(rng.randint(80, 110))}})
+
+    return {'schedule': schedule}
+
+
+def assert_standings_equal(df, df_expected):
+    df = df.sort_values(['week_number', 'standings']).reset_index(drop=True)
+    df_expected = df_expected.sort_values(['week_number', 'standings']).reset_index(drop=True)
+
+    assert len(df) == len(df_expected)
+
+    for col in ['week_number', 'team_id', 'standings', 'record', 'all_play_record']:
+        assert df[col].tolist() == df_expected[col].tolist(), col
+
+    for col in ['cum_score', 'cum_wlt_points', 'cum_all_play_wlt_points', 'cum_score_per_week',
+                'cum_all_play_wlt_points_per_week']:
+        np.testing.assert_allclose(df[col].astype('float'), df_expected[col].astype('float'), atol=0.011,
+                                   err_msg=col)
+
+
+@pytest.mark.parametrize('number_of_teams, seed', [(4, seed) for seed in range(10)] +
+                                                  [(12, seed) for seed in range(20)])
+def test_incremental_matches_pull_standings(number_of_teams, seed):
+    matchup_data = fake_schedule(number_of_teams, seed)
+    df_expected = standings.pull_standings(matchup_data, PLAYOFF_WEEK_START, RANK_METRICS)
+
+    prior_scores = None
+    weeks = []
+    for week_number in range(1, PLAYOFF_WEEK_START):
+        prior_scores = standings.pull_standings_incremental(matchup_data, prior_scores, week_number,
+                                                            PLAYOFF_WEEK_START, RANK_METRICS)
+        weeks.append(prior_scores)
+
+    assert_standings_equal(pd.concat(weeks), df_expected)
+
+
+def scores_round_trip(df_scores):
+    """ Returns df_scores rounded the way the SCORES table's NUMERIC columns store them """
+
+    df_scores = df_scores.copy()
+
+    for col, col_type in TABLE_SCHEMAS['SCORES']['columns']:
+        if col.lower() in df_scores.columns and col_type.startswith('NUMERIC'):
+            scale = int(col_type.split(',')[1].strip(' )'))
+            df_scores[col.lower()] = df_scores[col.lower()].astype('float').round(scale)
+
+    return df_scores
+
+
+@pytest.mark.parametrize('number_of_teams, seed', [(12, seed) for seed in range(20)])
+def test_incremental_matches_pull_standings_from_db_rows(number_of_teams, seed):
+    # three or more teams tied on a week's score split the all play points into 1/3s etc.
+    matchup_data = fake_schedule(number_of_teams, seed)
+    df_expected = standings.pull_standings(matchup_data, PLAYOFF_WEEK_START, RANK_METRICS)
+
+    prior_scores = None
+    weeks = []
+    for week_number in range(1, PLAYOFF_WEEK_START):
+        prior_scores = standings.pull_standings_incremental(matchup_data, prior_scores, week_number,
+                                                            PLAYOFF_WEEK_START, RANK_METRICS)
+        prior_scores = scores_round_trip(prior_scores)
+        weeks.append(prior_scores)
+
+    assert_standings_equal(pd.concat(weeks), scores_round_trip(df_expected))
+
+
+@pytest.mark.parametrize('number_of_teams, seed', [(4, seed) for seed in range(10)] +
+                                                  [(12, seed) for seed in range(20)])
+def test_iter_standings_matches_pull_standings(number_of_teams, seed):
+    matchup_data = fake_schedule(number_of_teams, seed)
+    df_expected = standings.pull_standings(matchup_data, PLAYOFF_WEEK_START, RANK_METRICS)
+
+    df = pd.concat(standings.iter_standings(matchup_data, PLAYOFF_WEEK_START, RANK_METRICS))
+
+    assert_standings_equal(df, df_expected)
+
+
+def test_incremental_raises_without_prior_week():
+    matchup_data = fake_schedule(4, 0)
+    df_scores = standings.pull_standings(matchup_data, PLAYOFF_WEEK_START, RANK_METRICS)
+
+    with pytest.raises(standings.MissingPriorWeek):
+        standings.pull_standings_incremental(matchup_data, df_scores.loc[df_scores['week_number'] < 3], 5,
+                                             PLAYOFF_WEEK_START, RANK_METRICS)
+
+
+def test_incremental_matches_pull_standings_with_missing_rows():
+    # a team missing from a week still counts towards the other teams' all play losses
+    matchup_data = fake_schedule(12, 0)
+    week_5 = [matchup_dict for matchup_dict in matchup_data['schedule'] if matchup_dict['matchupPeriodId'] == 5]
+    del week_5[0]['away']['totalPoints']
+
+    df_expected = standings.pull_standings(matchup_data, PLAYOFF_WEEK_START, RANK_METRICS)
+    df_prior = df_expected.loc[df_expected['week_number'] == 4]
+
+    df = standings.pull_standings_incremental(matchup_data, df_prior, 5, PLAYOFF_WEEK_START, RANK_METRICS)
+
+    assert_standings_equal(df, df_expected.loc[df_expected['week_number'] == 5])
@@ -0,0 +1,15 @@
+'''
+Lets the app import the ESPN modules kept with db_pipeline's pull_data (espn_cache, espn_scheduler,
+espn_fixtures and api_data's create_session), so the app and the ETL share one copy of them along
+with one response cache.
+'''
+
+import os
+import sys
+
+
+PULL_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'db_pipeline', 'pull_data')
+
+# appended rather than prepended so nothing in pull_data shadows the app's own modules
+if PULL_DATA_DIR not in sys.path:
+    sys.path.append(PULL_DATA_DIR)
@@ -0,0 +1,124 @@
+'''
+Local stand-in for the ESPN API that replays fixtures recorded with espn_fixtures.
+
+Point the pulls at it by setting ESPN_BASE_URL (e.g. http://127.0.0.1:8765) before
+running the pipeline, the app or a benchmark. Latency and 429s can be injected to see
+how the rest of the code holds up. Use ESPN_CACHE_DIR to point the response cache at
+an empty directory (or turn it off) so every pull actually reaches the server.
+
+Recording skips the response cache, so the fixtures cover every pull even when the cache is warm.
+
+Example:
+    ESPN_RECORD_DIR=fixtures python create_ff_standings.py
+    python mock_espn_server.py fixtures --port 8765 --latency 0.2 --error-rate 0.1
+    ESPN_BASE_URL=http://127.0.0.1:8765 ESPN_CACHE_DIR=/tmp/empty python create_ff_standings.py
+'''
+
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import espn_modules  # noqa: F401 - makes espn_fixtures importable
+from espn_fixtures import read_fixture
+
+
+class MockEspnHandler(BaseHTTPRequestHandler):
+    # These are set on the subclass created by create_mock_server
+    record_dir = None
+    latency = 0
+    latency_jitter = 0
+    error_rate = 0
+    retry_after = 1
+
+    def do_GET(self):
+        time.sleep(self.latency + random.uniform(0, self.latency_jitter))
+
+        if random.random() < self.error_rate:
+            self._send(429, {'Retry-After': str(self.retry_after)}, {'messages': ['rate limited']})
+            return None
+
+        fixture = read_fixture(self.path, self.record_dir,
+                               fantasy_filter=self.headers.get('X-Fantasy-Filter'))
+        if fixture is None:
+            self._send(404, {}, {'messages': ['no fixture recorded for ' + self.path]})
+            return None
+
+        headers = fixture['headers']
+        etag = headers.get('ETag')
+        if etag is not None and self.headers.get('If-None-Match') == etag:
+            self._send(304, headers, None)
+            return None
+
+        self._send(fixture['status'], headers, fixture['body'])
+
+    def _send(self, status: int, headers: dict, body: [dict, list, None]) -> None:
+        self.send_response(status)
+
+        for header, value in headers.items():
+            if header != 'Content-Type':
+                self.send_header(header, value)
+
+        if body is None:
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+
+        payload = json.dumps(body).encode('utf-8')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        # Logging every request would skew the benchmarks this is used for
+        pass
+
+
+def create_mock_server(record_dir: str, host: str='127.0.0.1', port: int=0, latency: float=0,
+                       latency_jitter: float=0, error_rate: float=0,
+                       retry_after: int=1) -> ThreadingHTTPServer:
+    """
+    Returns a server that replays the fixtures in record_dir. port=0 picks a free port,
+    which can be read from server.server_address.
+    """
+
+    handler_attrs = {'record_dir': record_dir, 'latency': latency, 'latency_jitter': latency_jitter,
+                     'error_rate': error_rate, 'retry_after': retry_after}
+    handler = type('ConfiguredMockEspnHandler', (MockEspnHandler,), handler_attrs)
+
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def start_mock_server(record_dir: str, **kwargs) -> [ThreadingHTTPServer, str]:
+    """ Starts the server in a background thread and returns it along with its base url. """
+
+    server = create_mock_server(record_dir, **kwargs)
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    host, port = server.server_address[:2]
+
+    return server, f'http://{host}:{port}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replays recorded ESPN fixtures')
+    parser.add_argument('record_dir')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every response')
+    parser.add_argument('--latency-jitter', type=float, default=0, help='random extra latency up to this')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of requests answered with a 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After sent with injected 429s')
+    args = parser.parse_args()
+
+    server = create_mock_server(args.record_dir, host=args.host, port=args.port, latency=args.latency,
+                                latency_jitter=args.latency_jitter, error_rate=args.error_rate,
+                                retry_after=args.retry_after)
+
+    print(f'Serving {args.record_dir} on http://{args.host}:{args.port}')
+    server.serve_forever()
@@ -1,4 +1,17 @@
-import requests
+import os
+
+import espn_modules  # noqa: F401 - makes espn_cache, espn_scheduler and api_data importable
+import espn_cache
+import espn_scheduler
+from api_data import create_session
+
+
+# Can be pointed at mock_espn_server to replay recorded fixtures
+ESPN_BASE_URL = os.environ.get('ESPN_BASE_URL', 'https://fantasy.espn.com')
+
+
+# Shared by every pull_data call so the connection to ESPN is kept alive between pulls
+session = create_session()
 
 
 def convert_tuple_to_list(tuple_var):
@@ -35,17 +48,21 @@ def convert_dict_to_list(dict_var):
     return list_var
 
 
-def pull_data(season_id, league_id, params=None):
-    """ Returns a JSON object containing the data pulled APIs url """
+def pull_data(season_id, league_id, params=None, use_cache=True):
+    """
+    Returns a JSON object containing the data pulled APIs url
+    Note: responses are served from the on-disk cache (see espn_cache) unless use_cache is False
+    Raises espn_scheduler.EspnUnavailable if the data couldn't be pulled
+    """
 
     if params == None:
         params = []
 
     if season_id < 2020:
-        url = "https://fantasy.espn.com/apis/v3/games/ffl/leagueHistory/" + \
+        url = ESPN_BASE_URL + "/apis/v3/games/ffl/leagueHistory/" + \
               str(league_id) + "?seasonId=" + str(season_id)
     else:
-        url = "https://fantasy.espn.com/apis/v3/games/ffl/seasons/" + \
+        url = ESPN_BASE_URL + "/apis/v3/games/ffl/seasons/" + \
               str(season_id) + "/segments/0/leagues/" + str(league_id)
 
     # Passing the dict_params directly to the request_params of the requests.get method was
@@ -68,22 +85,24 @@ def pull_data(season_id, league_id, params=None):
         else:
             url = url + "&" + param + "=" + param_value
 
-    r = requests.get(url)
+    if use_cache:
+        d = espn_cache.cached_get(session, url, season_id, league_id, params)
 
-    if r.status_code == 200:
-        pass
+        # every caller needs the data, so a failed pull is raised rather than handed back as None
+        if d is None:
+            raise espn_scheduler.EspnUnavailable("%s didn't return any data" % url)
     else:
-        if r.status_code == 429:
-            print("429 error")
+        r = espn_scheduler.scheduler.get(session, url)
 
-        return None
+        if r.status_code != 200:
+            r.close()
+            raise espn_scheduler.EspnUnavailable("%s returned %s" % (url, r.status_code))
 
-        # 2020 url returns JSON object while prior season_ids return it in a list
-    if season_id < 2020:
-        d = r.json()[0]
-    else:
         d = r.json()
+        r.close()
 
-    r.close()
+    # 2020 url returns JSON object while prior season_ids return it in a list
+    if season_id < 2020:
+        d = d[0]
 
-    return d
\ No newline at end of file
+    return d
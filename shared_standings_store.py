@@ -0,0 +1,156 @@
+'''
+Standings shared by every gunicorn worker on a dyno through memory-mapped Arrow files.
+
+One worker at a time (whichever holds the lock) builds the standings and writes them as a new
+generation. The rest only check the generation file and map the new Arrow file when it changes,
+so the standings are built once per dyno rather than once per worker. The Arrow buffers are
+shared through the page cache - numeric columns are handed to pandas without a copy.
+'''
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+import pyarrow as pa
+
+try:
+    import fcntl
+except ImportError:
+    # Windows - there's only ever one process there (the dev server) so there's nothing to lock
+    fcntl = None
+
+
+STORE_DIR = os.environ.get('STANDINGS_STORE_DIR',
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshots', 'shared'))
+
+# Seconds between checks for a generation published by another worker
+POLL_INTERVAL = int(os.environ.get('STANDINGS_STORE_POLL', 15))
+
+# Older generations are removed once they're this far behind. Workers that still have them mapped
+# keep reading them fine since the data isn't freed until they're unmapped
+KEEP_GENERATIONS = 2
+
+
+class SharedStandingsStore():
+
+    def __init__(self, league_id, season_id, store_dir=None):
+        if store_dir is None:
+            store_dir = STORE_DIR
+
+        self.store_dir = store_dir
+        self.prefix = f'standings_{league_id}_{season_id}'
+
+        self.generation_path = os.path.join(store_dir, self.prefix + '.generation.json')
+        self.lock_path = os.path.join(store_dir, self.prefix + '.lock')
+
+        self._thread_lock = threading.Lock()
+
+    def arrow_path(self, generation: int) -> str:
+        return os.path.join(self.store_dir, f'{self.prefix}.{generation}.arrow')
+
+    def generation_info(self) -> [dict, None]:
+        """
+        Returns the current generation along with when it was built and its week number,
+        or None if nothing has been published yet
+        """
+
+        try:
+            with open(self.generation_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @contextmanager
+    def lock(self, blocking: bool=False):
+        """ Yields True if the lock was acquired, meaning this process may publish a new generation """
+
+        os.makedirs(self.store_dir, exist_ok=True)
+
+        if not self._thread_lock.acquire(blocking):
+            yield False
+            return
+
+        try:
+            if fcntl is None:
+                yield True
+                return
+
+            with open(self.lock_path, 'w') as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    yield False
+                    return
+
+                try:
+                    yield True
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        finally:
+            self._thread_lock.release()
+
+    def publish(self, df_standings, current_week_number: int, built_at: float=None) -> int:
+        """
+        Writes the standings as the next generation and returns it. Should only be called while holding lock.
+        built_at is when the standings were pulled (defaults to now)
+        """
+
+        if built_at is None:
+            built_at = time.time()
+
+        info = self.generation_info()
+        generation = 1 if info is None else info['generation'] + 1
+
+        table = pa.Table.from_pandas(df_standings, preserve_index=False)
+
+        path = self.arrow_path(generation)
+        tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+        os.replace(tmp_path, path)
+
+        # the generation file is swapped in last so workers never see a generation that isn't fully written
+        self._write_generation_info({'generation': generation, 'built_at': built_at,
+                                     'current_week_number': current_week_number})
+
+        self._remove_old_generations(generation)
+
+        return generation
+
+    def mark_refreshed(self, info: dict, built_at: float=None) -> None:
+        """
+        Records that the current generation was just rebuilt and didn't change, so the other
+        workers don't rebuild it too. Should only be called while holding lock
+        """
+
+        if built_at is None:
+            built_at = time.time()
+
+        self._write_generation_info(dict(info, built_at=built_at))
+
+    def read(self, info: dict):
+        """ Returns the standings for the generation in info (from generation_info) mapped from its Arrow file """
+
+        source = pa.memory_map(self.arrow_path(info['generation']), 'r')
+        table = pa.ipc.open_file(source).read_all()
+
+        return table.to_pandas(split_blocks=True)
+
+    def _write_generation_info(self, info: dict) -> None:
+        tmp_path = self.generation_path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(info, f)
+
+        os.replace(tmp_path, self.generation_path)
+
+    def _remove_old_generations(self, generation: int) -> None:
+        for old_generation in range(generation - KEEP_GENERATIONS - 1, 0, -1):
+            try:
+                os.remove(self.arrow_path(old_generation))
+            except FileNotFoundError:
+                # anything older was already removed
+                break
@@ -0,0 +1,272 @@
+'''
+Reads the standings the ETL (db_pipeline) has already loaded into the SCORES table, through the
+STANDINGS_HISTORY and CURRENT_STANDINGS materialized views it keeps (see db_pipeline/materialized_views.py).
+
+Connections come from a pool shared by the app's threads, and the queries are prepared once
+per connection and then executed with the (league_id, season_id, week_number) they need.
+Results are kept in a small cache for a short time since every page load asks for the same rows.
+'''
+
+import os
+import time
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+import create_team_data
+
+
+# A libpq connection string or URL. Heroku sets DATABASE_URL for the attached database
+DATABASE_URL = os.environ.get('STANDINGS_DATABASE_URL', os.environ.get('DATABASE_URL'))
+
+POOL_MIN_CONN = int(os.environ.get('STANDINGS_DB_POOL_MIN', 1))
+POOL_MAX_CONN = int(os.environ.get('STANDINGS_DB_POOL_MAX', 4))
+
+# Seconds a result is served from the cache
+RESULT_CACHE_TTL = int(os.environ.get('STANDINGS_DB_CACHE_TTL', 60))
+RESULT_CACHE_SIZE = 64
+
+# The columns are renamed to the ones create_ff_standings uses so the app can't tell the difference
+STANDINGS_COLUMNS = '''
+    S.LEAGUE_ID AS league_id
+    , S.SEASON_ID AS season_id
+    , S.WEEK_NUMBER AS week_number
+    , S.TEAM_ID AS "teamId"
+    , S.STANDINGS AS standings
+    , S.MANAGER_NAME AS full_name
+    , S.RECORD AS cum_wlt
+    , S.ALL_PLAY_RECORD AS cum_all_play_wlt_int
+    , S.CUM_WINS AS cum_wins
+    , S.CUM_LOSSES AS cum_losses
+    , S.CUM_TIES AS cum_ties
+    , S.CUM_WLT_POINTS AS cum_total_wins
+    , S.CUM_ALL_PLAY_WLT_POINTS AS cum_all_play_wins
+    , S.CUM_SCORE AS cum_score
+    , S.CUM_SCORE_OPP AS cum_score_opp
+    , S.CUM_SCORE_PER_WEEK AS cum_score_per_week
+    , S.CUM_SCORE_OPP_PER_WEEK AS cum_score_opp_per_week
+    , S.CUM_ALL_PLAY_WLT_POINTS_PER_WEEK AS cum_all_play_wins_per_week
+'''
+
+# STANDINGS_HISTORY already has the TEAMS columns joined on
+STANDINGS_FROM = '''
+    FROM STANDINGS_HISTORY S
+'''
+
+# name -> statement. $1 = league_id, $2 = season_id, $3 = week_number
+PREPARED_STATEMENTS = {
+    'standings_through_week': f'''
+        PREPARE standings_through_week (BIGINT, SMALLINT, BIGINT) AS
+        SELECT {STANDINGS_COLUMNS}
+        {STANDINGS_FROM}
+        WHERE S.LEAGUE_ID = $1
+            AND S.SEASON_ID = $2
+            AND S.WEEK_NUMBER <= $3
+        ORDER BY S.WEEK_NUMBER, S.STANDINGS
+    ''',
+    # only the weeks db_pipeline says changed (see standings_notify)
+    'standings_from_week': f'''
+        PREPARE standings_from_week (BIGINT, SMALLINT, BIGINT) AS
+        SELECT {STANDINGS_COLUMNS}
+        {STANDINGS_FROM}
+        WHERE S.LEAGUE_ID = $1
+            AND S.SEASON_ID = $2
+            AND S.WEEK_NUMBER >= $3
+        ORDER BY S.WEEK_NUMBER, S.STANDINGS
+    ''',
+    # CURRENT_STANDINGS is a materialized view maintained by db_pipeline (see materialized_views.py)
+    'latest_week': '''
+        PREPARE latest_week (BIGINT, SMALLINT, BIGINT) AS
+        SELECT LEAST(MAX(WEEK_NUMBER), $3)
+        FROM CURRENT_STANDINGS
+        WHERE LEAGUE_ID = $1
+            AND SEASON_ID = $2
+    '''
+}
+
+# NUMERIC columns are read as floats rather than Decimals since pandas can't do much with Decimals
+DECIMAL_TO_FLOAT = psycopg2.extensions.new_type(psycopg2.extensions.DECIMAL.values, 'DECIMAL_TO_FLOAT',
+                                                lambda value, cursor: float(value) if value is not None else None)
+
+
+class ReaderConnection(psycopg2.extensions.connection):
+    """ Connection that remembers which statements have been prepared on it """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.prepared = set()
+        psycopg2.extensions.register_type(DECIMAL_TO_FLOAT, self)
+
+
+class StandingsReader():
+
+    def __init__(self, dsn: str=None, min_conn: int=None, max_conn: int=None, cache_ttl: int=None,
+                 cache_size: int=RESULT_CACHE_SIZE):
+        if dsn is None:
+            dsn = DATABASE_URL
+
+        if min_conn is None:
+            min_conn = POOL_MIN_CONN
+
+        if max_conn is None:
+            max_conn = POOL_MAX_CONN
+
+        if cache_ttl is None:
+            cache_ttl = RESULT_CACHE_TTL
+
+        self.pool = psycopg2.pool.ThreadedConnectionPool(min_conn, max_conn, dsn=dsn,
+                                                         connection_factory=ReaderConnection)
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def execute(self, statement: str, league_id: int, season_id: int, week_number: int) -> [pd.DataFrame, None]:
+        """ Returns the rows for a prepared statement, served from the cache when it's fresh """
+
+        key = (statement, league_id, season_id, week_number)
+
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None and time.time() - cached[0] < self.cache_ttl:
+                self._cache.move_to_end(key)
+                return cached[1]
+
+        df = self._execute(statement, league_id, season_id, week_number)
+        if df is None:
+            return None
+
+        with self._cache_lock:
+            self._cache[key] = (time.time(), df)
+            self._cache.move_to_end(key)
+
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return df
+
+    def invalidate(self, league_id: int, season_id: int) -> None:
+        """ Drops the cached results of a league/season so they're read again """
+
+        with self._cache_lock:
+            for key in [key for key in self._cache if key[1:3] == (league_id, season_id)]:
+                del self._cache[key]
+
+    def close(self) -> None:
+        self.pool.closeall()
+
+    def _execute(self, statement: str, league_id: int, season_id: int, week_number: int) -> [pd.DataFrame, None]:
+        conn = self.pool.getconn()
+
+        cursor = conn.cursor()
+        try:
+            if statement not in conn.prepared:
+                cursor.execute(PREPARED_STATEMENTS[statement])
+                conn.prepared.add(statement)
+
+            cursor.execute(f'EXECUTE {statement} (%s, %s, %s)', (league_id, season_id, week_number))
+
+            rows = cursor.fetchall()
+            cols = [col[0] for col in cursor.description]
+
+            # nothing here writes, but the select still opened a transaction
+            conn.rollback()
+            cursor.close()
+            self.pool.putconn(conn)
+
+            return pd.DataFrame(rows, columns=cols)
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            print("Error: %s" % error)
+            cursor.close()
+
+            # the connection may be broken so it isn't reused
+            self.pool.putconn(conn, close=True)
+
+            return None
+
+
+_reader = None
+_reader_lock = threading.Lock()
+
+
+def get_reader() -> StandingsReader:
+    """ Returns the reader shared by the process, creating its pool the first time it's needed """
+    global _reader
+
+    with _reader_lock:
+        if _reader is None:
+            _reader = StandingsReader()
+
+    return _reader
+
+
+def read_standings(league_id: int, season_id: int, max_week_number: int) -> [tuple, None]:
+    """
+    Returns the standings for every week through the latest one loaded (capped at max_week_number)
+    along with that week, or None if they couldn't be read
+    """
+
+    reader = get_reader()
+
+    df_week = reader.execute('latest_week', league_id, season_id, max_week_number)
+    if df_week is None or pd.isna(df_week.iloc[0, 0]):
+        return None
+
+    current_week_number = int(df_week.iloc[0, 0])
+
+    df_standings = reader.execute('standings_through_week', league_id, season_id, current_week_number)
+    if df_standings is None:
+        return None
+
+    df_standings = add_manual_nicknames(df_standings)
+
+    return df_standings, current_week_number
+
+
+def read_standings_from_week(league_id: int, season_id: int, from_week_number: int,
+                             max_week_number: int) -> [tuple, None]:
+    """
+    Returns the standings for from_week_number through the latest week loaded (capped at max_week_number)
+    along with that week, or None if they couldn't be read. The latest week is also taken from the rows
+    themselves in case CURRENT_STANDINGS failed to refresh.
+    """
+
+    reader = get_reader()
+
+    df_week = reader.execute('latest_week', league_id, season_id, max_week_number)
+    df_standings = reader.execute('standings_from_week', league_id, season_id, from_week_number)
+    if df_week is None or df_standings is None:
+        return None
+
+    df_standings = df_standings.loc[df_standings['week_number'] <= max_week_number]
+
+    week_numbers = [week_number for week_number in [df_week.iloc[0, 0], df_standings['week_number'].max()]
+                    if not pd.isna(week_number)]
+    if len(week_numbers) == 0:
+        return None
+
+    current_week_number = int(max(week_numbers))
+
+    df_standings = df_standings.loc[df_standings['week_number'] <= current_week_number]
+    df_standings = add_manual_nicknames(df_standings.reset_index(drop=True))
+
+    return df_standings, current_week_number
+
+
+def add_manual_nicknames(df_standings: pd.DataFrame) -> pd.DataFrame:
+    """ Returns the standings with the nicknames displayed in the app, falling back to the manager's name """
+
+    df_team = create_team_data.create_team_data()[['seasonId', 'teamId', 'manual_nickname']]
+    df_team = df_team.rename(columns={'seasonId': 'season_id'})
+
+    df_standings = pd.merge(df_standings, df_team, on=['season_id', 'teamId'], how='left')
+    df_standings['manual_nickname'] = df_standings['manual_nickname'].fillna(df_standings['full_name'])
+
+    return df_standings
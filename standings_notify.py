@@ -0,0 +1,180 @@
+'''
+Listens for the notifications db_pipeline sends when it loads new scores.
+
+The loader sends the (league_id, season_id, week_number) of the first week that changed on a
+Postgres channel once the load has committed and the materialized views the app reads are refreshed
+(see db_pipeline/materialized_views.py). A daemon thread
+holds a connection that LISTENs on that channel and hands the changed week to a callback, so the
+app can rebuild just those weeks without polling the DB.
+'''
+
+import os
+import json
+import time
+import select
+import threading
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2 import sql
+
+import standings_db
+
+
+# Needs to match db_pipeline's STANDINGS_CHANNEL
+CHANNEL = os.environ.get('STANDINGS_NOTIFY_CHANNEL', 'standings_changed')
+
+# Seconds to wait before reconnecting after the connection drops
+RECONNECT_INTERVAL = int(os.environ.get('STANDINGS_NOTIFY_RECONNECT', 30))
+
+# Seconds each wait for a notification lasts, which is how long stop() can take
+WAIT_TIMEOUT = 5
+
+
+def parse_notification(payload: str) -> [tuple, None]:
+    """ Returns the (league_id, season_id, week_number) in a notification's payload, or None if it isn't one """
+
+    try:
+        change = json.loads(payload)
+        return int(change['league_id']), int(change['season_id']), int(change['week_number'])
+    except (ValueError, TypeError, KeyError):
+        return None
+
+
+class ChangedWeeks():
+    """ The earliest week that's changed since the standings were last rebuilt """
+
+    def __init__(self):
+        self._week_number = None
+        self._changed_at = None
+        self._lock = threading.Lock()
+
+    def add(self, week_number: int, changed_at: float=None) -> None:
+        """ changed_at is when the week changed (defaults to now) """
+
+        if changed_at is None:
+            changed_at = time.time()
+
+        with self._lock:
+            if self._week_number is None or week_number < self._week_number:
+                self._week_number = week_number
+
+            self._changed_at = changed_at if self._changed_at is None else max(self._changed_at, changed_at)
+
+    def peek(self) -> [int, None]:
+        with self._lock:
+            return self._week_number
+
+    def pop(self) -> [int, None]:
+        """ Returns the earliest changed week (or None) and clears it """
+
+        with self._lock:
+            week_number = self._week_number
+            self._week_number = None
+            self._changed_at = None
+
+        return week_number
+
+    def clear_built_since(self, built_at: float) -> bool:
+        """
+        Clears the changed weeks if standings pulled at built_at already include them, i.e. another
+        worker rebuilt them after the last change. Returns True if they were cleared
+        """
+
+        with self._lock:
+            if self._changed_at is None or built_at < self._changed_at:
+                return False
+
+            self._week_number = None
+            self._changed_at = None
+
+        return True
+
+
+class StandingsListener():
+
+    def __init__(self, league_id: int, season_id: int, on_change, dsn: str=None, channel: str=CHANNEL):
+        """
+        on_change is called with the first week that changed each time new scores are loaded for the
+        league/season. Notifications for other league/seasons are ignored.
+        """
+
+        if dsn is None:
+            dsn = standings_db.DATABASE_URL
+
+        self.league_id = league_id
+        self.season_id = season_id
+        self.on_change = on_change
+        self.dsn = dsn
+        self.channel = channel
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        """ Starts listening in a daemon thread """
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def handle_notifications(self, notifies: list) -> None:
+        """ Calls on_change once with the earliest week changed across notifies """
+
+        week_numbers = []
+        for notify in notifies:
+            change = parse_notification(notify.payload)
+
+            if change is not None and change[:2] == (self.league_id, self.season_id):
+                week_numbers.append(change[2])
+
+        if len(week_numbers) > 0:
+            self.on_change(min(week_numbers))
+
+    def _run(self) -> None:
+        connected_before = False
+
+        while not self._stop.is_set():
+            try:
+                conn = self._connect()
+            except (Exception, psycopg2.DatabaseError) as error:
+                print("Error listening for standings: %s" % error)
+                self._stop.wait(RECONNECT_INTERVAL)
+                continue
+
+            # anything loaded while disconnected was missed, so every week is treated as changed
+            if connected_before:
+                self.on_change(1)
+            connected_before = True
+
+            try:
+                self._listen(conn)
+            except (Exception, psycopg2.DatabaseError) as error:
+                print("Error listening for standings: %s" % error)
+            finally:
+                conn.close()
+
+    def _connect(self) -> psycopg2.extensions.connection:
+        conn = psycopg2.connect(self.dsn)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+
+        cursor = conn.cursor()
+        cursor.execute(sql.SQL('LISTEN {}').format(sql.Identifier(self.channel)))
+        cursor.close()
+
+        return conn
+
+    def _listen(self, conn: psycopg2.extensions.connection) -> None:
+        while not self._stop.is_set():
+            # the connection's socket becomes readable once a notification (or an error) arrives
+            if select.select([conn], [], [], WAIT_TIMEOUT) == ([], [], []):
+                continue
+
+            conn.poll()
+
+            notifies = list(conn.notifies)
+            conn.notifies.clear()
+
+            self.handle_notifications(notifies)
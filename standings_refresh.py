@@ -0,0 +1,128 @@
+'''
+Refreshes the app's standings in the background.
+
+Scores only change while games are being played, so the standings are rebuilt every few minutes
+during the NFL's game windows and only occasionally otherwise. Everything derived from the standings
+is built before it's swapped in as a single object, so a request that's in flight keeps reading
+the version it started with.
+'''
+
+import os
+import time
+import threading
+from datetime import datetime
+
+import pytz
+
+
+GAME_DAY_INTERVAL = int(os.environ.get('STANDINGS_REFRESH_GAME_DAY', 5 * 60))
+OFF_DAY_INTERVAL = int(os.environ.get('STANDINGS_REFRESH_OFF_DAY', 6 * 60 * 60))
+
+GAME_TIMEZONE = pytz.timezone('US/Eastern')
+
+# (weekday, start hour, end hour) in Eastern time - Monday is 0. Late games run past midnight
+# and Saturday games are only played late in the season
+GAME_WINDOWS = [(3, 19, 24), (4, 0, 2),    # Thursday night
+                (5, 15, 24), (6, 0, 2),    # Saturday
+                (6, 9, 24), (0, 0, 2),     # Sunday (including London games)
+                (0, 19, 24), (1, 0, 2)]    # Monday night
+
+
+class StandingsState():
+    """ The standings and everything derived from them. Never modified once built """
+
+    def __init__(self, df_standings, current_week_number, table_cache, generation=None):
+        self.df_standings = df_standings
+        self.current_week_number = current_week_number
+        self.table_cache = table_cache
+        self.generation = generation
+        self.built_at = time.time()
+
+
+def standings_changed(state: StandingsState, df_standings, current_week_number: int) -> bool:
+    """ Returns True if the standings differ from the ones in state """
+
+    return not (current_week_number == state.current_week_number and df_standings.equals(state.df_standings))
+
+
+def in_game_window(now: datetime=None) -> bool:
+    """ Returns True if games could be in progress at now (defaults to the current time) """
+
+    if now is None:
+        now = datetime.now(GAME_TIMEZONE)
+    else:
+        now = now.astimezone(GAME_TIMEZONE)
+
+    return any(now.weekday() == weekday and start_hour <= now.hour < end_hour
+               for weekday, start_hour, end_hour in GAME_WINDOWS)
+
+
+def refresh_interval(now: datetime=None) -> int:
+    """ Returns the number of seconds to wait before the next refresh """
+
+    if in_game_window(now):
+        return GAME_DAY_INTERVAL
+
+    return OFF_DAY_INTERVAL
+
+
+class StandingsRefresher():
+
+    def __init__(self, build_state, swap_state, interval=refresh_interval):
+        """
+        build_state returns a new StandingsState (or None if they haven't changed) and swap_state makes it
+        the one being served. interval returns the seconds to wait between refreshes.
+        """
+
+        self.build_state = build_state
+        self.swap_state = swap_state
+        self.interval = interval
+
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def refresh(self) -> bool:
+        """ Builds the standings and swaps them in if they changed. Returns True if they were swapped """
+
+        try:
+            new_state = self.build_state()
+        except Exception as error:
+            # keep serving the current standings if ESPN is down
+            print("Error refreshing standings: %s" % error)
+            return False
+
+        if new_state is None:
+            return False
+
+        self.swap_state(new_state)
+
+        return True
+
+    def start(self, refresh_now: bool=True) -> None:
+        """ Starts refreshing in a daemon thread. refresh_now runs the first refresh right away """
+
+        self._thread = threading.Thread(target=self._run, args=(refresh_now,), daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def wake(self) -> None:
+        """ Runs the next refresh right away rather than waiting out the interval """
+
+        self._wake.set()
+
+    def _run(self, refresh_now: bool) -> None:
+        if refresh_now:
+            self.refresh()
+
+        while True:
+            self._wake.wait(self.interval())
+            self._wake.clear()
+
+            if self._stop.is_set():
+                break
+
+            self.refresh()
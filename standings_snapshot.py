@@ -0,0 +1,265 @@
+'''
+Builds the standings displayed in the app and saves them as a Parquet snapshot.
+
+The app boots from the snapshot so it can start serving right away (and without ESPN
+being up) and then refreshes the standings in the background. Run this module as part
+of the ETL to write a fresh snapshot:
+    python standings_snapshot.py
+
+Heroku's dynos don't share a filesystem, so when a database is configured (see standings_db)
+the snapshot is kept in it where both the ETL and the web dynos can reach it. Otherwise it's
+written to SNAPSHOT_DIR, which only works when the ETL and the app run on the same host.
+'''
+
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import psycopg2
+
+import create_ff_standings
+import create_settings_data
+import standings_db
+import espn_modules  # noqa: F401 - makes espn_scheduler importable
+import espn_scheduler
+
+
+SNAPSHOT_DIR = os.environ.get('STANDINGS_SNAPSHOT_DIR',
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshots'))
+
+CREATE_SNAPSHOT_TABLE = '''
+    CREATE TABLE IF NOT EXISTS STANDINGS_SNAPSHOTS (
+        LEAGUE_ID BIGINT NOT NULL
+        , SEASON_ID SMALLINT NOT NULL
+        , CURRENT_WEEK_NUMBER BIGINT NOT NULL
+        , SNAPSHOT BYTEA NOT NULL
+        , WRITTEN_AT TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        , PRIMARY KEY (LEAGUE_ID, SEASON_ID)
+    )
+'''
+
+# Regular season weeks - the table never displays anything past this
+MAX_WEEK_NUMBER = 14
+
+
+def snapshot_path(league_id, season_id, snapshot_dir=None):
+    """ Returns the path of the snapshot for a league/season """
+
+    if snapshot_dir is None:
+        snapshot_dir = SNAPSHOT_DIR
+
+    return os.path.join(snapshot_dir, f'standings_{league_id}_{season_id}.parquet')
+
+
+def add_table_str_columns(df_standings):
+    """ Returns the standings with string versions of the score metrics so they can be formatted correctly """
+
+    df_standings = df_standings.copy()
+
+    df_standings['cum_score_str'] = df_standings['cum_score'].map('{:,.2f}'.format)
+    df_standings['cum_score_opp_str'] = df_standings['cum_score_opp'].map('{:,.2f}'.format)
+    df_standings['cum_score_per_week_str'] = df_standings['cum_score_per_week'].map('{:,.2f}'.format)
+    df_standings['cum_score_opp_per_week_str'] = df_standings['cum_score_opp_per_week'].map('{:,.2f}'.format)
+    df_standings['cum_all_play_wins_per_week_str'] = df_standings['cum_all_play_wins_per_week'].map('{:,.1f}'.format)
+
+    return df_standings
+
+
+def pull_current_week_number(league_id, season_id):
+    """ Returns the latest completed week, capped so the table only displays regular season standings """
+
+    # need to update this to more effectively assign week numbers
+    try:
+        settings_data = create_settings_data.settingsData(season_id, league_id)
+        current_week_number = settings_data.currentMatchupPeriod - 1
+    except espn_scheduler.EspnUnavailable as error:
+        print("Error pulling the current week: %s" % error)
+        current_week_number = MAX_WEEK_NUMBER
+    except:
+        current_week_number = MAX_WEEK_NUMBER
+
+    if current_week_number > MAX_WEEK_NUMBER:
+        current_week_number = MAX_WEEK_NUMBER
+
+    return current_week_number
+
+
+def build_standings(league_id, season_id, rank_metrics_by_week_range=None, source='espn', from_week_number=None,
+                    df_prior=None):
+    """
+    Returns the standings displayed in the app along with the current week number.
+    source is 'espn' to calculate them from the API or 'db' to read the ones the ETL loaded into SCORES
+    (where they were ranked with the ETL's own rank_metrics_by_week_range). With 'db', passing the
+    standings already being served as df_prior only reads the weeks from from_week_number on
+    """
+
+    if source == 'db' and from_week_number is not None and df_prior is not None:
+        standings = standings_db.read_standings_from_week(league_id, season_id, from_week_number, MAX_WEEK_NUMBER)
+        if standings is None:
+            raise RuntimeError(f'No standings loaded for league {league_id} season {season_id}')
+
+        df_changed, current_week_number = standings
+
+        df_standings = pd.concat([df_prior.loc[df_prior['week_number'] < from_week_number],
+                                  add_table_str_columns(df_changed)], ignore_index=True)
+
+        return df_standings, current_week_number
+
+    if source == 'db':
+        standings = standings_db.read_standings(league_id, season_id, MAX_WEEK_NUMBER)
+        if standings is None:
+            raise RuntimeError(f'No standings loaded for league {league_id} season {season_id}')
+
+        df_standings, current_week_number = standings
+
+        return add_table_str_columns(df_standings), current_week_number
+
+    df_standings = create_ff_standings.create_final_standings(rank_metrics_by_week_range=rank_metrics_by_week_range,
+                                                              league_id=league_id, year=season_id)
+    df_standings = add_table_str_columns(df_standings)
+
+    current_week_number = pull_current_week_number(league_id, season_id)
+
+    return df_standings, current_week_number
+
+
+def snapshot_table(df_standings, current_week_number):
+    """ Returns the standings as an Arrow table with the current week number kept in its metadata """
+
+    table = pa.Table.from_pandas(df_standings, preserve_index=False)
+
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'current_week_number'] = str(current_week_number).encode('utf-8')
+
+    return table.replace_schema_metadata(metadata)
+
+
+def from_snapshot_table(table):
+    """ Returns the standings and current week number saved in a snapshot's Arrow table """
+
+    current_week_number = int(table.schema.metadata[b'current_week_number'])
+
+    return table.to_pandas(), current_week_number
+
+
+def write_snapshot(df_standings, current_week_number, path):
+    """ Writes the standings to a Parquet file. The file is swapped in so readers never see a partial write """
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+    pq.write_table(snapshot_table(df_standings, current_week_number), tmp_path)
+
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path):
+    """ Returns the standings and current week number saved in a snapshot or None if there isn't one """
+
+    try:
+        table = pq.read_table(path)
+    except (OSError, pa.ArrowInvalid):
+        return None
+
+    return from_snapshot_table(table)
+
+
+def write_db_snapshot(df_standings, current_week_number, league_id, season_id, dsn=None):
+    """ Upserts the standings into STANDINGS_SNAPSHOTS as a Parquet file """
+
+    if dsn is None:
+        dsn = standings_db.DATABASE_URL
+
+    sink = pa.BufferOutputStream()
+    pq.write_table(snapshot_table(df_standings, current_week_number), sink)
+    snapshot = sink.getvalue().to_pybytes()
+
+    conn = None
+    try:
+        conn = psycopg2.connect(dsn)
+        cursor = conn.cursor()
+
+        cursor.execute(CREATE_SNAPSHOT_TABLE)
+        cursor.execute('''
+            INSERT INTO STANDINGS_SNAPSHOTS (LEAGUE_ID, SEASON_ID, CURRENT_WEEK_NUMBER, SNAPSHOT)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (LEAGUE_ID, SEASON_ID) DO UPDATE SET
+                CURRENT_WEEK_NUMBER = EXCLUDED.CURRENT_WEEK_NUMBER
+                , SNAPSHOT = EXCLUDED.SNAPSHOT
+                , WRITTEN_AT = NOW()
+        ''', (league_id, season_id, current_week_number, psycopg2.Binary(snapshot)))
+
+        conn.commit()
+        cursor.close()
+    except (Exception, psycopg2.DatabaseError) as error:
+        print("Error: %s" % error)
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def read_db_snapshot(league_id, season_id, dsn=None):
+    """ Returns the standings and current week number saved in STANDINGS_SNAPSHOTS or None if there isn't one """
+
+    if dsn is None:
+        dsn = standings_db.DATABASE_URL
+
+    conn = None
+    try:
+        conn = psycopg2.connect(dsn)
+        cursor = conn.cursor()
+
+        cursor.execute('''SELECT to_regclass('STANDINGS_SNAPSHOTS')''')
+        if cursor.fetchone()[0] is None:
+            return None
+
+        cursor.execute('''
+            SELECT SNAPSHOT
+            FROM STANDINGS_SNAPSHOTS
+            WHERE LEAGUE_ID = %s
+                AND SEASON_ID = %s
+        ''', (league_id, season_id))
+
+        row = cursor.fetchone()
+        cursor.close()
+    except (Exception, psycopg2.DatabaseError) as error:
+        print("Error: %s" % error)
+        return None
+    finally:
+        if conn is not None:
+            conn.close()
+
+    if row is None:
+        return None
+
+    return from_snapshot_table(pq.read_table(pa.BufferReader(bytes(row[0]))))
+
+
+def save_snapshot(df_standings, current_week_number, league_id, season_id):
+    """ Saves the snapshot to the database if one is configured, otherwise to SNAPSHOT_DIR """
+
+    if standings_db.DATABASE_URL is not None:
+        write_db_snapshot(df_standings, current_week_number, league_id, season_id)
+    else:
+        write_snapshot(df_standings, current_week_number, snapshot_path(league_id, season_id))
+
+
+def load_snapshot(league_id, season_id):
+    """ Returns the standings and current week number saved by save_snapshot or None if there isn't one """
+
+    if standings_db.DATABASE_URL is not None:
+        return read_db_snapshot(league_id, season_id)
+
+    return read_snapshot(snapshot_path(league_id, season_id))
+
+
+if __name__ == '__main__':
+    from app_configs import LEAGUE_ID, SEASON_ID, for_rank_metrics_by_week_range, STANDINGS_SOURCE
+
+    df_standings, current_week_number = build_standings(LEAGUE_ID, SEASON_ID, for_rank_metrics_by_week_range,
+                                                        source=STANDINGS_SOURCE)
+
+    save_snapshot(df_standings, current_week_number, LEAGUE_ID, SEASON_ID)
+
+    print(f'Saved {len(df_standings)} rows through week {current_week_number}')
@@ -0,0 +1,107 @@
+'''
+Precomputed standings table data for the app's callbacks.
+
+Each week's rows are converted to the records sent to the DataTable once, when the cache
+is built. Sorting a week then only needs a permutation of those records, and the sorted
+results are kept in an LRU keyed on (week_number, sort_by) so repeated clicks are lookups.
+'''
+
+from functools import lru_cache
+
+
+class StandingsTableCache():
+
+    def __init__(self, df_standings, create_table_df, columns_w_table_names: dict, sort_table_variables: dict,
+                 maxsize: int=512, prior_cache=None, from_week_number: int=None):
+        """
+        create_table_df builds the (default sorted) table for a week, e.g. app.create_df_for_standings_table.
+        sort_table_variables maps the string columns to the numeric columns they should be sorted by.
+        The weeks before from_week_number are taken from prior_cache rather than built again.
+        """
+
+        self.week_numbers = sorted(int(week_number) for week_number in df_standings['week_number'].unique())
+
+        # table name -> the column it's sorted by, so callbacks don't need to map the names back
+        self.sort_columns = {table_name: sort_table_variables.get(column, column)
+                             for column, table_name in columns_w_table_names.items()}
+
+        self._week_records = {}
+        self._week_sort_data = {}
+        self.columns = []
+
+        if prior_cache is not None and from_week_number is not None:
+            self.columns = prior_cache.columns
+
+            for week_number in prior_cache.week_numbers:
+                if week_number < from_week_number and week_number in self.week_numbers:
+                    self._week_records[week_number] = prior_cache._week_records[week_number]
+                    self._week_sort_data[week_number] = prior_cache._week_sort_data[week_number]
+
+        for week_number in self.week_numbers:
+            if week_number in self._week_records:
+                continue
+
+            df_week = df_standings.loc[df_standings['week_number'] == week_number]
+
+            df_table = create_table_df(df_week, week_number)
+            self.columns = list(df_table.columns)
+
+            # keep the sort data in the same order as the records so positions line up
+            df_sort = df_week.loc[df_table.index, sorted(set(self.sort_columns.values()))]
+
+            self._week_records[week_number] = df_table.to_dict('records')
+            self._week_sort_data[week_number] = df_sort.reset_index(drop=True)
+
+        self._sorted_records = lru_cache(maxsize=maxsize)(self._sort_records)
+
+    def records(self, week_number: int, sort_by: list=None) -> list:
+        """
+        Returns the table records for a week sorted by the DataTable's sort_by property, which is
+        a list of dictionaries of the form {'column_id': <table name>, 'direction': <'asc' or 'desc'>}
+        """
+
+        week_number = int(week_number)
+        if week_number not in self._week_records:
+            return []
+
+        if not sort_by:
+            return self._week_records[week_number]
+
+        sort_spec = tuple((col['column_id'], col['direction']) for col in sort_by)
+
+        return self._sorted_records(week_number, sort_spec)
+
+    def clientside_data(self) -> dict:
+        """
+        Returns every week's rows in a compact form for sorting in the browser (see assets/standings_table.js).
+        Each row is a list of the displayed values and each key row is the values to sort those columns by.
+        """
+
+        weeks = {}
+        for week_number in self.week_numbers:
+            df_sort = self._week_sort_data[week_number]
+
+            rows = [[record[column] for column in self.columns] for record in self._week_records[week_number]]
+            keys = df_sort[[self.sort_columns[column] for column in self.columns]].values.tolist()
+
+            weeks[str(week_number)] = {'rows': rows, 'keys': keys}
+
+        return {'columns': self.columns, 'weeks': weeks}
+
+    def cache_info(self):
+        """ Returns the hits/misses of the sorted records LRU """
+
+        return self._sorted_records.cache_info()
+
+    def _sort_records(self, week_number: int, sort_spec: tuple) -> list:
+        """ Returns the week's records in the order given by sort_spec """
+
+        sort_values = [self.sort_columns[column_id] for column_id, _ in sort_spec]
+        sort_asc = [direction == 'asc' for _, direction in sort_spec]
+
+        df_sort = self._week_sort_data[week_number]
+        order = df_sort.sort_values(sort_values, ascending=sort_asc, kind='mergesort').index
+
+        week_records = self._week_records[week_number]
+
+        return [week_records[i] for i in order]